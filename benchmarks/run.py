@@ -0,0 +1,404 @@
+"""
+Load and latency benchmark for every view in store/urls.py.
+
+Seeds a fresh database, starts gunicorn with the project's gunicorn.conf.py
+against it and drives each URL with concurrent clients, including logged-in
+cart and checkout flows.  Reports p50/p95/p99 latency, requests per second
+and database queries per request (read from the Server-Timing header), and
+saves the results as JSON so runs can be compared:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --compare benchmarks/results/<earlier run>.json
+
+With --compare, scenarios whose p95 or throughput got worse by more than
+--threshold percent, or which now run more queries, are flagged and the
+script exits with status 1.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import quote, urlencode, urlsplit
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = BASE_DIR / 'benchmarks' / 'results'
+PASSWORD = 'bench-password-123'
+METRICS_TOKEN = 'benchmark'
+
+# Adds an unlimited discount code and prints what the scenarios need as JSON
+SETUP_SCRIPT = '''
+import json
+from datetime import timedelta
+from django.utils import timezone
+from store.models import Category, DiscountCode, Product, User
+now = timezone.now()
+DiscountCode.objects.create(code='BENCH10', discount_percent=10, max_usage=10 ** 9,
+                            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=365))
+print(json.dumps({
+    'product_ids': list(Product.objects.filter(is_available=True).values_list('id', flat=True)),
+    'category_slugs': list(Category.objects.values_list('slug', flat=True)),
+    'usernames': list(User.objects.filter(username__startswith='bench').values_list('username', flat=True)),
+}))
+'''
+
+_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class Client:
+    """A minimal cookie-keeping HTTP client; one per simulated shopper."""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookies = {}
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def request(self, method, path, data=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        body = None
+        if data is not None:
+            data = dict(data)
+            if 'csrftoken' in self.cookies:
+                data['csrfmiddlewaretoken'] = self.cookies['csrftoken']
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            # Workers close keep-alive connections when they are recycled
+            self.connection.close()
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+        elapsed = time.perf_counter() - started
+
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                if morsel['max-age'] == '0' or not morsel.value or morsel.value == '""':
+                    self.cookies.pop(name, None)
+                else:
+                    self.cookies[name] = morsel.value
+        match = _QUERIES.search(response.headers.get('Server-Timing', ''))
+        return response.status, response.headers, elapsed, int(match.group(1)) if match else None
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, data=None, **kwargs):
+        return self.request('POST', path, data=data or {}, **kwargs)
+
+    def login(self, username):
+        self.get('/login/')
+        status = self.post('/login/', {'username': username, 'password': PASSWORD})[0]
+        if status != 302:
+            raise RuntimeError(f'Login as {username} failed with HTTP {status}')
+
+
+class Scenario:
+    """One URL under test.
+
+    ``prepare`` runs untimed before every request (e.g. filling the cart
+    before a checkout); ``request`` returns the (method, path, data) to time.
+    """
+
+    def __init__(self, name, request, prepare=None, login=False, expect=(200,)):
+        self.name = name
+        self.request = request
+        self.prepare = prepare
+        self.login = login
+        self.expect = expect
+
+
+def build_scenarios(data):
+    products = data['product_ids']
+    category = quote(data['category_slugs'][0])
+
+    def product():
+        return random.choice(products)
+
+    def fill_cart(client, count=3):
+        for product_id in random.sample(products, count):
+            client.post(f'/cart/add/{product_id}/')
+
+    def fill_cart_once(client):
+        if not getattr(client, 'cart_filled', False):
+            fill_cart(client, 5)
+            client.cart_filled = True
+
+    def checkout(client):
+        # The cart page issues a fresh key; any well-formed one will do here
+        client.checkout_key = secrets.token_urlsafe(24)
+        return ('POST', '/checkout/', {'idempotency_key': client.checkout_key})
+
+    def remember_order(client):
+        # Checkout once so there is an order to confirm
+        if not getattr(client, 'order_path', None):
+            fill_cart(client)
+            _, headers, _, _ = client.request(*checkout(client))
+            client.order_path = urlsplit(headers.get('Location', '')).path
+
+    def csrf_cookie(client):
+        if 'csrftoken' not in client.cookies:
+            client.get('/contact/')
+
+    def apply_discount(client):
+        client.post('/cart/apply-discount/', {'discount_code': 'BENCH10'})
+
+    return [
+        Scenario('debug_urls', lambda c: ('GET', '/debug-urls/', None)),
+        Scenario('home', lambda c: ('GET', '/', None)),
+        Scenario('products', lambda c: ('GET', '/products/', None)),
+        Scenario('products_filtered', lambda c: (
+            'GET', f'/products/?search={quote("ارگانیک")}&category={category}&price_min=1000', None
+        )),
+        Scenario('product_detail', lambda c: ('GET', f'/product/{product()}/', None)),
+        Scenario('about', lambda c: ('GET', '/about/', None)),
+        Scenario('contact', lambda c: ('GET', '/contact/', None)),
+        Scenario('contact_submit', lambda c: ('POST', '/contact/', {
+            'name': 'بنچمارک', 'email': 'bench@example.com', 'subject': 'سلام',
+            'message': 'پیام آزمایشی برای سنجش کارایی',
+        }), prepare=csrf_cookie, expect=(302,)),
+        Scenario('register_form', lambda c: ('GET', '/register/', None)),
+        Scenario('login_form', lambda c: ('GET', '/login/', None)),
+        Scenario('cart', lambda c: ('GET', '/cart/', None), prepare=fill_cart_once, login=True),
+        Scenario('add_to_cart', lambda c: ('POST', f'/cart/add/{product()}/', {}), login=True, expect=(302,)),
+        Scenario('update_cart', lambda c: ('POST', f'/cart/update/{c.last_product}/', {'action': 'increase'}),
+                 prepare=lambda c: _add_one(c, product()), login=True, expect=(302,)),
+        Scenario('remove_from_cart', lambda c: ('GET', f'/cart/remove/{c.last_product}/', None),
+                 prepare=lambda c: _add_one(c, product()), login=True, expect=(302,)),
+        Scenario('clear_cart', lambda c: ('POST', '/cart/clear/', {}),
+                 prepare=lambda c: fill_cart(c, 2), login=True, expect=(302,)),
+        Scenario('apply_discount', lambda c: ('POST', '/cart/apply-discount/', {'discount_code': 'BENCH10'}),
+                 login=True, expect=(302,)),
+        Scenario('remove_discount', lambda c: ('GET', '/cart/remove-discount/', None),
+                 prepare=apply_discount, login=True, expect=(302,)),
+        Scenario('checkout', checkout, prepare=fill_cart, login=True, expect=(302,)),
+        # A double submit: the same key again finds the first order
+        Scenario('checkout_retry', lambda c: ('POST', '/checkout/', {'idempotency_key': c.checkout_key}),
+                 prepare=remember_order, login=True, expect=(302,)),
+        Scenario('order_confirmation', lambda c: ('GET', c.order_path, None),
+                 prepare=remember_order, login=True),
+        Scenario('profile', lambda c: ('GET', '/profile/', None), login=True),
+        Scenario('logout', lambda c: ('GET', '/logout/', None),
+                 prepare=lambda c: c.login(c.username), expect=(302,)),
+        Scenario('metrics', lambda c: ('GET', '/metrics/', None)),
+    ]
+
+
+def _add_one(client, product_id):
+    client.post(f'/cart/add/{product_id}/')
+    client.last_product = product_id
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(scenario, clients, requests_per_client, warmup):
+    latencies = []
+    queries = []
+    errors = []
+    throughput = []
+    lock = threading.Lock()
+
+    def worker(client):
+        busy = 0.0
+        for iteration in range(warmup + requests_per_client):
+            if scenario.prepare:
+                scenario.prepare(client)
+            method, path, data = scenario.request(client)
+            headers = {'Authorization': f'Bearer {METRICS_TOKEN}'} if scenario.name == 'metrics' else None
+            status, _, elapsed, query_count = client.request(method, path, data=data, headers=headers)
+            if iteration < warmup:
+                continue
+            busy += elapsed
+            with lock:
+                latencies.append(elapsed)
+                if query_count is not None:
+                    queries.append(query_count)
+                if status not in scenario.expect:
+                    errors.append(status)
+        # Untimed prepare steps don't count against throughput
+        with lock:
+            throughput.append(requests_per_client / busy if busy else 0)
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_statuses': sorted(set(errors)),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'requests_per_second': round(sum(throughput), 1),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/about/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + threshold / 100):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current['requests_per_second'] < previous['requests_per_second'] * (1 - threshold / 100):
+            regressions.append(
+                f"{name}: {previous['requests_per_second']} -> {current['requests_per_second']} req/s"
+            )
+        if (previous.get('max_queries') is not None and current.get('max_queries') is not None
+                and current['max_queries'] > previous['max_queries']):
+            regressions.append(f"{name}: queries {previous['max_queries']} -> {current['max_queries']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the generated data')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=25, help='Timed requests per client per scenario')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per client per scenario')
+    parser.add_argument('--workers', type=int, help='gunicorn workers (default: gunicorn.conf.py)')
+    parser.add_argument('--only', nargs='*', help='Run only these scenarios')
+    parser.add_argument('--output', type=Path, help='Where to save the JSON results')
+    parser.add_argument('--compare', type=Path, help='Earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Regression threshold in percent')
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='tarla-bench-'))
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{workdir / "db.sqlite3"}',
+        CACHE_DIR=str(workdir / 'cache'),
+        METRICS_DIR=str(workdir / 'metrics'),
+        METRICS_TOKEN=METRICS_TOKEN,
+        SERVER_TIMING_PUBLIC='1',
+        THROTTLE_ENABLED='0',
+        SLOW_REQUEST_THRESHOLD_MS='600000',
+    )
+    server = None
+    try:
+        print(f'Seeding {args.products} products and {args.orders} orders in {workdir}')
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '-v0'], cwd=BASE_DIR, env=env, check=True)
+        users = max(args.concurrency * 2, 10)
+        # Plenty of stock so checkouts never run out mid-benchmark
+        subprocess.run(
+            [sys.executable, 'manage.py', 'seed_store', '--products', str(args.products),
+             '--orders', str(args.orders), '--users', str(users), '--seed', str(args.seed),
+             '--stock', '1000000', '--user-prefix', 'bench', '--password', PASSWORD],
+            cwd=BASE_DIR, env=env, check=True,
+        )
+        data = json.loads(subprocess.run(
+            [sys.executable, 'manage.py', 'shell', '-v0', '-c', SETUP_SCRIPT],
+            cwd=BASE_DIR, env=env, check=True, capture_output=True, text=True,
+        ).stdout.strip().splitlines()[-1])
+
+        port = free_port()
+        command = ['gunicorn', 'tarla.wsgi:application', '-c', 'gunicorn.conf.py',
+                   '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+        if args.workers:
+            command += ['--workers', str(args.workers)]
+        server = subprocess.Popen(command, cwd=BASE_DIR, env=env)
+        wait_until_up(port, server)
+
+        results = {}
+        for scenario in build_scenarios(data):
+            if args.only and scenario.name not in args.only:
+                continue
+            clients = [Client(port) for _ in range(args.concurrency)]
+            for client, username in zip(clients, data['usernames']):
+                client.username = username
+                if scenario.login:
+                    client.login(client.username)
+            results[scenario.name] = result = run_scenario(scenario, clients, args.requests, args.warmup)
+            print(
+                f"{scenario.name:20} p50 {result['p50_ms']:8.1f}ms  p95 {result['p95_ms']:8.1f}ms  "
+                f"p99 {result['p99_ms']:8.1f}ms  {result['requests_per_second']:7.1f} req/s  "
+                f"{result['queries_per_request'] if result['queries_per_request'] is not None else '-':>6} q/req"
+                + (f"  {result['errors']} errors {result['error_statuses']}" if result['errors'] else '')
+            )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                            capture_output=True, text=True).stdout.strip()
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'run'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f'Saved results to {output}')
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('Regressions against', args.compare)
+            for line in regressions:
+                print('  ' + line)
+            sys.exit(1)
+        print('No regressions against', args.compare)
+
+
+if __name__ == '__main__':
+    main()
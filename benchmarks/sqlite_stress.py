@@ -0,0 +1,141 @@
+"""
+Concurrent-writer stress test for the SQLite profile.
+
+Starts several worker processes, like gunicorn's, against one fresh SQLite
+file.  Each one repeatedly saves a session, reserves stock for it and
+records a stock movement, the write mix of browsing and add-to-cart.
+"database is locked" errors are counted, once with SQLITE_PROFILE=0 (SQLite's
+defaults) and once with the profile from settings.py:
+
+    python benchmarks/sqlite_stress.py --workers 3 --iterations 200
+
+Exits with status 1 if the profile run hit any lock errors.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+SETUP_SCRIPT = '''
+from store.models import Category, Product, StockMovement
+category = Category.objects.create(name='آزمون فشار')
+products = Product.objects.bulk_create([
+    Product(name=f'محصول {i}', price=10000, image='products/placeholder.jpg',
+            category=category, stock_quantity=1000000)
+    for i in range(20)
+])
+StockMovement.objects.bulk_create([
+    StockMovement(product=product, kind=StockMovement.RECEIPT, quantity=1000000) for product in products
+])
+'''
+
+
+def worker(iterations, start_at):
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tarla.settings')
+    import django
+    django.setup()
+
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.db import OperationalError
+
+    from store import inventory
+    from store.models import Product, StockMovement
+
+    products = list(Product.objects.all())
+    rng = random.Random(os.getpid())
+    done = locked = 0
+    time.sleep(max(0, start_at - time.time()))
+    started = time.perf_counter()
+    for _ in range(iterations):
+        product = rng.choice(products)
+        try:
+            session = SessionStore()
+            session['cart'] = {str(product.pk): {'quantity': 1}}
+            session.save()
+            inventory.reserve(session.session_key, product, 1)
+            inventory.record_movement(product.pk, StockMovement.ADJUSTMENT, 1, note='stress')
+            Product.objects.filter(pk=product.pk).values_list('stock_quantity', flat=True).get()
+            done += 1
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    print(json.dumps({'done': done, 'locked': locked, 'seconds': time.perf_counter() - started}))
+
+
+def run(workers, iterations, profile):
+    workdir = Path(tempfile.mkdtemp(prefix='tarla-sqlite-'))
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{workdir / "db.sqlite3"}',
+        CACHE_DIR=str(workdir / 'cache'),
+        SQLITE_PROFILE='1' if profile else '0',
+    )
+    manage = [sys.executable, 'manage.py']
+    try:
+        subprocess.run(manage + ['migrate', '-v0'], cwd=BASE_DIR, env=env, check=True)
+        subprocess.run(manage + ['shell', '-v0', '-c', SETUP_SCRIPT], cwd=BASE_DIR, env=env, check=True)
+
+        # Workers need a moment to import Django; start them all at the same time
+        start_at = time.time() + 3
+        processes = [
+            subprocess.Popen(
+                [sys.executable, __file__, '--worker', '--iterations', str(iterations),
+                 '--start-at', str(start_at)],
+                cwd=BASE_DIR, env=env, stdout=subprocess.PIPE, text=True,
+            )
+            for _ in range(workers)
+        ]
+        results = []
+        for process in processes:
+            output, _ = process.communicate()
+            if process.returncode:
+                raise RuntimeError(f'Worker exited with status {process.returncode}')
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    done = sum(result['done'] for result in results)
+    return {
+        'profile': profile,
+        'done': done,
+        'locked': sum(result['locked'] for result in results),
+        'writes_per_second': round(done / max(result['seconds'] for result in results), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=200, help='Write cycles per worker')
+    parser.add_argument('--profile-only', action='store_true', help='Skip the run with SQLite defaults')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.iterations, args.start_at)
+        return
+
+    modes = [True] if args.profile_only else [False, True]
+    failed = False
+    for profile in modes:
+        result = run(args.workers, args.iterations, profile)
+        print(
+            f"{'profile' if profile else 'defaults':8}  {result['done']:6} write cycles  "
+            f"{result['locked']:5} lock errors  {result['writes_per_second']:8.1f} cycles/s"
+        )
+        failed = failed or (profile and result['locked'] > 0)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
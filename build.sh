@@ -7,8 +7,15 @@ source venv/bin/activate
 # Apply migrations
 python manage.py migrate
 
+# Build the CSS bundles, fonts and icon subset
+npm install --no-audit --no-fund
+python manage.py build_assets
+
 # Collect static files
 python manage.py collectstatic --noinput
 
+# Start the background job worker (emails); it stops cleanly on SIGTERM
+python manage.py run_worker &
+
 # Start Gunicorn
 exec gunicorn tarla.wsgi:application --config gunicorn.conf.py
\ No newline at end of file
@@ -6,4 +6,33 @@ worker_connections = 1000
 timeout = 30
 max_requests = 1000
 max_requests_jitter = 100
-preload_app = True
\ No newline at end of file
+preload_app = True
+
+# Metrics: every worker writes its own file in METRICS_DIR (see store/metrics.py)
+import os
+import shutil
+import tempfile
+
+metrics_dir = os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'tarla-metrics'))
+
+
+def on_starting(server):
+    # Counters start from zero on each deploy, not on each worker recycle
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from store.metrics import merge_worker_file
+    merge_worker_file(metrics_dir, worker.pid)
+
+
+# Product view counters are buffered per worker (see store/counters.py)
+def post_worker_init(worker):
+    from store import counters
+    counters.start_flusher()
+
+
+def worker_exit(server, worker):
+    from store import counters
+    counters.stop_flusher()
@@ -0,0 +1,66 @@
+// Fills in the per-visitor parts of a public page (see PublicPageMiddleware):
+// the CSRF token for its forms, the cart badge, messages and account link.
+(function () {
+    const script = document.currentScript;
+
+    const messageClasses = {
+        error: ['error-message', 'fa-exclamation-triangle'],
+        success: ['success-message', 'fa-check-circle'],
+        warning: ['warning-message', 'fa-exclamation-circle'],
+    };
+
+    function showMessages(messages) {
+        if (!messages.length) {
+            return;
+        }
+        const container = document.createElement('div');
+        container.id = 'messages';
+        container.className = 'fixed top-20 right-4 z-50 space-y-2 max-w-sm';
+        messages.forEach(message => {
+            const [boxClass, iconClass] = messageClasses[message.tags] || ['glass', 'fa-info-circle'];
+            const box = document.createElement('div');
+            box.className = `rounded-lg p-4 text-white flex items-center ${boxClass}`;
+            const icon = document.createElement('i');
+            icon.className = `fas ${iconClass} ml-2`;
+            box.append(icon, message.text);
+            container.append(box);
+        });
+        document.body.append(container);
+        setTimeout(() => {
+            container.style.transition = 'opacity 0.5s';
+            container.style.opacity = '0';
+            setTimeout(() => container.remove(), 500);
+        }, 5000);
+    }
+
+    function apply(state) {
+        document.querySelectorAll('input[data-csrf-field]').forEach(input => {
+            input.value = state.csrf_token;
+        });
+
+        const badge = document.getElementById('cart-badge');
+        if (badge && state.cart_items_count > 0) {
+            badge.textContent = state.cart_items_count;
+            badge.classList.remove('hidden');
+        }
+
+        const account = document.getElementById('account-link');
+        if (account && state.username) {
+            account.href = state.profile_url;
+            account.querySelector('span').textContent = state.username;
+        }
+
+        showMessages(state.messages);
+    }
+
+    fetch(script.dataset.url, {credentials: 'same-origin', headers: {'Accept': 'application/json'}})
+        .then(response => response.ok ? response.json() : Promise.reject(response.status))
+        .then(state => {
+            if (document.readyState === 'loading') {
+                document.addEventListener('DOMContentLoaded', () => apply(state));
+            } else {
+                apply(state);
+            }
+        })
+        .catch(error => console.warn('Could not load session state', error));
+})();
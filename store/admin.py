@@ -1,21 +1,38 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.models import Group
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
+from django.db.models import OuterRef, Subquery, Sum
 from django.urls import reverse
-from .models import Product, SiteSettings, Category, UserProfile, Order, OrderItem, DiscountCode
+from django.utils import timezone
+from datetime import timedelta
+from .models import (
+    Product, SiteSettings, Category, UserProfile, Order, OrderItem, DiscountCode, StockMovement, Job,
+    ProductCounter, OrderStatusChange, ArchivedOrder,
+)
+from . import archive, catalog, discounts, inventory, orders
 
 # Unregister default Group
 admin.site.unregister(Group)
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'is_active', 'created_at', 'admin_actions']
+    list_display = ['tree_name', 'slug', 'is_active', 'created_at', 'admin_actions']
     list_filter = ['is_active', 'created_at']
-    search_fields = ['name', 'description']
+    search_fields = ['name', 'slug', 'description']
     list_editable = ['is_active']
     readonly_fields = ['created_at']
+    prepopulated_fields = {'slug': ('name',)}
+    list_select_related = ['parent']
+    # Materialized paths sort each category right after its parent
+    ordering = ['path']
     actions = ['delete_selected']
     
+    def tree_name(self, obj):
+        return '— ' * obj.depth + obj.name
+    tree_name.short_description = 'Name'
+    tree_name.admin_order_field = 'path'
+    
     def admin_actions(self, obj):
         return format_html(
             '<a class="button" href="{}">Edit</a>&nbsp;'
@@ -27,10 +44,10 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'price', 'category', 'stock_quantity', 'is_featured', 'is_available', 'created_at', 'admin_actions']
+    list_display = ['name', 'price', 'category', 'stock_quantity', 'popularity_score', 'views_30d', 'cart_adds_30d', 'is_featured', 'is_available', 'created_at', 'admin_actions']
     list_filter = ['category', 'is_featured', 'is_available', 'created_at']
     search_fields = ['name', 'description']
-    list_editable = ['price', 'stock_quantity', 'is_featured', 'is_available']
+    list_editable = ['price', 'is_featured', 'is_available']
     readonly_fields = ['created_at']
     actions = ['delete_selected', 'make_featured', 'make_unavailable']
     fieldsets = (
@@ -55,12 +72,58 @@ class ProductAdmin(admin.ModelAdmin):
         )
     admin_actions.short_description = 'Actions'
     
+    def get_queryset(self, request):
+        # Last 30 days of the buffered counters, one subquery per column so
+        # the changelist page needs no GROUP BY over products
+        since = timezone.localdate() - timedelta(days=30)
+        recent = ProductCounter.objects.filter(product=OuterRef('pk'), day__gte=since).values('product')
+        return super().get_queryset(request).annotate(
+            views_30d=Subquery(recent.annotate(total=Sum('views')).values('total')),
+            cart_adds_30d=Subquery(recent.annotate(total=Sum('cart_adds')).values('total')),
+        )
+    
+    def views_30d(self, obj):
+        return obj.views_30d or 0
+    views_30d.short_description = 'Views (30 days)'
+    views_30d.admin_order_field = 'views_30d'
+    
+    def cart_adds_30d(self, obj):
+        return obj.cart_adds_30d or 0
+    cart_adds_30d.short_description = 'Cart adds (30 days)'
+    cart_adds_30d.admin_order_field = 'cart_adds_30d'
+    
+    def get_readonly_fields(self, request, obj=None):
+        # Stock only changes through the ledger once the product exists
+        if obj is not None:
+            return self.readonly_fields + ['stock_quantity']
+        return self.readonly_fields
+    
+    def save_model(self, request, obj, form, change):
+        if change:
+            # Only write what was edited: saving the whole row would put back
+            # the stock_quantity loaded with the form over sales made since
+            fields = [name for name in form.changed_data if name != 'stock_quantity']
+            if fields:
+                obj.save(update_fields=fields)
+            return
+        initial_stock = obj.stock_quantity
+        obj.stock_quantity = 0
+        super().save_model(request, obj, form, change)
+        if initial_stock:
+            inventory.record_movement(
+                obj.pk, StockMovement.RECEIPT, initial_stock,
+                note='موجودی اولیه', user=request.user
+            )
+            obj.stock_quantity = initial_stock
+    
     def make_featured(self, request, queryset):
         queryset.update(is_featured=True)
+        catalog.bump()
     make_featured.short_description = "Mark selected products as featured"
     
     def make_unavailable(self, request, queryset):
         queryset.update(is_available=False)
+        catalog.bump()
     make_unavailable.short_description = "Mark selected products as unavailable"
 
 @admin.register(SiteSettings)
@@ -108,9 +171,13 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'user', 'total_price', 'status', 'created_at', 'admin_actions']
     list_filter = ['status', 'created_at']
     search_fields = ['order_number', 'user__username']
-    readonly_fields = ['created_at', 'updated_at']
-    list_editable = ['status']
-    actions = ['delete_selected', 'mark_as_processing', 'mark_as_shipped', 'mark_as_delivered']
+    # Status only changes through the actions below, which check the
+    # transition and keep stock and the history in step
+    readonly_fields = ['status', 'created_at', 'updated_at']
+    actions = [
+        'delete_selected', 'mark_as_paid', 'mark_as_processing', 'mark_as_shipped', 'mark_as_delivered',
+        'mark_as_cancelled',
+    ]
     
     def admin_actions(self, obj):
         return format_html(
@@ -123,17 +190,37 @@ class OrderAdmin(admin.ModelAdmin):
         )
     admin_actions.short_description = 'Actions'
     
+    def _transition(self, request, queryset, status):
+        selected = queryset.count()
+        moved = orders.transition(queryset, status, user=request.user)
+        label = dict(Order.STATUS_CHOICES)[status]
+        self.message_user(request, f'{moved} سفارش به وضعیت «{label}» رفت.')
+        if moved < selected:
+            self.message_user(
+                request,
+                f'{selected - moved} سفارش در وضعیتی بود که نمی‌تواند به «{label}» برود و تغییر نکرد.',
+                messages.WARNING,
+            )
+    
+    def mark_as_paid(self, request, queryset):
+        self._transition(request, queryset, 'paid')
+    mark_as_paid.short_description = "Mark selected orders as paid"
+    
     def mark_as_processing(self, request, queryset):
-        queryset.update(status='processing')
+        self._transition(request, queryset, 'processing')
     mark_as_processing.short_description = "Mark selected orders as processing"
     
     def mark_as_shipped(self, request, queryset):
-        queryset.update(status='shipped')
+        self._transition(request, queryset, 'shipped')
     mark_as_shipped.short_description = "Mark selected orders as shipped"
     
     def mark_as_delivered(self, request, queryset):
-        queryset.update(status='delivered')
+        self._transition(request, queryset, 'delivered')
     mark_as_delivered.short_description = "Mark selected orders as delivered"
+    
+    def mark_as_cancelled(self, request, queryset):
+        self._transition(request, queryset, 'cancelled')
+    mark_as_cancelled.short_description = "Cancel selected orders and restock their items"
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
@@ -175,14 +262,156 @@ class DiscountCodeAdmin(admin.ModelAdmin):
     is_valid.short_description = 'معتبر'
     
     def activate_codes(self, request, queryset):
+        codes = list(queryset.values_list('code', flat=True))
         queryset.update(is_active=True)
+        discounts.invalidate(*codes)
     activate_codes.short_description = "Activate selected discount codes"
     
     def deactivate_codes(self, request, queryset):
+        codes = list(queryset.values_list('code', flat=True))
         queryset.update(is_active=False)
+        discounts.invalidate(*codes)
     deactivate_codes.short_description = "Deactivate selected discount codes"
 
+class StockMovementForm(forms.ModelForm):
+    kind = forms.ChoiceField(
+        choices=[
+            (StockMovement.RECEIPT, 'ورود به انبار'),
+            (StockMovement.ADJUSTMENT, 'اصلاح دستی'),
+        ],
+        label='نوع'
+    )
+    
+    class Meta:
+        model = StockMovement
+        fields = ['product', 'kind', 'quantity', 'note']
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        product = cleaned_data.get('product')
+        quantity = cleaned_data.get('quantity')
+        if quantity == 0:
+            self.add_error('quantity', 'تغییر موجودی نمی‌تواند صفر باشد.')
+        elif product and quantity is not None and product.stock_quantity + quantity < 0:
+            self.add_error('quantity', f'موجودی فعلی {product.stock_quantity} عدد است.')
+        if cleaned_data.get('kind') == StockMovement.RECEIPT and quantity is not None and quantity < 0:
+            self.add_error('quantity', 'ورود به انبار باید مثبت باشد.')
+        return cleaned_data
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    form = StockMovementForm
+    list_display = ['product', 'kind', 'quantity', 'order', 'note', 'created_by', 'created_at']
+    list_filter = ['kind', 'created_at']
+    search_fields = ['product__name', 'order__order_number', 'note']
+    raw_id_fields = ['product', 'order']
+    date_hierarchy = 'created_at'
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def save_model(self, request, obj, form, change):
+        # The ledger is append-only; new rows go through inventory so the
+        # product balance moves with them
+        try:
+            movement = inventory.record_movement(
+                obj.product_id, obj.kind, obj.quantity,
+                note=obj.note, user=request.user
+            )
+        except inventory.InsufficientStock:
+            messages.error(request, 'موجودی محصول برای این کاهش کافی نیست.')
+            return
+        obj.pk = movement.pk
+        # Restocks should show up on the storefront right away
+        catalog.bump()
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    search_fields = ['name', 'last_error']
+    readonly_fields = [
+        'name', 'payload', 'status', 'attempts', 'max_attempts', 'run_at',
+        'locked_at', 'locked_by', 'last_error', 'created_at', 'finished_at',
+    ]
+    date_hierarchy = 'created_at'
+    actions = ['retry_jobs']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def retry_jobs(self, request, queryset):
+        updated = queryset.exclude(status=Job.RUNNING).update(
+            status=Job.QUEUED, attempts=0, run_at=timezone.now(), finished_at=None
+        )
+        self.message_user(request, f'{updated} کار دوباره در صف قرار گرفت.')
+    retry_jobs.short_description = 'Retry selected jobs'
+
+@admin.register(ProductCounter)
+class ProductCounterAdmin(admin.ModelAdmin):
+    list_display = ['product', 'day', 'views', 'cart_adds']
+    list_filter = ['day']
+    search_fields = ['product__name']
+    list_select_related = ['product']
+    readonly_fields = ['product', 'day', 'views', 'cart_adds']
+    date_hierarchy = 'day'
+    
+    def has_add_permission(self, request):
+        return False
+
 # Custom admin site title
 admin.site.site_header = "پنل مدیریت تارلا ارگانیک"
 admin.site.site_title = "تارلا ارگانیک"
-admin.site.index_title = "مدیریت فروشگاه"
\ No newline at end of file
+admin.site.index_title = "مدیریت فروشگاه"
+
+@admin.register(OrderStatusChange)
+class OrderStatusChangeAdmin(admin.ModelAdmin):
+    list_display = ['order', 'from_status', 'to_status', 'changed_by', 'changed_at']
+    list_filter = ['to_status', 'changed_at']
+    search_fields = ['order__order_number']
+    list_select_related = ['order', 'changed_by']
+    date_hierarchy = 'changed_at'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['order_number', 'user', 'final_price', 'status', 'created_at', 'archived_at']
+    list_filter = ['status', 'archived_at']
+    search_fields = ['order_number', 'user__username']
+    list_select_related = ['user']
+    date_hierarchy = 'created_at'
+    fields = [
+        'order_number', 'user', 'status', 'total_price', 'shipping_cost', 'final_price',
+        'created_at', 'updated_at', 'archived_at', 'items',
+    ]
+    readonly_fields = fields
+    
+    def items(self, obj):
+        return format_html(
+            '<table>{}</table>',
+            format_html_join(
+                '', '<tr><td>{}</td><td>{} × {}</td><td>{}</td></tr>',
+                ((item.product.name, item.quantity, item.price, item.total) for item in archive.items(obj)),
+            ),
+        )
+    items.short_description = 'Items'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
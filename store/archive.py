@@ -0,0 +1,258 @@
+"""
+Archiving of old, finished orders.
+
+Delivered and cancelled orders older than ORDER_ARCHIVE_AFTER_DAYS are moved
+from Order, OrderItem and OrderStatusChange into one ArchivedOrder row each,
+whose payload holds the items and history as zlib-compressed JSON.  Each
+batch is its own short transaction, so the tables are never locked for long.
+The stock ledger keeps its movements; only their link to the order is
+cleared, and ``restore()`` puts it back.  The product pairs of archived
+orders are added up in ArchivedCooccurrence, so the recommendations still
+count them.
+
+Archived orders are read through ``items()``, which takes product names and
+images from the catalog snapshot, so showing them costs no extra queries.
+"""
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Case, DateTimeField, IntegerField, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import catalog, recommendations
+from .models import (
+    ArchivedCooccurrence, ArchivedOrder, Order, OrderItem, OrderStatusChange, Product, StockMovement,
+)
+
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+BATCH_SIZE = 500
+
+
+class ArchivedItem:
+    """An OrderItem stand-in for templates; ``product`` may be a catalog record."""
+    __slots__ = ('product', 'quantity', 'price')
+
+    def __init__(self, product, quantity, price):
+        self.product = product
+        self.quantity = quantity
+        self.price = price
+
+    @property
+    def total(self):
+        return self.quantity * self.price
+
+
+def pack(data):
+    return zlib.compress(json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode(), 9)
+
+
+def unpack(payload):
+    return json.loads(zlib.decompress(bytes(payload)))
+
+
+def items(archived_order):
+    data = unpack(archived_order.payload)
+    snapshot = catalog.snapshot()
+    return [
+        # Products no longer on sale keep the name they had
+        ArchivedItem(snapshot.get(product_id) or Product(id=product_id, name=name), quantity, price)
+        for product_id, name, quantity, price in data['items']
+    ]
+
+
+def with_items(archived_orders, preview=None):
+    """Attach what the order history shows to each archived order."""
+    for archived_order in archived_orders:
+        archived_order.order_items = items(archived_order)
+        archived_order.preview_items = archived_order.order_items[:preview]
+        archived_order.item_count = len(archived_order.order_items)
+        archived_order.quantity_total = sum(item.quantity for item in archived_order.order_items)
+    return archived_orders
+
+
+def archive(days=None, batch_size=BATCH_SIZE):
+    """Archive finished orders placed more than ``days`` ago; returns how many."""
+    if days is None:
+        days = getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 180)
+    cutoff = timezone.now() - timedelta(days=days)
+    archived = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            orders = list(
+                Order.objects.select_for_update()
+                .filter(pk__gt=last_pk, status__in=ARCHIVABLE_STATUSES, created_at__lt=cutoff)
+                .order_by('pk')[:batch_size]
+            )
+            if not orders:
+                return archived
+            last_pk = orders[-1].pk
+            archived += _archive_batch(orders)
+
+
+def _archive_batch(orders):
+    ids = [order.pk for order in orders]
+    data = {order.pk: {'items': [], 'status_changes': [], 'stock_movements': []} for order in orders}
+    for order_id, product_id, name, quantity, price in (
+        OrderItem.objects.filter(order_id__in=ids).order_by('pk')
+        .values_list('order_id', 'product_id', 'product__name', 'quantity', 'price')
+    ):
+        data[order_id]['items'].append([product_id, name, quantity, price])
+    for order_id, *change in (
+        OrderStatusChange.objects.filter(order_id__in=ids).order_by('pk')
+        .values_list('order_id', 'from_status', 'to_status', 'changed_by_id', 'changed_at')
+    ):
+        data[order_id]['status_changes'].append(change)
+    for order_id, movement_id in StockMovement.objects.filter(order_id__in=ids).values_list('order_id', 'pk'):
+        data[order_id]['stock_movements'].append(movement_id)
+
+    ArchivedOrder.objects.bulk_create([
+        ArchivedOrder(
+            id=order.pk,
+            user_id=order.user_id,
+            order_number=order.order_number,
+            total_price=order.total_price,
+            shipping_cost=order.shipping_cost,
+            final_price=order.final_price,
+            status=order.status,
+            created_at=order.created_at,
+            updated_at=order.updated_at,
+            payload=pack(data[order.pk]),
+        )
+        for order in orders
+    ])
+    _add_cooccurrences(_cooccurrences(orders, data))
+    # Cascades to the items and history; stock movements are kept, unlinked
+    Order.objects.filter(pk__in=ids).delete()
+    return len(orders)
+
+
+def _cooccurrences(orders, data, products=None):
+    # Both callers lock their batch in pk order, as count_cooccurrences needs
+    rows = [
+        (order.pk, item[0])
+        for order in orders
+        if order.status != 'cancelled'
+        for item in data[order.pk]['items']
+    ]
+    return recommendations.count_cooccurrences(rows, products)
+
+
+def _add_cooccurrences(counts):
+    rows = [
+        (product_id, other_id, orders)
+        for product_id, neighbours in sorted(counts.items())
+        for other_id, orders in sorted(neighbours.items())
+    ]
+    table = connection.ops.quote_name(ArchivedCooccurrence._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} (product_id, other_id, orders) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT (product_id, other_id) DO UPDATE SET '
+                f'orders = {table}.orders + excluded.orders',
+                [value for row in batch for value in row],
+            )
+
+
+def _remove_cooccurrences(counts):
+    if not counts:
+        return
+    pairs = (
+        ArchivedCooccurrence.objects
+        .filter(product_id__in=list(counts))
+        .select_for_update()
+    )
+    changed = []
+    for pair in pairs:
+        orders = counts[pair.product_id].get(pair.other_id)
+        if orders:
+            pair.orders = max(pair.orders - orders, 0)
+            changed.append(pair)
+    ArchivedCooccurrence.objects.bulk_update(changed, ['orders'], batch_size=BATCH_SIZE)
+    ArchivedCooccurrence.objects.filter(product_id__in=list(counts), orders=0).delete()
+
+
+def restore(archived_orders, batch_size=BATCH_SIZE):
+    """Move archived orders back into Order and OrderItem; returns how many.
+
+    Items of products that have since been deleted can't be restored and are
+    dropped.
+    """
+    restored = 0
+    while True:
+        with transaction.atomic():
+            batch = list(archived_orders.select_for_update().order_by('pk')[:batch_size])
+            if not batch:
+                return restored
+            _restore_batch(batch)
+            restored += len(batch)
+
+
+def _restore_batch(batch):
+    data = {archived_order.pk: unpack(archived_order.payload) for archived_order in batch}
+    ids = list(data)
+    Order.objects.bulk_create([
+        Order(
+            id=archived_order.pk,
+            user_id=archived_order.user_id,
+            order_number=archived_order.order_number,
+            total_price=archived_order.total_price,
+            shipping_cost=archived_order.shipping_cost,
+            final_price=archived_order.final_price,
+            status=archived_order.status,
+        )
+        for archived_order in batch
+    ])
+    # bulk_create applies auto_now_add and auto_now; put the original dates back
+    Order.objects.filter(pk__in=ids).update(
+        created_at=Case(
+            *[When(pk=archived_order.pk, then=archived_order.created_at) for archived_order in batch],
+            output_field=DateTimeField(),
+        ),
+        updated_at=Case(
+            *[When(pk=archived_order.pk, then=archived_order.updated_at) for archived_order in batch],
+            output_field=DateTimeField(),
+        ),
+    )
+
+    product_ids = {item[0] for order_data in data.values() for item in order_data['items']}
+    existing = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+    # Pairs of deleted products went with them
+    _remove_cooccurrences(_cooccurrences(batch, data, existing))
+    user_ids = {change[2] for order_data in data.values() for change in order_data['status_changes']} - {None}
+    users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    OrderItem.objects.bulk_create([
+        OrderItem(order_id=order_id, product_id=product_id, quantity=quantity, price=price)
+        for order_id, order_data in data.items()
+        for product_id, _, quantity, price in order_data['items']
+        if product_id in existing
+    ], batch_size=BATCH_SIZE)
+    OrderStatusChange.objects.bulk_create([
+        OrderStatusChange(
+            order_id=order_id, from_status=from_status, to_status=to_status,
+            changed_by_id=changed_by_id if changed_by_id in users else None,
+            changed_at=parse_datetime(changed_at),
+        )
+        for order_id, order_data in data.items()
+        for from_status, to_status, changed_by_id, changed_at in order_data['status_changes']
+    ], batch_size=BATCH_SIZE)
+    movements = {
+        movement_id: order_id
+        for order_id, order_data in data.items()
+        for movement_id in order_data['stock_movements']
+    }
+    if movements:
+        StockMovement.objects.filter(pk__in=list(movements), order__isnull=True).update(order_id=Case(
+            *[When(pk=movement_id, then=order_id) for movement_id, order_id in movements.items()],
+            output_field=IntegerField(),
+        ))
+    ArchivedOrder.objects.filter(pk__in=ids).delete()
@@ -0,0 +1,281 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+from . import instrumentation, metrics
+
+_MISSING = object()
+
+
+def _record(tier, hits, misses):
+    instrumentation.record_cache(hits, misses, tier)
+    if hits:
+        metrics.inc('store_cache_requests_total', hits, tier=tier, result='hit')
+    if misses:
+        metrics.inc('store_cache_requests_total', misses, tier=tier, result='miss')
+
+
+class InstrumentedCache(BaseCache):
+    """Wrap another cache backend and count hits and misses per request.
+
+    The wrapped cache is configured under OPTIONS['CACHE'] like a regular
+    CACHES entry; keys are passed through untouched.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        inner = dict(params['OPTIONS']['CACHE'])
+        backend = import_string(inner.pop('BACKEND'))
+        self._cache = backend(inner.get('LOCATION', ''), inner)
+
+    def get(self, key, default=None, version=None):
+        value = self._cache.get(key, _MISSING, version)
+        if value is _MISSING:
+            _record('shared', 0, 1)
+            return default
+        _record('shared', 1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = self._cache.get_many(keys, version)
+        _record('shared', len(found), len(keys) - len(found))
+        return found
+
+    def has_key(self, key, version=None):
+        return self._cache.has_key(key, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.add(key, value, timeout, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.set(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.set_many(data, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        return self._cache.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        return self._cache.delete_many(keys, version)
+
+    def incr(self, key, delta=1, version=None):
+        return self._cache.incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        return self._cache.decr(key, delta, version)
+
+    def clear(self):
+        return self._cache.clear()
+
+    def close(self, **kwargs):
+        return self._cache.close(**kwargs)
+
+
+class TwoTierCache(InstrumentedCache):
+    """A small LRU in each worker's memory in front of the shared cache.
+
+    Only keys starting with one of OPTIONS['L1_KEY_PREFIXES'] (hot, small
+    values such as the catalog version and discount codes) are kept in L1,
+    at most L1_MAX_ENTRIES of them for at most L1_TIMEOUT seconds; everything
+    else goes straight to the shared cache.
+
+    set(), add() and set_many() are fills: they store a value read from the
+    source of truth, which any worker would have stored alike, so they only
+    go to the shared cache and this worker's L1.  Changing what other workers
+    may hold is done by deleting the key (or incr/decr): that bumps an epoch
+    counter in the shared cache and logs the key under the new epoch.  Every
+    worker compares the epoch at most every L1_CHECK_SECONDS and drops just
+    the logged keys from its L1, or all of it when it fell too far behind, so
+    an invalidation reaches the other workers within L1_CHECK_SECONDS.
+    Fills never touch the epoch, so a stream of cache misses (say, guessed
+    discount codes) can't make every worker flush its L1.  Backends whose
+    incr() isn't atomic (the file cache) can lose a log entry to a race,
+    which L1_TIMEOUT bounds.
+    """
+
+    EPOCH_KEY = 'l1:epoch'
+    LOG_TIMEOUT = 600
+    MAX_LOG = 100
+
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        options = params['OPTIONS']
+        self._prefixes = tuple(options.get('L1_KEY_PREFIXES', ()))
+        self._max_entries = options.get('L1_MAX_ENTRIES', 1000)
+        self._l1_timeout = options.get('L1_TIMEOUT', 10)
+        self._check_seconds = options.get('L1_CHECK_SECONDS', 1)
+        self._lock = threading.Lock()
+        self._l1 = OrderedDict()
+        self._epoch = None
+        self._checked_at = 0.0
+
+    def _local(self, key):
+        return key.startswith(self._prefixes)
+
+    def _l1_get(self, entry_key):
+        with self._lock:
+            entry = self._l1.get(entry_key)
+            if entry is None:
+                return _MISSING
+            pickled, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._l1[entry_key]
+                return _MISSING
+            self._l1.move_to_end(entry_key)
+        # Unpickled per read so callers can't change each other's copy
+        return pickle.loads(pickled)
+
+    def _l1_set(self, entry_key, value, timeout=DEFAULT_TIMEOUT):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is not None and timeout <= 0:
+            self._l1_drop([entry_key])
+            return
+        lifetime = self._l1_timeout if timeout is None else min(timeout, self._l1_timeout)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._l1[entry_key] = (pickled, time.monotonic() + lifetime)
+            self._l1.move_to_end(entry_key)
+            while len(self._l1) > self._max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_drop(self, entry_keys):
+        with self._lock:
+            for entry_key in entry_keys:
+                self._l1.pop(entry_key, None)
+
+    def _sync(self):
+        """Apply the other workers' invalidations, at most every L1_CHECK_SECONDS."""
+        now = time.monotonic()
+        if now - self._checked_at < self._check_seconds:
+            return
+        self._checked_at = now
+        epoch = self._cache.get(self.EPOCH_KEY, 0)
+        if epoch == self._epoch:
+            return
+        behind = epoch - self._epoch if self._epoch is not None else 0
+        logs = {}
+        if 0 < behind <= self.MAX_LOG:
+            logs = self._cache.get_many([f'l1:log:{n}' for n in range(self._epoch + 1, epoch + 1)])
+        if len(logs) == behind and behind:
+            self._l1_drop([entry_key for entry_keys in logs.values() for entry_key in entry_keys])
+        else:
+            with self._lock:
+                self._l1.clear()
+        self._epoch = epoch
+
+    def _broadcast(self, entry_keys):
+        try:
+            epoch = self._cache.incr(self.EPOCH_KEY)
+        except ValueError:
+            self._cache.add(self.EPOCH_KEY, 0, None)
+            epoch = self._cache.incr(self.EPOCH_KEY)
+        self._cache.set(f'l1:log:{epoch}', entry_keys, self.LOG_TIMEOUT)
+        if self._epoch is not None and epoch == self._epoch + 1:
+            # Nobody else wrote in between; our own L1 is already up to date
+            self._epoch = epoch
+
+    def get(self, key, default=None, version=None):
+        if not self._local(key):
+            return super().get(key, default, version)
+        self._sync()
+        value = self._l1_get((key, version))
+        if value is not _MISSING:
+            _record('l1', 1, 0)
+            return value
+        _record('l1', 0, 1)
+        value = super().get(key, _MISSING, version)
+        if value is _MISSING:
+            return default
+        self._l1_set((key, version), value)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = {}
+        shared = []
+        self._sync()
+        for key in keys:
+            value = self._l1_get((key, version)) if self._local(key) else _MISSING
+            if value is _MISSING:
+                shared.append(key)
+            else:
+                found[key] = value
+        local = sum(1 for key in keys if self._local(key))
+        if local:
+            _record('l1', len(found), local - len(found))
+        if shared:
+            fetched = super().get_many(shared, version)
+            for key, value in fetched.items():
+                if self._local(key):
+                    self._l1_set((key, version), value)
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version) is not _MISSING
+
+    def _invalidated(self, keys, version):
+        entry_keys = [(key, version) for key in keys if self._local(key)]
+        if entry_keys:
+            self._l1_drop(entry_keys)
+            self._broadcast(entry_keys)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout, version)
+        if added and self._local(key):
+            self._l1_set((key, version), value, timeout)
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version)
+        if self._local(key):
+            self._l1_set((key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = super().set_many(data, timeout, version)
+        for key, value in data.items():
+            if self._local(key):
+                if key in failed:
+                    self._l1_drop([(key, version)])
+                else:
+                    self._l1_set((key, version), value, timeout)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_drop([(key, version)])
+        return super().touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        deleted = super().delete(key, version)
+        self._invalidated([key], version)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        super().delete_many(keys, version)
+        self._invalidated(keys, version)
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta, version)
+        self._invalidated([key], version)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        value = super().decr(key, delta, version)
+        self._invalidated([key], version)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+        self._epoch = None
+        return super().clear()
@@ -0,0 +1,309 @@
+"""
+A read-only copy of the catalog held in each worker's memory.
+
+Available products, categories and product recommendations are loaded once
+into compact ``__slots__`` records with id and category indexes, so the
+storefront and cart pricing read them without touching the database.  A
+version token in the shared cache says when the copy is out of date: saving
+or deleting a Product or Category bumps it (see signals.py), as do bulk
+updates that bypass signals, which must call ``bump()`` themselves.  Workers
+look at the token at most every CATALOG_VERSION_CHECK_SECONDS (read through
+the cache's per-worker tier, so a new token can take L1_CHECK_SECONDS more to
+show up) and reload from the primary when it changed, since a replica may
+not have the change yet.  CATALOG_MAX_AGE_SECONDS is only a safety net for a
+missed bump; that reload reads from a replica.
+
+Sales only bump the version when they sell a product out (see
+inventory.sell), so the stock left shown may trail the database by up to
+CATALOG_MAX_AGE_SECONDS; reservations and checkout always check the
+database.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from . import routers
+from .models import Category, Product, ProductRecommendation
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'catalog:version'
+
+# Listing sort orders, as the database ordering (backed by the indexes on
+# Product) and the equivalent key for sorting records in memory
+SORTS = {
+    'newest': (('-created_at', '-id'), None),
+    'popular': (('-popularity_score', '-id'), lambda product: (-product.popularity_score, -product.id)),
+    'price': (('price', 'id'), lambda product: (product.price, product.id)),
+    'price_desc': (('-price', '-id'), lambda product: (-product.price, -product.id)),
+}
+DEFAULT_SORT = 'newest'
+
+
+class ImageRecord:
+    __slots__ = ('name', 'url')
+
+    def __init__(self, name):
+        self.name = name
+        self.url = default_storage.url(name) if name else None
+
+    def __bool__(self):
+        return bool(self.name)
+
+    def __str__(self):
+        return self.name
+
+
+class CategoryRecord:
+    __slots__ = ('id', 'name', 'slug', 'parent_id', 'path', 'depth', 'description', 'is_active', 'children')
+
+    def __init__(self, id, name, slug, parent_id, path, depth, description, is_active):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.parent_id = parent_id
+        self.path = path
+        self.depth = depth
+        self.description = description
+        self.is_active = is_active
+        self.children = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def tree_label(self):
+        return '— ' * self.depth + self.name
+
+    def __str__(self):
+        return self.name
+
+
+class ProductRecord:
+    __slots__ = (
+        'id', 'name', 'description', 'price', 'image', 'category', 'is_featured',
+        'stock_quantity', 'created_at', 'popularity_score', 'search_text',
+    )
+    is_available = True
+
+    def __init__(
+        self, id, name, description, price, image, category, is_featured, stock_quantity, created_at,
+        popularity_score,
+    ):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.price = price
+        self.image = ImageRecord(image)
+        self.category = category
+        self.is_featured = is_featured
+        self.stock_quantity = stock_quantity
+        self.created_at = created_at
+        self.popularity_score = popularity_score
+        self.search_text = f'{name}\n{description}'.lower()
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def category_id(self):
+        return self.category.id
+
+    @property
+    def in_stock(self):
+        return self.stock_quantity > 0
+
+    def __str__(self):
+        return self.name
+
+
+class Catalog:
+    """One immutable load of the catalog; replaced, never modified."""
+
+    def __init__(self, version, categories, products, recommendations):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.categories_by_id = categories
+        self.categories_by_slug = {category.slug: category for category in categories.values()}
+        by_name = sorted(categories.values(), key=lambda category: category.name)
+        children = {}
+        for category in by_name:
+            if category.is_active:
+                children.setdefault(category.parent_id, []).append(category)
+        for category in by_name:
+            category.children = tuple(children.get(category.id, ()))
+        # Inactive categories hide their whole subtree
+        self.category_tree = tuple(children.get(None, ()))
+        # Active categories depth first, siblings by name, for the filter list
+        self.categories = tuple(self._walk(self.category_tree))
+        self._fragments = {}
+        self.products = tuple(products)
+        # Loaded newest first; the other orders are sorted once per load
+        self.sorted = {
+            sort: self.products if key is None else tuple(sorted(self.products, key=key))
+            for sort, (_, key) in SORTS.items()
+        }
+        self.by_id = {product.id: product for product in self.products}
+        by_category = {}
+        for product in self.products:
+            by_category.setdefault(product.category.id, []).append(product)
+        self.by_category = {category_id: tuple(items) for category_id, items in by_category.items()}
+        self.featured = tuple(product for product in self.products if product.is_featured)
+        self.recommendations = recommendations
+
+    def _walk(self, categories):
+        for category in categories:
+            yield category
+            yield from self._walk(category.children)
+
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+    def category(self, slug):
+        return self.categories_by_slug.get(slug)
+
+    def ancestors(self, category):
+        """The categories from the root down to ``category``, for breadcrumbs."""
+        return [self.categories_by_id[int(category_id)] for category_id in category.path.split('/')[:-1]]
+
+    def fragment(self, key, render):
+        """Render a piece of HTML once per snapshot, e.g. the category menu."""
+        html = self._fragments.get(key)
+        if html is None:
+            html = self._fragments[key] = render()
+        return html
+
+    def in_bulk(self, product_ids):
+        by_id = self.by_id
+        return {product_id: by_id[product_id] for product_id in product_ids if product_id in by_id}
+
+    def search(self, query='', category=None, price_min=None, price_max=None, sort=DEFAULT_SORT):
+        products = self.sorted.get(sort, self.products)
+        if category is not None:
+            # The category and everything under it
+            path = category.path
+            products = [product for product in products if product.category.path.startswith(path)]
+        if query:
+            query = query.lower()
+            products = [product for product in products if query in product.search_text]
+        if price_min is not None:
+            products = [product for product in products if product.price >= price_min]
+        if price_max is not None:
+            products = [product for product in products if product.price <= price_max]
+        return list(products)
+
+    def related(self, product, limit=4):
+        """Recommended products, or others from the same category for cold products."""
+        by_id = self.by_id
+        related = [
+            by_id[other_id] for other_id in self.recommendations.get(product.id, ())
+            if other_id in by_id
+        ][:limit]
+        if related:
+            return related
+        return [
+            other for other in self.by_category.get(product.category.id, ())
+            if other.id != product.id
+        ][:limit]
+
+
+_lock = threading.Lock()
+_current = None
+_checked_at = 0.0
+
+
+def _shared_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # First worker up, or the cache was cleared
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def load(version, primary=True):
+    # Right after a bump a replica may not have the change yet
+    with routers.primary() if primary else routers.reporting():
+        categories = {
+            row[0]: CategoryRecord(*row)
+            for row in Category.objects.values_list(
+                'id', 'name', 'slug', 'parent_id', 'path', 'depth', 'description', 'is_active',
+            )
+        }
+        products = [
+            ProductRecord(
+                id, name, description, price, image, categories[category_id],
+                is_featured, stock_quantity, created_at, popularity_score,
+            )
+            for (
+                id, name, description, price, image, category_id, is_featured, stock_quantity, created_at,
+                popularity_score,
+            ) in Product.objects.filter(is_available=True).order_by(*SORTS[DEFAULT_SORT][0]).values_list(
+                'id', 'name', 'description', 'price', 'image', 'category_id', 'is_featured',
+                'stock_quantity', 'created_at', 'popularity_score',
+            ).iterator(chunk_size=2000)
+        ]
+        recommendations = {}
+        for product_id, recommended_id in (
+            ProductRecommendation.objects.order_by('product_id', 'rank')
+            .values_list('product_id', 'recommended_id').iterator(chunk_size=2000)
+        ):
+            recommendations.setdefault(product_id, []).append(recommended_id)
+    return Catalog(
+        version,
+        categories,
+        products,
+        {product_id: tuple(ids) for product_id, ids in recommendations.items()},
+    )
+
+
+def snapshot():
+    """Return the current catalog, reloading it if it has gone out of date."""
+    global _current, _checked_at
+    now = time.monotonic()
+    check_every = getattr(settings, 'CATALOG_VERSION_CHECK_SECONDS', 1)
+    max_age = getattr(settings, 'CATALOG_MAX_AGE_SECONDS', 3600)
+    current = _current
+    if current is not None and now - _checked_at < check_every and now - current.loaded_at < max_age:
+        return current
+
+    with _lock:
+        current = _current
+        if current is not None and now - _checked_at < check_every and now - current.loaded_at < max_age:
+            return current
+        version = _shared_version()
+        changed = current is None or current.version != version
+        if changed or now - current.loaded_at >= max_age:
+            started = time.perf_counter()
+            current = load(version, primary=changed)
+            logger.debug(
+                'Loaded catalog version %s: %d products in %.0fms',
+                version, len(current.products), (time.perf_counter() - started) * 1000,
+            )
+            _current = current
+        _checked_at = now
+    return current
+
+
+def bump():
+    """Make every worker reload the catalog once the current transaction commits."""
+    def publish():
+        # Deleted rather than overwritten: only deletes reach the other
+        # workers' cache tier, and the next read mints a new token
+        cache.delete(VERSION_KEY)
+        reset()
+    transaction.on_commit(publish)
+
+
+def reset():
+    """Drop this worker's copy; the next read loads a fresh one."""
+    global _current
+    _current = None
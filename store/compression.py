@@ -0,0 +1,88 @@
+"""
+Brotli and gzip for HTML and JSON responses.
+
+Pages without a CSRF token are identical for everyone who gets the same
+bytes, so their compressed form is cached under a hash of the content and
+each distinct page is encoded once, at a higher level than we could afford
+per request.  Pages that carry a CSRF token are BREACH targets: the token is
+already masked per response by Django, and on top of that they are gzipped
+with random bytes in the gzip header (Django's "Heal the Breach" padding, as
+in GZipMiddleware) so the compressed length doesn't track the content, and
+never cached.
+
+Brotli needs the optional ``brotli`` package; without it everything is gzip.
+"""
+import gzip
+import hashlib
+
+from django.core.cache import cache
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {'text/html', 'application/json', 'text/plain'}
+BREACH_RANDOM_BYTES = 100
+
+
+def negotiate(accept_encoding):
+    """Pick 'br' or 'gzip' from an Accept-Encoding header, or None."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    wildcard = accepted.get('*', 0.0)
+    best = max(candidates, key=lambda coding: accepted.get(coding, wildcard))
+    return best if accepted.get(best, wildcard) > 0 else None
+
+
+def is_compressible(response, min_size):
+    if response.streaming or response.has_header('Content-Encoding'):
+        return False
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return content_type in COMPRESSIBLE_TYPES and len(response.content) >= min_size
+
+
+def carries_token(request):
+    """Whether the response to ``request`` may contain the CSRF token.
+
+    get_token() sets CSRF_COOKIE_NEEDS_UPDATE, and CsrfViewMiddleware resets
+    it to False on the way out before this middleware sees the response, so
+    only the key being there can be relied on.  A new cookie for a bad one
+    sets it too; padding such a page as well costs nothing.
+    """
+    return 'CSRF_COOKIE_NEEDS_UPDATE' in request.META
+
+
+def _encode(content, coding, cached):
+    # Cached variants are encoded once, so they get the slow, small settings
+    if coding == 'br':
+        return brotli.compress(content, quality=9 if cached else 5)
+    return gzip.compress(content, compresslevel=9 if cached else 6, mtime=0)
+
+
+def compress(content, coding, cache_seconds):
+    """Compress a page that is the same for everyone who receives it."""
+    if not cache_seconds:
+        return _encode(content, coding, False)
+    key = f'compressed:{coding}:{hashlib.blake2b(content, digest_size=16).hexdigest()}'
+    compressed = cache.get(key)
+    if compressed is None:
+        compressed = _encode(content, coding, True)
+        cache.set(key, compressed, cache_seconds)
+    return compressed
+
+
+def compress_secret(content):
+    """Compress a page carrying a CSRF token, padded against BREACH."""
+    return compress_string(content, max_random_bytes=BREACH_RANDOM_BYTES)
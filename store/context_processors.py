@@ -1,22 +1,21 @@
+from . import catalog, site
 from .models import SiteSettings
 
 def cart_context(request):
-    cart = request.session.get('cart', {})
+    # Public pages don't touch the session; the badge is filled in by script
+    cart = {} if getattr(request, 'public_page', False) else request.session.get('cart', {})
     cart_items_count = sum(item.get('quantity', 1) for item in cart.values())
     
     # Calculate total price for shipping
     total_price = 0
-    for product_id, item_data in cart.items():
-        try:
-            from .models import Product
-            product = Product.objects.get(id=product_id, is_available=True)
-            quantity = item_data.get('quantity', 1)
-            total_price += product.price * quantity
-        except:
-            continue
+    if cart:
+        products = catalog.snapshot().by_id
+        for product_id, item_data in cart.items():
+            if product_id.isdigit() and int(product_id) in products:
+                total_price += products[int(product_id)].price * item_data.get('quantity', 1)
     
     try:
-        site_settings = SiteSettings.objects.first()
+        site_settings = site.settings()
         if site_settings:
             delivery_fee = site_settings.delivery_fee
             free_delivery_threshold = site_settings.free_delivery_threshold
@@ -49,7 +48,7 @@ def cart_context(request):
 
 def site_settings(request):
     try:
-        site_settings = SiteSettings.objects.first()
+        site_settings = site.settings()
         if not site_settings:
             site_settings = SiteSettings.objects.create(
                 site_name="تارلا ارگانیک",
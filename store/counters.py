@@ -0,0 +1,169 @@
+"""
+Buffered per-product view and add-to-cart counters.
+
+Incrementing a row on every product view would make hot products' rows a
+write bottleneck, so ``record()`` only bumps a number in this worker's
+memory.  A background thread started in each gunicorn worker (see
+gunicorn.conf.py) writes the buffer every COUNTER_FLUSH_SECONDS as batched
+upserts that add to the (product, day) rows of ProductCounter.  A worker
+that dies without a clean exit loses at most one interval of counts; a clean
+exit flushes what is left.
+
+Without the thread (runserver, tests, shells) counts stay buffered until
+``flush()`` is called.
+
+Views are recorded through ``record_view()``, which counts each visitor once
+per product and day in each worker, so reloading a page or replaying its
+session_state request can't push a product up the popularity sort.  The
+visitors seen are kept in memory too, as a set of hashes that is emptied
+each day or when it reaches VIEWS_SEEN_MAX.
+"""
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import throttling
+from .models import Product, ProductCounter
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('views', 'cart_adds')
+# Four parameters per row, so a statement stays under SQLite's 999 variables
+BATCH_SIZE = 200
+# About 8MB of hashes per worker at most
+VIEWS_SEEN_MAX = 100_000
+
+_lock = threading.Lock()
+_pending = defaultdict(lambda: [0, 0])
+_seen = set()
+_seen_day = None
+_flusher = None
+
+
+def record(product_id, field, amount=1):
+    """Count a 'views' or 'cart_adds' event for a product, in memory."""
+    index = FIELDS.index(field)
+    key = (product_id, timezone.localdate())
+    with _lock:
+        _pending[key][index] += amount
+
+
+def record_view(request, product_id):
+    """Count a view of a product unless this visitor was counted for it today."""
+    # Reading the session first drops the key of a made-up session cookie;
+    # visitors without a session (public pages) are told apart by address
+    if request.session.keys():
+        visitor = 'session:' + request.session.session_key
+    else:
+        visitor = 'ip:' + throttling.client_ip(request)
+    global _seen_day
+    day = timezone.localdate()
+    seen = hash((product_id, visitor))
+    with _lock:
+        if _seen_day != day or len(_seen) >= VIEWS_SEEN_MAX:
+            _seen.clear()
+            _seen_day = day
+        if seen in _seen:
+            return
+        _seen.add(seen)
+        _pending[(product_id, day)][0] += 1
+
+
+def _take():
+    global _pending
+    with _lock:
+        pending, _pending = _pending, defaultdict(lambda: [0, 0])
+    return pending
+
+
+def _give_back(pending):
+    with _lock:
+        for key, (views, cart_adds) in pending.items():
+            counts = _pending[key]
+            counts[0] += views
+            counts[1] += cart_adds
+
+
+def _upsert(rows):
+    table = connection.ops.quote_name(ProductCounter._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} (product_id, day, views, cart_adds) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT (product_id, day) DO UPDATE SET '
+                f'views = {table}.views + excluded.views, '
+                f'cart_adds = {table}.cart_adds + excluded.cart_adds',
+                [value for row in batch for value in row],
+            )
+
+
+def flush():
+    """Write the buffered counts and return how many rows were upserted."""
+    pending = _take()
+    if not pending:
+        return 0
+    rows = sorted((product_id, day, views, cart_adds) for (product_id, day), (views, cart_adds) in pending.items())
+    try:
+        try:
+            _upsert(rows)
+        except IntegrityError:
+            # A product was deleted since it was viewed; drop its counts
+            existing = set(
+                Product.objects.filter(pk__in={row[0] for row in rows}).values_list('pk', flat=True)
+            )
+            rows = [row for row in rows if row[0] in existing]
+            _upsert(rows)
+    except Exception:
+        _give_back(pending)
+        raise
+    return len(rows)
+
+
+def _run(stop, interval):
+    while not stop.wait(interval):
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception('Flushing product counters failed; retrying next time')
+    try:
+        flush()
+    except Exception:
+        logger.exception('Final flush of product counters failed')
+    connection.close()
+
+
+def start_flusher():
+    """Flush this process's counters every COUNTER_FLUSH_SECONDS in a thread."""
+    global _flusher
+    if _flusher is not None:
+        return
+    interval = getattr(settings, 'COUNTER_FLUSH_SECONDS', 5)
+    stop = threading.Event()
+    thread = threading.Thread(target=_run, args=(stop, interval), name='counter-flusher', daemon=True)
+    thread.start()
+    _flusher = (thread, stop)
+
+
+def stop_flusher(timeout=10):
+    """Stop the flusher thread after a last flush."""
+    global _flusher
+    if _flusher is None:
+        return
+    thread, stop = _flusher
+    stop.set()
+    thread.join(timeout)
+    _flusher = None
+
+
+def reset():
+    """Drop this process's buffered counts and seen visitors without writing them."""
+    _take()
+    with _lock:
+        _seen.clear()
@@ -0,0 +1,93 @@
+"""
+Discount code lookups and redemption.
+
+Valid codes are cached by their normalized code and misses are cached for a
+short time, so guessing codes doesn't reach the database on every attempt.
+Redemption is a single conditional UPDATE bounded by max_usage.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DiscountCode
+
+CACHE_TIMEOUT = 300
+MISS_TIMEOUT = 30
+_MISSING = 'missing'
+
+
+class DiscountUnavailable(Exception):
+    pass
+
+
+def normalize_code(code):
+    return (code or '').strip().upper()
+
+
+def _cache_key(code):
+    return f'discount:{code}'
+
+
+def lookup(code):
+    """Return a dict for an active code inside its validity window, else None.
+
+    The dict holds id, code, discount_percent, max_usage and used_count; the
+    usage numbers may be a few minutes old, redeem() has the final say.
+    """
+    code = normalize_code(code)
+    if not code:
+        return None
+
+    key = _cache_key(code)
+    discount = cache.get(key)
+    if discount == _MISSING:
+        return None
+
+    now = timezone.now()
+    if discount is None:
+        discount = DiscountCode.objects.filter(
+            code=code,
+            is_active=True,
+            valid_to__gte=now
+        ).values(
+            'id', 'code', 'discount_percent', 'max_usage', 'used_count', 'valid_from', 'valid_to'
+        ).first()
+        if discount is None:
+            cache.set(key, _MISSING, MISS_TIMEOUT)
+            return None
+        # Never keep a code cached past its expiry
+        timeout = min(CACHE_TIMEOUT, int((discount['valid_to'] - now).total_seconds()) + 1)
+        cache.set(key, discount, timeout)
+
+    if not discount['valid_from'] <= now <= discount['valid_to']:
+        return None
+    return discount
+
+
+def redeem(discount_id, code=None):
+    """Count one use of a code; False if it is no longer valid or used up."""
+    now = timezone.now()
+    redeemed = DiscountCode.objects.filter(
+        pk=discount_id,
+        is_active=True,
+        used_count__lt=F('max_usage'),
+        valid_from__lte=now,
+        valid_to__gte=now
+    ).update(used_count=F('used_count') + 1)
+    if code:
+        invalidate(code)
+    return bool(redeemed)
+
+
+def invalidate(*codes):
+    """Drop cached lookups once the current transaction commits.
+
+    Dropping them earlier would let another request cache the old row again
+    before the change is visible to it.
+    """
+    transaction.on_commit(lambda: _invalidate_now(codes))
+
+
+def _invalidate_now(codes):
+    cache.delete_many([_cache_key(normalize_code(code)) for code in codes])
@@ -0,0 +1,58 @@
+"""
+Idempotency keys that make checkout safe to submit twice.
+
+The cart page carries a fresh random key in its checkout form.  Checkout
+stores the key in the same transaction as the order it places, so a double
+click or a browser retry with the same key finds the order with one indexed
+lookup instead of placing it again.  Two submits that race both try to insert
+the key; the unique constraint lets exactly one of them commit.
+"""
+import re
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+def issue():
+    return secrets.token_urlsafe(24)
+
+
+def is_valid(key):
+    return bool(KEY_PATTERN.match(key))
+
+
+def order_for(key, user):
+    """The id of the order already placed with ``key`` by ``user``, or None."""
+    return (
+        IdempotencyKey.objects.filter(key=key, user_id=user.pk, expires_at__gt=timezone.now())
+        .values_list('order_id', flat=True)
+        .first()
+    )
+
+
+def record(key, order):
+    hours = getattr(settings, 'IDEMPOTENCY_KEY_HOURS', 24)
+    return IdempotencyKey.objects.create(
+        key=key,
+        user_id=order.user_id,
+        order=order,
+        expires_at=timezone.now() + timedelta(hours=hours),
+    )
+
+
+def purge_expired(batch_size=1000):
+    purged = 0
+    while True:
+        batch = list(
+            IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
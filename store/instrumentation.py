@@ -0,0 +1,134 @@
+"""
+Per-request timing: wall time, SQL count and time, template rendering time and
+cache hits/misses of the shared cache and of the per-worker cache in front of it.
+
+Stats live in a context variable set by RequestTimingMiddleware, so the hooks
+below cost a lookup and an addition when no request is being measured.
+"""
+import heapq
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.template.backends import django as django_backend
+from django.template.exceptions import TemplateDoesNotExist
+
+SLOWEST_QUERIES = 5
+
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = (
+        'started', 'elapsed', 'db_count', 'db_time', 'slowest',
+        'template_time', 'template_depth', 'cache_hits', 'cache_misses', 'l1_hits', 'l1_misses',
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.db_count = 0
+        self.db_time = 0.0
+        self.slowest = []
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.l1_hits = 0
+        self.l1_misses = 0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def add_query(self, sql, duration):
+        self.db_count += 1
+        self.db_time += duration
+        # Min-heap of the N slowest statements; cheap compared to the query itself
+        if len(self.slowest) < SLOWEST_QUERIES:
+            heapq.heappush(self.slowest, (duration, self.db_count, sql))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, self.db_count, sql))
+
+    def slowest_queries(self):
+        return [(duration, sql) for duration, _, sql in sorted(self.slowest, reverse=True)]
+
+    def server_timing(self):
+        return ', '.join([
+            f'total;dur={self.elapsed * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="hit={self.cache_hits} miss={self.cache_misses}"',
+            f'cache-l1;desc="hit={self.l1_hits} miss={self.l1_misses}"',
+        ])
+
+
+def current():
+    return _current.get()
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - started)
+
+
+@contextmanager
+def measure():
+    """Collect RequestStats for everything run inside the block."""
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(_record_query))
+            yield stats
+    finally:
+        stats.finish()
+        _current.reset(token)
+
+
+def record_cache(hits, misses, tier='shared'):
+    stats = _current.get()
+    if stats is None:
+        return
+    if tier == 'l1':
+        stats.l1_hits += hits
+        stats.l1_misses += misses
+    else:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        # Templates rendered from inside another template are already counted
+        stats.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_depth -= 1
+            if not stats.template_depth:
+                stats.template_time += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The stock Django template backend with render timing."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
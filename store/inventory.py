@@ -0,0 +1,194 @@
+"""
+Stock ledger and cart reservations.
+
+StockMovement is append-only and is the source of truth; Product.stock_quantity
+is a denormalized balance that is only ever changed with F() expressions next to
+the movement that explains it.  Reservations hold stock for a cart for a short
+time so two shoppers can't both be promised the last unit.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import catalog
+from .models import Product, StockMovement, StockReservation
+
+RESERVATION_TTL = timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_MINUTES', 15))
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(f'Insufficient stock for product {product_id}')
+        self.product_id = product_id
+
+
+def record_movement(product_id, kind, quantity, order=None, note='', user=None):
+    """Append a movement and apply it to the product's balance.
+
+    Negative movements never take the balance below zero; InsufficientStock is
+    raised instead so the caller's transaction can roll back.
+    """
+    with transaction.atomic():
+        balance = Product.objects.filter(pk=product_id)
+        if quantity < 0:
+            balance = balance.filter(stock_quantity__gte=-quantity)
+        if not balance.update(stock_quantity=F('stock_quantity') + quantity):
+            raise InsufficientStock(product_id)
+        return StockMovement.objects.create(
+            product_id=product_id,
+            kind=kind,
+            quantity=quantity,
+            order=order,
+            note=note,
+            created_by=user,
+        )
+
+
+def _held_elsewhere(session_key, now):
+    # Units of OuterRef('pk') held by other carts' unexpired reservations
+    return Coalesce(
+        Subquery(
+            StockReservation.objects.filter(product=OuterRef('pk'), expires_at__gt=now)
+            .exclude(session_key=session_key)
+            .values('product')
+            .annotate(total=Sum('quantity'))
+            .values('total')
+        ),
+        Value(0),
+    )
+
+
+def sell(order, quantities, session_key=None):
+    """Record the sale of {product_id: quantity}, honouring other carts' holds.
+
+    All balances are checked and decremented in a single conditional UPDATE, so
+    the number of queries doesn't depend on the size of the order.  Selling a
+    product out bumps the catalog version.
+    """
+    now = timezone.now()
+    enough = Q()
+    for product_id, quantity in quantities.items():
+        enough |= Q(pk=product_id, stock_quantity__gte=_held_elsewhere(session_key, now) + quantity)
+    try:
+        with transaction.atomic():
+            sold = Product.objects.filter(enough).update(stock_quantity=Case(
+                *[When(pk=product_id, then=F('stock_quantity') - quantity)
+                  for product_id, quantity in quantities.items()],
+                default=F('stock_quantity'),
+                output_field=IntegerField(),
+            ))
+            if sold != len(quantities):
+                raise InsufficientStock(None)
+            movements = StockMovement.objects.bulk_create([
+                StockMovement(product_id=product_id, kind=StockMovement.SALE, quantity=-quantity, order=order)
+                for product_id, quantity in quantities.items()
+            ])
+            # The storefront must stop offering what just sold out
+            if Product.objects.filter(pk__in=list(quantities), stock_quantity=0).exists():
+                catalog.bump()
+            return movements
+    except InsufficientStock:
+        # Work out which product was short only once the update is rolled back
+        short = Product.objects.filter(pk__in=list(quantities)).exclude(enough).values_list('pk', flat=True).first()
+        raise InsufficientStock(short or next(iter(quantities)))
+
+
+def restock(returns, kind=StockMovement.CANCELLATION, user=None):
+    """Put {(order_id, product_id): quantity} back on the shelf.
+
+    The balances of every product involved move in one UPDATE, next to one
+    movement per order and product.
+    """
+    totals = {}
+    for (order_id, product_id), quantity in returns.items():
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    if not totals:
+        return []
+    with transaction.atomic():
+        Product.objects.filter(pk__in=list(totals)).update(stock_quantity=Case(
+            *[When(pk=product_id, then=F('stock_quantity') + quantity)
+              for product_id, quantity in totals.items()],
+            default=F('stock_quantity'),
+            output_field=IntegerField(),
+        ))
+        return StockMovement.objects.bulk_create([
+            StockMovement(product_id=product_id, kind=kind, quantity=quantity, order_id=order_id, created_by=user)
+            for (order_id, product_id), quantity in returns.items()
+        ], batch_size=500)
+
+
+def reserved_quantities(product_ids, exclude_session=None):
+    """Return {product_id: units held by unexpired reservations}."""
+    reservations = StockReservation.objects.filter(
+        product_id__in=product_ids,
+        expires_at__gt=timezone.now(),
+    )
+    if exclude_session:
+        reservations = reservations.exclude(session_key=exclude_session)
+    return dict(
+        reservations.values('product_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+
+
+def available_quantity(product, session_key=None):
+    held = reserved_quantities([product.pk], exclude_session=session_key).get(product.pk, 0)
+    return max(0, product.stock_quantity - held)
+
+
+def hold(session_key, product_id, quantity):
+    """Set this cart's reservation without checking availability."""
+    StockReservation.objects.update_or_create(
+        session_key=session_key,
+        product_id=product_id,
+        defaults={'quantity': quantity, 'expires_at': timezone.now() + RESERVATION_TTL},
+    )
+
+
+def reserve(session_key, product, quantity):
+    """Reserve ``quantity`` units for this cart, replacing any earlier hold.
+
+    Returns False, leaving the previous reservation untouched, when other carts
+    and the current balance don't leave enough free stock.
+    """
+    with transaction.atomic():
+        stock = (
+            Product.objects.select_for_update()
+            .values_list('stock_quantity', flat=True)
+            .get(pk=product.pk)
+        )
+        held = reserved_quantities([product.pk], exclude_session=session_key).get(product.pk, 0)
+        if quantity > stock - held:
+            return False
+        hold(session_key, product.pk, quantity)
+    return True
+
+
+def release(session_key, product_ids=None):
+    reservations = StockReservation.objects.filter(session_key=session_key)
+    if product_ids is not None:
+        reservations = reservations.filter(product_id__in=product_ids)
+    reservations.delete()
+
+
+def transfer_reservations(old_session_key, new_session_key):
+    # Session keys are cycled on login; keep the cart's holds with it
+    if old_session_key and new_session_key and old_session_key != new_session_key:
+        StockReservation.objects.filter(session_key=old_session_key).update(session_key=new_session_key)
+
+
+def purge_expired_reservations(batch_size=1000):
+    purged = 0
+    while True:
+        batch = list(
+            StockReservation.objects.filter(expires_at__lte=timezone.now())
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return purged
+        purged += StockReservation.objects.filter(pk__in=batch).delete()[0]
@@ -0,0 +1,173 @@
+"""
+A small persistent job queue that lives in the database.
+
+Functions decorated with ``@register`` can be queued with ``enqueue(name,
+**payload)``; the job row is written when the surrounding transaction
+commits, so a rolled-back checkout never sends its email.  ``run_worker``
+claims due jobs with a conditional UPDATE, so any number of workers can share
+the table without a broker, and puts back the jobs of workers that died.
+Failed jobs are retried with exponential backoff until they run out of
+attempts, and so are jobs that keep killing their worker.
+"""
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def register(name=None, max_attempts=5, concurrency=None):
+    """Make a function runnable as a job.
+
+    ``concurrency`` caps how many jobs of this kind run at once across all
+    workers, e.g. to stay within a mail provider's connection limit.
+    """
+    def decorator(func):
+        _registry[name or func.__name__] = {
+            'func': func,
+            'max_attempts': max_attempts,
+            'concurrency': concurrency,
+        }
+        return func
+    return decorator
+
+
+def enqueue(name, /, **payload):
+    """Queue a job once the current transaction commits.
+
+    The payload must be JSON serialisable; pass ids rather than model
+    instances so the job reads fresh data when it runs.
+    """
+    if name not in _registry:
+        raise KeyError(f'Unknown job {name!r}')
+
+    def create():
+        Job.objects.create(
+            name=name,
+            payload=payload,
+            max_attempts=_registry[name]['max_attempts'],
+            run_at=timezone.now(),
+        )
+    transaction.on_commit(create)
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def backoff(attempts):
+    # 30s, 1m, 2m, 4m ... capped at an hour, with jitter so retries spread out
+    delay = min(30 * 2 ** (attempts - 1), 3600)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def _free_slot(name, limit):
+    taken = set(Job.objects.filter(name=name, status=Job.RUNNING).values_list('slot', flat=True))
+    return next((slot for slot in range(limit) if slot not in taken), None)
+
+
+def claim(locked_by, batch=10):
+    """Claim the next due job for ``locked_by`` and return it, or None.
+
+    A job whose kind has a concurrency limit also takes one of its kind's
+    numbered slots; a unique constraint on running jobs' (name, slot) means
+    two workers that both saw the last slot free can't both take it.
+    """
+    now = timezone.now()
+    candidates = (
+        Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+        .order_by('run_at', 'pk')
+        .values_list('pk', 'name')[:batch]
+    )
+    for pk, name in candidates:
+        limit = _registry.get(name, {}).get('concurrency')
+        slot = None
+        if limit is not None:
+            slot = _free_slot(name, limit)
+            if slot is None:
+                continue
+        # Only one worker's UPDATE can move the job out of the queue
+        try:
+            with transaction.atomic():
+                claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+                    status=Job.RUNNING,
+                    locked_at=now,
+                    locked_by=locked_by,
+                    attempts=F('attempts') + 1,
+                    slot=slot,
+                )
+        except IntegrityError:
+            # Another worker took the slot first
+            continue
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def execute(job):
+    """Run a claimed job and record the outcome."""
+    entry = _registry.get(job.name)
+    try:
+        if entry is None:
+            raise KeyError(f'Unknown job {job.name!r}')
+        entry['func'](**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error('Job %s failed for good after %d attempts:\n%s', job, job.attempts, error)
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.FAILED, last_error=error, finished_at=timezone.now()
+            )
+        else:
+            logger.warning('Job %s failed on attempt %d, retrying:\n%s', job, job.attempts, error)
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, last_error=error, run_at=timezone.now() + backoff(job.attempts)
+            )
+        return False
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, finished_at=timezone.now())
+    return True
+
+
+def requeue_stale():
+    """Put back jobs whose worker died mid-run; returns how many.
+
+    Jobs that have used up their attempts are marked failed instead, so one
+    that crashes every worker it runs on doesn't hold its slot for ever.
+    """
+    timeout = getattr(settings, 'JOB_TIMEOUT_SECONDS', 600)
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=timeout))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED,
+        last_error=f'Worker stopped responding for {timeout}s on the last attempt',
+        finished_at=now,
+    )
+    if failed:
+        logger.error('%d stale jobs failed for good', failed)
+    return stale.update(status=Job.QUEUED, run_at=now)
+
+
+def purge_finished(days=7, batch_size=1000):
+    """Delete finished jobs older than ``days``, in batches."""
+    cutoff = timezone.now() - timedelta(days=days)
+    purged = 0
+    while True:
+        batch = list(
+            Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff)
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return purged
+        purged += Job.objects.filter(pk__in=batch).delete()[0]
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store import archive
+
+
+class Command(BaseCommand):
+    help = 'Move old delivered and cancelled orders to the order archive in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 180),
+            help='Archive orders placed more than this many days ago',
+        )
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        archived = archive.archive(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} orders placed more than {options["days"]} days ago'
+        ))
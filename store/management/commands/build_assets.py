@@ -0,0 +1,123 @@
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    from fontTools import subset
+except ImportError:  # fonttools[woff] is only needed to shrink the icon fonts
+    subset = None
+
+ICON_PATTERN = re.compile(r'\bfa-([a-z0-9-]+)')
+# ".fa-circle-check::before, .fa-check-circle::before { content: "\f058"; }"
+ICON_RULE = re.compile(
+    r'(?P<selectors>\.fa-[\w-]+::?before(?:\s*,\s*\.fa-[\w-]+::?before)*)'
+    r'\s*\{\s*content:\s*"(?P<content>[^"]*)";?\s*\}\s*'
+)
+VAZIRMATN_WEIGHTS = ['Regular', 'Medium', 'SemiBold', 'Bold']
+
+
+class Command(BaseCommand):
+    help = 'Build the minified CSS bundles, self-hosted fonts and icon subset (needs "npm install")'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--critical-templates',
+            nargs='+',
+            default=['store/templates/store/base.html', 'store/templates/store/header.html'],
+            help='Templates whose classes go into the inlined critical CSS',
+        )
+
+    def handle(self, *args, **options):
+        self.base = Path(settings.BASE_DIR)
+        self.node_modules = self.base / 'node_modules'
+        tailwind = self.node_modules / '.bin' / 'tailwindcss'
+        if not tailwind.exists():
+            raise CommandError('Tailwind is not installed; run "npm install" first')
+
+        assets = self.base / 'store' / 'assets'
+        static = self.base / 'store' / 'static' / 'store'
+        (assets / 'build').mkdir(exist_ok=True)
+        (static / 'fonts').mkdir(exist_ok=True)
+
+        self.copy_vazirmatn(static / 'fonts')
+        self.build_icons(assets / 'build' / 'icons.css', static / 'fonts')
+
+        self.tailwind(tailwind, assets / 'app.css', static / 'css' / 'app.css')
+        self.tailwind(
+            tailwind, assets / 'critical.css', static / 'css' / 'critical.css',
+            '--content', ','.join(options['critical_templates']),
+        )
+        self.stdout.write(self.style.SUCCESS('Assets built; run collectstatic to hash and compress them'))
+
+    def tailwind(self, tailwind, source, output, *extra):
+        subprocess.run(
+            [str(tailwind), '-c', 'tailwind.config.js', '-i', str(source), '-o', str(output), '--minify', *extra],
+            cwd=self.base, check=True,
+        )
+        self.report(output)
+
+    def copy_vazirmatn(self, fonts_dir):
+        package = self.node_modules / 'vazirmatn'
+        for weight in VAZIRMATN_WEIGHTS:
+            name = f'Vazirmatn-{weight}.woff2'
+            found = sorted(package.rglob(name), key=lambda path: 'webfonts' not in path.parts)
+            if not found:
+                raise CommandError(f'{name} not found in {package}')
+            shutil.copyfile(found[0], fonts_dir / name)
+
+    def used_icons(self):
+        sources = [*(self.base / 'store' / 'templates').rglob('*.html'), self.base / 'store' / 'views.py']
+        icons = set()
+        for path in sources:
+            icons.update(ICON_PATTERN.findall(path.read_text(encoding='utf-8')))
+        return icons
+
+    def build_icons(self, output, fonts_dir):
+        """Write Font Awesome's CSS with only the icons the templates use."""
+        package = self.node_modules / '@fortawesome' / 'fontawesome-free'
+        css = (package / 'css' / 'all.css').read_text(encoding='utf-8')
+        icons = self.used_icons()
+        codepoints = set()
+
+        def keep_if_used(match):
+            names = re.findall(r'\.fa-([\w-]+)', match.group('selectors'))
+            if not icons.intersection(names):
+                return ''
+            codepoints.update(int(code, 16) for code in re.findall(r'\\([0-9a-fA-F]{1,6})', match.group('content')))
+            return match.group(0)
+
+        css = ICON_RULE.sub(keep_if_used, css)
+        # Fonts sit next to the bundle's css/ directory; woff2 is enough for
+        # every browser Tailwind supports
+        css = css.replace('../webfonts/', '../fonts/')
+        css = re.sub(r',\s*url\("[^"]+\.ttf"\)\s*format\("truetype"\)', '', css)
+        output.write_text(css, encoding='utf-8')
+        self.stdout.write(f'{len(icons)} icon names used, {len(codepoints)} glyphs kept')
+
+        for name in sorted(set(re.findall(r'\.\./fonts/(fa-[\w-]+\.woff2)', css))):
+            source, target = package / 'webfonts' / name, fonts_dir / name
+            if subset is None:
+                self.stderr.write(f'fonttools is not installed, copying {name} without subsetting')
+                shutil.copyfile(source, target)
+                continue
+            subset_options = subset.Options()
+            subset_options.flavor = 'woff2'
+            font = subset.load_font(str(source), subset_options)
+            subsetter = subset.Subsetter(subset_options)
+            subsetter.populate(unicodes=codepoints)
+            subsetter.subset(font)
+            subset.save_font(font, str(target), subset_options)
+            self.report(target, source)
+
+    def report(self, path, original=None):
+        size = path.stat().st_size / 1024
+        if original is None:
+            self.stdout.write(f'{path.relative_to(self.base)}: {size:.1f} KiB')
+        else:
+            self.stdout.write(
+                f'{path.relative_to(self.base)}: {size:.1f} KiB (from {original.stat().st_size / 1024:.1f} KiB)'
+            )
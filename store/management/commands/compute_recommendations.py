@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.recommendations import TOP_K, rebuild_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Compute "frequently bought together" product recommendations from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rebuild every product instead of only those in orders placed since the last run',
+        )
+        parser.add_argument('--top-k', type=int, default=TOP_K, help='Neighbours stored per product')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        refreshed = rebuild_recommendations(full=options['full'], top_k=options['top_k'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed recommendations for {refreshed} products in {elapsed:.2f}s'
+        ))
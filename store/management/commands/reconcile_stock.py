@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from store import catalog, routers
+from store.inventory import purge_expired_reservations
+from store.models import Product, StockMovement
+
+
+class Command(BaseCommand):
+    help = 'Verify Product.stock_quantity against the stock ledger in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Reset mismatched balances to the ledger total',
+        )
+
+    def handle(self, *args, **options):
+        # Balances must be read from the same database as the ledger
+        with routers.primary():
+            self.reconcile(options)
+
+    def reconcile(self, options):
+        batch_size = options['batch_size']
+        purged = purge_expired_reservations()
+        if purged:
+            self.stdout.write(f'Purged {purged} expired reservations')
+
+        checked = mismatched = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                balances = Product.objects.filter(pk__gt=last_pk).order_by('pk')
+                if options['fix']:
+                    balances = balances.select_for_update()
+                balances = list(balances.values_list('pk', 'stock_quantity')[:batch_size])
+                if not balances:
+                    break
+                last_pk = balances[-1][0]
+
+                ledger = dict(
+                    StockMovement.objects.filter(product_id__in=[pk for pk, _ in balances])
+                    .values('product_id')
+                    .annotate(total=Sum('quantity'))
+                    .values_list('product_id', 'total')
+                )
+                for pk, stock_quantity in balances:
+                    expected = ledger.get(pk, 0)
+                    if stock_quantity == expected:
+                        continue
+                    mismatched += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'Product {pk}: balance {stock_quantity}, ledger {expected}'
+                    ))
+                    if options['fix']:
+                        Product.objects.filter(pk=pk).update(stock_quantity=max(0, expected))
+            checked += len(balances)
+
+        if mismatched and options['fix']:
+            catalog.bump()
+        style = self.style.SUCCESS if not mismatched else self.style.ERROR
+        self.stdout.write(style(f'Checked {checked} products, {mismatched} mismatched'))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.popularity import refresh_popularity
+
+
+class Command(BaseCommand):
+    help = 'Recompute the best-selling scores used to sort the product listing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=int, help='Only count orders from this many days back')
+        parser.add_argument('--half-life-days', type=float, help='Age at which a sale counts half')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        changed = refresh_popularity(options['window_days'], options['half_life_days'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated popularity for {changed} products in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import archive
+from store.models import ArchivedOrder
+
+
+class Command(BaseCommand):
+    help = 'Move archived orders back into the live order tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('order_numbers', nargs='*', help='Order numbers to restore')
+        parser.add_argument('--user', help='Restore every archived order of this username')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if not options['order_numbers'] and not options['user']:
+            raise CommandError('Give order numbers or --user')
+        archived_orders = ArchivedOrder.objects.all()
+        if options['order_numbers']:
+            archived_orders = archived_orders.filter(order_number__in=options['order_numbers'])
+        if options['user']:
+            archived_orders = archived_orders.filter(user__username=options['user'])
+        restored = archive.restore(archived_orders, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Restored {restored} orders'))
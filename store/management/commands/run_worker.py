@@ -0,0 +1,78 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from store import jobs, routers
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (emails etc.) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help='Jobs to run at once')
+        parser.add_argument(
+            '--poll-interval', type=float, default=None,
+            help='Seconds to wait when the queue is empty (default JOB_POLL_SECONDS)',
+        )
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.once = options['once']
+        self.poll = options['poll_interval'] or getattr(settings, 'JOB_POLL_SECONDS', 2)
+        # Finish the jobs in hand on SIGTERM/Ctrl-C instead of abandoning them
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: self.stopping.set())
+
+        self.requeue_stale()
+        purged = jobs.purge_finished(getattr(settings, 'JOB_KEEP_DAYS', 7))
+        if purged:
+            self.stdout.write(f'Purged {purged} finished jobs')
+
+        self.counts = {True: 0, False: 0}
+        self.lock = threading.Lock()
+        threads = [
+            threading.Thread(target=self.loop, args=(f'{jobs.worker_id()}:{n}',))
+            for n in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        # Join with a timeout so the main thread keeps receiving signals, and
+        # keep putting back jobs whose worker died while this one runs
+        requeue_every = getattr(settings, 'JOB_REQUEUE_SECONDS', 60)
+        next_requeue = time.monotonic() + requeue_every
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+            if not self.once and time.monotonic() >= next_requeue:
+                close_old_connections()
+                self.requeue_stale()
+                next_requeue = time.monotonic() + requeue_every
+        self.stdout.write(self.style.SUCCESS(f'{self.counts[True]} jobs done, {self.counts[False]} failed'))
+
+    def requeue_stale(self):
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs')
+
+    def loop(self, name):
+        try:
+            while not self.stopping.is_set():
+                # Jobs read what the request that queued them just wrote
+                with routers.primary():
+                    job = jobs.claim(name)
+                    if job is not None:
+                        succeeded = jobs.execute(job)
+                        with self.lock:
+                            self.counts[succeeded] += 1
+                        continue
+                if self.once:
+                    return
+                self.stopping.wait(self.poll)
+                close_old_connections()
+        finally:
+            connection.close()
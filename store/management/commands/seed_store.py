@@ -0,0 +1,297 @@
+import io
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from store import catalog, routers
+from store.popularity import refresh_popularity
+from store.models import (
+    Category, DiscountCode, Order, OrderItem, Product, SiteSettings, StockMovement, UserProfile,
+)
+
+CATEGORIES = [
+    ('سبزیجات', (76, 140, 74)),
+    ('میوه', (214, 94, 62)),
+    ('لبنیات', (232, 226, 210)),
+    ('غلات', (201, 164, 92)),
+    ('حبوبات', (150, 102, 64)),
+    ('خشکبار', (122, 82, 48)),
+    ('ادویه', (196, 70, 42)),
+    ('عسل', (230, 170, 40)),
+    ('روغن', (190, 180, 60)),
+    ('چای و دمنوش', (90, 120, 70)),
+]
+PRODUCTS = ['برنج', 'عسل', 'زعفران', 'پسته', 'گردو', 'بادام', 'خرما', 'کشمش', 'عدس', 'لوبیا',
+            'نخود', 'ماش', 'گوجه', 'خیار', 'سیب', 'انار', 'پرتقال', 'انجیر', 'کره', 'ماست',
+            'پنیر', 'روغن زیتون', 'چای', 'زیره', 'زردچوبه', 'گلپر', 'آویشن', 'گل‌گاوزبان']
+QUALITIES = ['ارگانیک', 'طبیعی', 'ممتاز', 'درجه یک', 'محلی', 'دست‌چین', 'تازه']
+REGIONS = ['گیلان', 'مازندران', 'خراسان', 'کرمان', 'فارس', 'آذربایجان', 'اصفهان', 'یزد',
+           'کردستان', 'لرستان', 'سیستان', 'خوزستان']
+SIZES = ['۲۵۰ گرمی', '۵۰۰ گرمی', '۱ کیلویی', '۲ کیلویی', '۵ کیلویی']
+FIRST_NAMES = ['علی', 'محمد', 'رضا', 'حسین', 'مهدی', 'سارا', 'مریم', 'فاطمه', 'زهرا', 'نرگس',
+               'امیر', 'نیما', 'پریسا', 'شیرین', 'کاوه', 'آرش', 'لیلا', 'مینا', 'بهار', 'سینا']
+LAST_NAMES = ['محمدی', 'حسینی', 'احمدی', 'رضایی', 'کریمی', 'موسوی', 'جعفری', 'صادقی',
+              'رحیمی', 'کاظمی', 'نوری', 'تهرانی', 'شیرازی', 'اصفهانی', 'قاسمی', 'یزدانی']
+# Most orders are delivered; a few never get past payment
+STATUSES = (['pending', 'paid', 'processing', 'shipped', 'delivered', 'cancelled'], [4, 3, 3, 5, 80, 5])
+
+
+class Command(BaseCommand):
+    help = 'Generate a large, deterministic synthetic catalogue with users and order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--items-per-order', type=float, default=5,
+                            help='Average number of distinct products per order')
+        parser.add_argument('--discount-codes', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Exponent of the Zipf distribution of product popularity')
+        parser.add_argument('--stock', type=int,
+                            help='Give every product this much stock instead of a random amount')
+        parser.add_argument('--user-prefix', default='user',
+                            help='Usernames are this prefix followed by the user id')
+        parser.add_argument('--password', default='tarla-seed-password',
+                            help='Password shared by every generated user')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['products'] < 1 and options['orders']:
+            raise CommandError('Orders need at least one product')
+        if options['users'] < 1 and options['orders']:
+            raise CommandError('Orders need at least one user')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.totals = {}
+        started = time.monotonic()
+
+        # Primary keys are allocated from what is already on the primary
+        with routers.primary():
+            SiteSettings.objects.get_or_create(pk=1)
+            categories = self.create_categories()
+            products = self.create_products(options['products'], categories, options['stock'])
+            users = self.create_users(options['users'], options['user_prefix'], options['password'])
+            self.create_discount_codes(options['discount_codes'])
+            self.create_orders(options['orders'], options['items_per_order'], users, products, options['zipf'])
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [User, UserProfile, Product, StockMovement, Order, OrderItem]
+            ):
+                cursor.execute(sql)
+        catalog.bump()
+        if options['orders']:
+            refresh_popularity()
+
+        elapsed = time.monotonic() - started
+        rows = sum(count for count, _ in self.totals.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)'
+        ))
+
+    def insert(self, model, columns, rows):
+        """Insert ``rows`` (tuples in ``columns`` order) in chunks with executemany.
+
+        Skips model instances and signals entirely, which is what makes millions
+        of rows feasible; callers supply primary keys and auto_now values.
+        """
+        table = connection.ops.quote_name(model._meta.db_table)
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            table,
+            ', '.join(connection.ops.quote_name(column) for column in columns),
+            ', '.join(['%s'] * len(columns)),
+        )
+        count, elapsed = self.totals.get(model._meta.label, (0, 0.0))
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.batch_size))
+            if not chunk:
+                break
+            started = time.monotonic()
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, chunk)
+            elapsed += time.monotonic() - started
+            count += len(chunk)
+        self.totals[model._meta.label] = (count, elapsed)
+
+    def report(self, model):
+        count, elapsed = self.totals.get(model._meta.label, (0, 0.0))
+        rate = f'{count / elapsed:,.0f} rows/s' if elapsed else '-'
+        self.stdout.write(f'{model.__name__}: {count} rows ({rate})')
+
+    def next_pk(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def timestamp(self, days_ago):
+        value = self.now - timedelta(days=days_ago)
+        return connection.ops.adapt_datetimefield_value(value)
+
+    def placeholder_image(self, index, colour):
+        # One flat image per category, drawn once and shared by its products
+        name = f'products/placeholder-{index}.jpg'
+        if not default_storage.exists(name):
+            from PIL import Image
+
+            buffer = io.BytesIO()
+            Image.new('RGB', (600, 600), colour).save(buffer, 'JPEG', quality=70)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+        return name
+
+    def create_categories(self):
+        # One by one: save() assigns the slug and materialized path
+        existing = set(Category.objects.values_list('name', flat=True))
+        for name, _ in CATEGORIES:
+            if name not in existing:
+                Category.objects.create(name=name, description=f'محصولات ارگانیک دسته {name}')
+        by_name = dict(Category.objects.values_list('name', 'pk'))
+        return [
+            (by_name[name], self.placeholder_image(index, colour))
+            for index, (name, colour) in enumerate(CATEGORIES)
+        ]
+
+    def create_products(self, count, categories, stock):
+        rng = self.rng
+        first_pk = self.next_pk(Product)
+        prices = {}
+        stocks = {}
+
+        def rows():
+            for pk in range(first_pk, first_pk + count):
+                category_id, image = rng.choice(categories)
+                name = f'{rng.choice(PRODUCTS)} {rng.choice(QUALITIES)} {rng.choice(REGIONS)} {rng.choice(SIZES)}'
+                # Prices are roughly log-normal, rounded to 1000 toman
+                prices[pk] = max(5_000, int(rng.lognormvariate(12, 0.8)) // 1_000 * 1_000)
+                stocks[pk] = stock if stock is not None else rng.randint(0, 500)
+                yield (
+                    pk, name, f'{name}، برداشت شده از مزارع {rng.choice(REGIONS)}.', prices[pk], image,
+                    category_id, rng.random() < 0.02, rng.random() < 0.97, stocks[pk],
+                    self.timestamp(rng.uniform(0, 730)), 0,
+                )
+
+        self.insert(Product, [
+            'id', 'name', 'description', 'price', 'image', 'category_id', 'is_featured',
+            'is_available', 'stock_quantity', 'created_at', 'popularity_score',
+        ], rows())
+        self.report(Product)
+
+        # Opening balances keep the stock ledger reconciled
+        first_movement = self.next_pk(StockMovement)
+        self.insert(StockMovement, [
+            'id', 'product_id', 'kind', 'quantity', 'note', 'created_at',
+        ], (
+            (first_movement + offset, pk, StockMovement.RECEIPT, quantity, 'موجودی اولیه', self.timestamp(0))
+            for offset, (pk, quantity) in enumerate(stocks.items()) if quantity
+        ))
+        self.report(StockMovement)
+        return prices
+
+    def create_users(self, count, prefix, password):
+        rng = self.rng
+        first_pk = self.next_pk(User)
+        # Hashing is deliberately slow, so every user shares one hash
+        password_hash = make_password(password)
+        names = [(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)) for _ in range(count)]
+        joined = [self.timestamp(rng.uniform(0, 730)) for _ in range(count)]
+
+        self.insert(User, [
+            'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+            'is_staff', 'is_active', 'date_joined',
+        ], (
+            (first_pk + i, password_hash, False, f'{prefix}{first_pk + i}', first, last,
+             f'{prefix}{first_pk + i}@example.com', False, True, joined[i])
+            for i, (first, last) in enumerate(names)
+        ))
+        self.report(User)
+
+        first_profile = self.next_pk(UserProfile)
+        self.insert(UserProfile, ['id', 'user_id', 'phone', 'address', 'created_at'], (
+            (first_profile + i, first_pk + i, f'0912{rng.randrange(10 ** 7):07d}',
+             f'{rng.choice(REGIONS)}، خیابان {rng.choice(LAST_NAMES)}، پلاک {rng.randint(1, 200)}', joined[i])
+            for i in range(count)
+        ))
+        self.report(UserProfile)
+        return list(range(first_pk, first_pk + count))
+
+    def create_discount_codes(self, count):
+        rng = self.rng
+        alphabet = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+        codes = []
+        for _ in range(count):
+            max_usage = rng.choice([1, 10, 100, 1000])
+            start = self.now - timedelta(days=rng.uniform(0, 365))
+            codes.append(DiscountCode(
+                code=''.join(rng.choices(alphabet, k=8)),
+                discount_percent=rng.choice([5, 10, 15, 20, 25, 30]),
+                max_usage=max_usage,
+                used_count=rng.randint(0, max_usage),
+                is_active=rng.random() < 0.9,
+                valid_from=start,
+                valid_to=start + timedelta(days=rng.choice([7, 30, 90, 365])),
+            ))
+        created = DiscountCode.objects.bulk_create(codes, ignore_conflicts=True)
+        self.totals[DiscountCode._meta.label] = (len(created), 0.0)
+        self.stdout.write(f'DiscountCode: {len(created)} rows')
+
+    def create_orders(self, count, items_per_order, users, prices, exponent):
+        rng = self.rng
+        product_ids = list(prices)
+        # Zipfian popularity, with ranks shuffled so it doesn't follow the ids
+        ranks = list(range(1, len(product_ids) + 1))
+        rng.shuffle(ranks)
+        cum_weights = list(itertools.accumulate(1 / rank ** exponent for rank in ranks))
+        statuses, status_weights = STATUSES
+        first_pk = self.next_pk(Order)
+        first_item = self.next_pk(OrderItem)
+        items = []
+
+        def orders():
+            item_pk = first_item
+            for pk in range(first_pk, first_pk + count):
+                # Basket sizes are geometric around the requested mean
+                size = 1
+                while rng.random() > 1 / items_per_order and size < len(product_ids):
+                    size += 1
+                basket = dict.fromkeys(rng.choices(product_ids, cum_weights=cum_weights, k=size))
+                total = 0
+                for product_id in basket:
+                    quantity = rng.choices((1, 2, 3, 4), weights=(70, 20, 7, 3))[0]
+                    items.append((item_pk, pk, product_id, quantity, prices[product_id]))
+                    item_pk += 1
+                    total += quantity * prices[product_id]
+                shipping = 0 if total >= 500_000 else 25_000
+                created = self.timestamp(rng.uniform(0, 365))
+                yield (
+                    pk, rng.choice(users), f'TS{pk:012d}', total, shipping, total + shipping,
+                    rng.choices(statuses, weights=status_weights)[0], created, created,
+                )
+
+        columns = [
+            'id', 'user_id', 'order_number', 'total_price', 'shipping_cost', 'final_price',
+            'status', 'created_at', 'updated_at',
+        ]
+        order_rows = orders()
+        while True:
+            # Generate orders a batch at a time and write their items straight after
+            before = self.totals.get(Order._meta.label, (0, 0.0))[0]
+            self.insert(Order, columns, itertools.islice(order_rows, self.batch_size))
+            if self.totals[Order._meta.label][0] == before:
+                break
+            self.insert(OrderItem, ['id', 'order_id', 'product_id', 'quantity', 'price'], items)
+            items.clear()
+        self.report(Order)
+        self.report(OrderItem)
@@ -0,0 +1,235 @@
+"""
+Process-safe metrics shared by every gunicorn worker.
+
+Each process appends its samples to its own memory-mapped file in METRICS_DIR,
+so recording is a dict lookup and an in-place float update with no locking
+between workers.  The metrics endpoint sums every file in the directory.  When
+gunicorn recycles a worker, the master folds the dead worker's file into an
+archive file (see gunicorn.conf.py), so totals survive recycling without the
+directory growing forever.
+
+File layout: a 4 byte "used" offset and 4 bytes of padding, followed by entries
+of a 4 byte key length, the UTF-8 key padded to 8 bytes and a float64 value.
+"""
+import glob
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import defaultdict
+
+INITIAL_SIZE = 64 * 1024
+ARCHIVE_FILE = 'archive.db'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'store_requests_total': ('counter', 'Requests served, by URL name, method and status.', None),
+    'store_request_duration_seconds': ('histogram', 'Request latency by URL name.', LATENCY_BUCKETS),
+    'store_request_db_queries': ('histogram', 'Database queries per request by URL name.', QUERY_BUCKETS),
+    'store_cart_additions_total': ('counter', 'Products added to carts.', None),
+    'store_checkouts_total': ('counter', 'Checkout attempts by outcome.', None),
+    'store_checkout_revenue_toman_total': ('counter', 'Final price of placed orders in toman.', None),
+    'store_cache_requests_total': ('counter', 'Cache lookups by tier (l1, shared) and result (hit, miss).', None),
+    'store_response_bytes_total': ('counter', 'Bytes of compressible responses before (identity) and after compression.', None),
+}
+
+
+def metrics_dir():
+    from django.conf import settings
+    return str(getattr(settings, 'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'tarla-metrics')))
+
+
+class MmapedDict:
+    """A str -> float dict backed by a file that only this process writes."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._file.truncate(INITIAL_SIZE)
+            size = INITIAL_SIZE
+        self._capacity = size
+        self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        self._positions = {}
+        self._used = struct.unpack_from('i', self._mmap, 0)[0]
+        if self._used == 0:
+            self._used = 8
+            struct.pack_into('i', self._mmap, 0, self._used)
+        for key, _, position in _read_entries(self._mmap, self._used):
+            self._positions[key] = position
+
+    def _add_key(self, key):
+        encoded = key.encode('utf-8')
+        padded = encoded + b' ' * (8 - (len(encoded) + 4) % 8)
+        entry = struct.pack(f'i{len(padded)}sd', len(encoded), padded, 0.0)
+        if self._used + len(entry) > self._capacity:
+            while self._used + len(entry) > self._capacity:
+                self._capacity *= 2
+            # Unmap the old size first; each growth would leak a mapping otherwise
+            self._mmap.close()
+            self._file.truncate(self._capacity)
+            self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        self._mmap[self._used:self._used + len(entry)] = entry
+        self._used += len(entry)
+        # Publish the entry only once it is fully written
+        struct.pack_into('i', self._mmap, 0, self._used)
+        position = self._used - 8
+        self._positions[key] = position
+        return position
+
+    def inc(self, key, amount):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._add_key(key)
+            value = struct.unpack_from('d', self._mmap, position)[0]
+            struct.pack_into('d', self._mmap, position, value + amount)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+def _read_entries(data, used):
+    position = 8
+    while position < used:
+        key_length = struct.unpack_from('i', data, position)[0]
+        key = bytes(data[position + 4:position + 4 + key_length]).decode('utf-8')
+        position += 4 + key_length + (8 - (key_length + 4) % 8)
+        yield key, struct.unpack_from('d', data, position)[0], position
+        position += 8
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 8:
+        return
+    used = struct.unpack_from('i', data, 0)[0]
+    for key, value, _ in _read_entries(data, used):
+        yield key, value
+
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def _process_store():
+    global _store, _store_pid
+    pid = os.getpid()
+    if _store_pid != pid:
+        # First use in this process, or we were forked from a process that
+        # already had a file open (gunicorn preload_app)
+        with _store_lock:
+            if _store_pid != pid:
+                directory = metrics_dir()
+                os.makedirs(directory, exist_ok=True)
+                _store = MmapedDict(os.path.join(directory, f'worker_{pid}.db'))
+                _store_pid = pid
+    return _store
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False)
+
+
+def inc(name, amount=1, **labels):
+    _process_store().inc(_key(name, labels), amount)
+
+
+def observe(name, value, **labels):
+    buckets = METRICS[name][2]
+    store = _process_store()
+    # Buckets are stored non-cumulatively and summed up on export
+    bucket = next((str(bound) for bound in buckets if value <= bound), '+Inf')
+    store.inc(_key(name + '_bucket', dict(labels, le=bucket)), 1)
+    store.inc(_key(name + '_sum', labels), value)
+    store.inc(_key(name + '_count', labels), 1)
+
+
+def observe_request(view, method, status, duration, queries):
+    inc('store_requests_total', view=view, method=method, status=str(status))
+    observe('store_request_duration_seconds', duration, view=view)
+    observe('store_request_db_queries', queries, view=view)
+
+
+def merge_worker_file(directory, pid):
+    """Fold a dead worker's samples into the archive file and remove it.
+
+    Only the gunicorn master calls this, so the archive has a single writer.
+    """
+    path = os.path.join(directory, f'worker_{pid}.db')
+    if not os.path.exists(path):
+        return
+    archive = MmapedDict(os.path.join(directory, ARCHIVE_FILE))
+    try:
+        for key, value in read_file(path):
+            archive.inc(key, value)
+    finally:
+        archive.close()
+    os.remove(path)
+
+
+def collect():
+    totals = defaultdict(float)
+    for path in glob.glob(os.path.join(metrics_dir(), '*.db')):
+        try:
+            for key, value in read_file(path):
+                totals[key] += value
+        except (OSError, struct.error, UnicodeDecodeError):
+            # A worker may be mid-way through growing its file
+            continue
+    return totals
+
+
+def _format_value(value):
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus():
+    """Aggregate every worker's samples in the Prometheus text format."""
+    samples = defaultdict(list)
+    for key, value in collect().items():
+        name, labels = json.loads(key)
+        samples[name].append(([tuple(label) for label in labels], value))
+
+    lines = []
+    for name, (kind, help_text, bounds) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for labels, value in sorted(samples.get(name, [])):
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            continue
+
+        # Histogram buckets become cumulative per label set
+        buckets = defaultdict(dict)
+        for labels, value in samples.get(name + '_bucket', []):
+            le = dict(labels)['le']
+            buckets[tuple(label for label in labels if label[0] != 'le')][le] = value
+        for labels, counts in sorted(buckets.items()):
+            cumulative = 0.0
+            for le in [str(bound) for bound in bounds] + ['+Inf']:
+                cumulative += counts.get(le, 0)
+                lines.append(f'{name}_bucket{_format_labels(list(labels) + [("le", le)])} {_format_value(cumulative)}')
+        for suffix in ('_sum', '_count'):
+            for labels, value in sorted(samples.get(name + suffix, [])):
+                lines.append(f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
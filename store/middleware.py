@@ -0,0 +1,278 @@
+import logging
+import math
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.utils.cache import has_vary_header, patch_cache_control, patch_vary_headers
+
+from . import compression, instrumentation, metrics, preload, routers, throttling
+
+performance_logger = logging.getLogger('store.performance')
+
+
+class RequestTimingMiddleware:
+    """Measure each request and report it as a Server-Timing header.
+
+    The header is sent to staff (or everyone with SERVER_TIMING_PUBLIC), and
+    requests slower than SLOW_REQUEST_THRESHOLD_MS are logged with their
+    slowest SQL statements.  Every request is also recorded in the shared
+    metrics store by URL name.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', 500) / 1000
+        self.public = getattr(settings, 'SERVER_TIMING_PUBLIC', False)
+
+    def __call__(self, request):
+        with instrumentation.measure() as stats:
+            response = self.get_response(request)
+
+        if self.public or self._is_staff(request):
+            response['Server-Timing'] = stats.server_timing()
+        if stats.elapsed >= self.threshold:
+            self._log_slow_request(request, response, stats)
+
+        match = getattr(request, 'resolver_match', None)
+        metrics.observe_request(
+            view=(match.url_name or match.view_name) if match else '<unresolved>',
+            method=request.method,
+            status=response.status_code,
+            duration=stats.elapsed,
+            queries=stats.db_count,
+        )
+        return response
+
+    def _is_staff(self, request):
+        # Only look at a user the request already loaded; resolving it here
+        # would cost a session and user query on requests that never needed one
+        user = getattr(request, '_cached_user', None)
+        return user is not None and user.is_staff
+
+    def _log_slow_request(self, request, response, stats):
+        lines = [
+            f'{sql[:500]} ({duration * 1000:.1f}ms)'
+            for duration, sql in stats.slowest_queries()
+        ]
+        performance_logger.warning(
+            'Slow request %s %s -> %s in %.0fms: %d queries (%.0fms), templates %.0fms, cache %d/%d hit\n  %s',
+            request.method,
+            request.get_full_path(),
+            response.status_code,
+            stats.elapsed * 1000,
+            stats.db_count,
+            stats.db_time * 1000,
+            stats.template_time * 1000,
+            stats.cache_hits,
+            stats.cache_hits + stats.cache_misses,
+            '\n  '.join(lines),
+        )
+
+
+class CompressionMiddleware:
+    """Compress HTML and JSON responses with Brotli or gzip.
+
+    Responses under COMPRESSION_MIN_SIZE bytes aren't worth it.  Pages that
+    used the CSRF token get BREACH padding and skip the cache of compressed
+    pages; see store.compression.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 512)
+        self.cache_seconds = getattr(settings, 'COMPRESSION_CACHE_SECONDS', 600)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not compression.is_compressible(response, self.min_size):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = compression.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        content = response.content
+        if compression.carries_token(request):
+            coding = 'gzip'
+            compressed = compression.compress_secret(content)
+        else:
+            cache_control = response.get('Cache-Control', '')
+            private = 'private' in cache_control or 'no-store' in cache_control
+            compressed = compression.compress(content, coding, 0 if private else self.cache_seconds)
+        if len(compressed) >= len(content):
+            return response
+
+        metrics.inc('store_response_bytes_total', len(content), encoding='identity')
+        metrics.inc('store_response_bytes_total', len(compressed), encoding=coding)
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        # A strong ETag would claim the compressed bytes equal the original
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+
+class PublicPageMiddleware:
+    """Render catalog pages for cookieless visitors so a CDN can share them.
+
+    For GET requests to the URL names in PUBLIC_PAGES from clients without a
+    session or messages cookie, the page is rendered without the session:
+    the user is anonymous, the cart is empty and forms get their CSRF token
+    from the session_state endpoint (see the csrf_field tag).  If nothing
+    else made the response personal, it is marked ``Cache-Control: public``
+    with PUBLIC_PAGE_S_MAXAGE for shared caches.  Pages an edge cache serves
+    to a visitor who does have a session fill in the cart badge, messages
+    and account link from session_state as well.
+    """
+
+    def __init__(self, get_response):
+        self.pages = frozenset(getattr(settings, 'PUBLIC_PAGES', ()))
+        if not self.pages:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.cookies = (settings.SESSION_COOKIE_NAME, getattr(settings, 'MESSAGE_COOKIE_NAME', 'messages'))
+        self.max_age = getattr(settings, 'PUBLIC_PAGE_MAX_AGE', 60)
+        self.s_maxage = getattr(settings, 'PUBLIC_PAGE_S_MAXAGE', 300)
+
+    def __call__(self, request):
+        request.public_page = False
+        response = self.get_response(request)
+        if (
+            request.public_page
+            and response.status_code == 200
+            and not response.cookies
+            and not has_vary_header(response, 'Cookie')
+        ):
+            patch_cache_control(response, public=True, max_age=self.max_age, s_maxage=self.s_maxage)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if (
+            request.method in ('GET', 'HEAD')
+            and match is not None
+            and match.url_name in self.pages
+            and not any(name in request.COOKIES for name in self.cookies)
+        ):
+            request.public_page = True
+            # Resolving the real user would load the session
+            request.user = AnonymousUser()
+        return None
+
+
+class EarlyHintsMiddleware:
+    """Let the browser fetch a page's critical assets while the view runs.
+
+    For GET requests to the URL names in EARLY_HINTS_PAGES, the preload links
+    from store.preload are sent as a ``103 Early Hints`` response before the
+    view starts when the server offers ``wsgi.early_hints`` (gunicorn does),
+    and as a Link header on the final HTML response either way, for servers
+    without it and for CDNs that turn Link headers into their own hints.
+    """
+
+    def __init__(self, get_response):
+        self.pages = frozenset(getattr(settings, 'EARLY_HINTS_PAGES', ()))
+        if not self.pages:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.preload_links = None
+        response = self.get_response(request)
+        if (
+            request.preload_links
+            and response.status_code == 200
+            and response.get('Content-Type', '').startswith('text/html')
+        ):
+            existing = response.get('Link')
+            response['Link'] = ', '.join([existing, *request.preload_links] if existing else request.preload_links)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if request.method not in ('GET', 'HEAD') or match is None or match.url_name not in self.pages:
+            return None
+        request.preload_links = preload.links(match.url_name, view_kwargs)
+        send_early_hints = request.META.get('wsgi.early_hints')
+        if send_early_hints is not None:
+            send_early_hints([('Link', value) for value in request.preload_links])
+        return None
+
+
+class ReplicaPinMiddleware:
+    """Read from the primary for a while after a client writes.
+
+    Requests start on the replicas (see store.routers); a request that writes
+    gets a short-lived cookie that keeps the client's next requests on the
+    primary until replication has caught up.
+    """
+
+    cookie_name = 'db_primary'
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DATABASE_REPLICAS', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+    def __call__(self, request):
+        with routers.request_scope(pinned=self.cookie_name in request.COOKIES) as state:
+            response = self.get_response(request)
+        if state.wrote:
+            response.set_cookie(
+                self.cookie_name,
+                '1',
+                max_age=self.pin_seconds,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+
+class ThrottleMiddleware:
+    """Reject bursts to expensive views with a 429 before any session or DB work.
+
+    Rates come from settings.THROTTLE_RATES keyed by URL name; only unsafe
+    methods are counted.  Logins are also refused while the username has
+    had too many failures from the client's address.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'THROTTLE_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.rates = {
+            name: throttling.parse_rate(rate)
+            for name, rate in getattr(settings, 'THROTTLE_RATES', {}).items()
+        }
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return None
+        match = request.resolver_match
+        rate = self.rates.get(match.url_name) if match else None
+        if rate is None:
+            return None
+
+        wait = throttling.consume(match.url_name, throttling.identities(request), *rate)
+        if match.url_name == 'login':
+            wait = max(wait, throttling.login_wait(request))
+        if not wait:
+            return None
+        response = HttpResponse(
+            'تعداد درخواست‌های شما بیش از حد مجاز است. لطفاً کمی بعد دوباره تلاش کنید.',
+            status=429,
+            content_type='text/plain; charset=utf-8',
+        )
+        # Rounded first so float noise doesn't add a second (10.000000001 -> 11)
+        response['Retry-After'] = str(math.ceil(round(wait, 6)))
+        return response
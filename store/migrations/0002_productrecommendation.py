@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField(verbose_name='تعداد خرید همزمان')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='رتبه')),
+                ('computed_at', models.DateTimeField(verbose_name='تاریخ محاسبه')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='store.product', verbose_name='محصول')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='store.product', verbose_name='محصول پیشنهادی')),
+            ],
+            options={
+                'verbose_name': 'پیشنهاد محصول',
+                'verbose_name_plural': 'پیشنهادهای محصول',
+                'ordering': ['product', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('product', 'rank'), name='unique_recommendation_rank')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_productrecommendation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'ورود به انبار'), ('sale', 'فروش'), ('cancellation', 'لغو سفارش'), ('adjustment', 'اصلاح دستی')], max_length=20, verbose_name='نوع')),
+                ('quantity', models.IntegerField(verbose_name='تغییر موجودی')),
+                ('note', models.CharField(blank=True, max_length=200, verbose_name='توضیحات')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ثبت')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='ثبت توسط')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='store.order', verbose_name='سفارش')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='store.product', verbose_name='محصول')),
+            ],
+            options={
+                'verbose_name': 'گردش موجودی',
+                'verbose_name_plural': 'دفتر انبار',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40, verbose_name='کلید نشست')),
+                ('quantity', models.PositiveIntegerField(verbose_name='تعداد')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='انقضا')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.product', verbose_name='محصول')),
+            ],
+            options={
+                'verbose_name': 'رزرو موجودی',
+                'verbose_name_plural': 'رزروهای موجودی',
+                'constraints': [models.UniqueConstraint(fields=('session_key', 'product'), name='unique_session_reservation')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:30
+
+from django.db import migrations
+
+
+def create_opening_balances(apps, schema_editor):
+    # Seed the ledger with each product's current balance so that
+    # reconcile_stock starts from a consistent state
+    db_alias = schema_editor.connection.alias
+    Product = apps.get_model('store', 'Product')
+    StockMovement = apps.get_model('store', 'StockMovement')
+    StockMovement.objects.using(db_alias).bulk_create(
+        [
+            StockMovement(
+                product_id=product_id,
+                kind='adjustment',
+                quantity=stock_quantity,
+                note='موجودی اولیه',
+            )
+            for product_id, stock_quantity in Product.objects.using(db_alias).filter(
+                stock_quantity__gt=0
+            ).values_list('id', 'stock_quantity').iterator()
+        ],
+        batch_size=500,
+    )
+
+
+def delete_opening_balances(apps, schema_editor):
+    StockMovement = apps.get_model('store', 'StockMovement')
+    StockMovement.objects.using(schema_editor.connection.alias).filter(kind='adjustment', note='موجودی اولیه', created_by=None).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_opening_balances, delete_opening_balances),
+    ]
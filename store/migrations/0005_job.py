@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_opening_stock_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='نام کار')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='ورودی')),
+                ('status', models.CharField(choices=[('queued', 'در صف'), ('running', 'در حال اجرا'), ('done', 'انجام شده'), ('failed', 'ناموفق')], default='queued', max_length=20, verbose_name='وضعیت')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='تعداد تلاش')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5, verbose_name='حداکثر تلاش')),
+                ('run_at', models.DateTimeField(verbose_name='زمان اجرا')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='شروع اجرا')),
+                ('locked_by', models.CharField(blank=True, max_length=100, verbose_name='اجرا کننده')),
+                ('last_error', models.TextField(blank=True, verbose_name='آخرین خطا')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='تاریخ پایان')),
+            ],
+            options={
+                'verbose_name': 'کار پس\u200cزمینه',
+                'verbose_name_plural': 'کارهای پس\u200cزمینه',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'run_at'], name='job_due_idx')],
+            },
+        ),
+    ]
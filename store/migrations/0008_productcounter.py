@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_product_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='روز')),
+                ('views', models.PositiveBigIntegerField(default=0, verbose_name='بازدید')),
+                ('cart_adds', models.PositiveBigIntegerField(default=0, verbose_name='افزودن به سبد')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='store.product', verbose_name='محصول')),
+            ],
+            options={
+                'verbose_name': 'آمار روزانه محصول',
+                'verbose_name_plural': 'آمار روزانه محصولات',
+                'ordering': ['-day', 'product'],
+                'indexes': [models.Index(fields=['day'], name='product_counter_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'day'), name='unique_product_counter_day')],
+            },
+        ),
+    ]
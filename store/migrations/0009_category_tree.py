@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def make_existing_categories_roots(apps, schema_editor):
+    # Every existing category becomes a root with a slug made from its name
+    Category = apps.get_model('store', 'Category')
+    categories = list(Category.objects.using(schema_editor.connection.alias).order_by('pk'))
+    used = set()
+    for category in categories:
+        base = slugify(category.name, allow_unicode=True)[:100] or 'category'
+        slug, n = base, 1
+        while slug in used:
+            n += 1
+            slug = f'{base}-{n}'
+        used.add(slug)
+        category.slug = slug
+        category.path = f'{category.pk}/'
+        category.depth = 0
+    Category.objects.using(schema_editor.connection.alias).bulk_update(
+        categories, ['slug', 'path', 'depth'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_productcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='store.category', verbose_name='دسته‌بندی والد'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        # Made unique in 0010, once every row has its own slug
+        migrations.AddField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, blank=True, max_length=120, null=True, verbose_name='نامک'),
+        ),
+        migrations.RunPython(make_existing_categories_roots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_category_tree'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, blank=True, help_text='در نشانی صفحه استفاده می‌شود؛ خالی بگذارید تا از نام ساخته شود.', max_length=120, unique=True, verbose_name='نامک'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_order_status_history'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='کلید')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='تاریخ انقضا')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_key', to='store.order', verbose_name='سفارش')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'کلید ثبت سفارش',
+                'verbose_name_plural': 'کلیدهای ثبت سفارش',
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_idempotencykey'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='شناسه سفارش')),
+                ('order_number', models.CharField(max_length=20, unique=True, verbose_name='شماره سفارش')),
+                ('total_price', models.PositiveIntegerField(verbose_name='مبلغ کل')),
+                ('shipping_cost', models.PositiveIntegerField(default=0, verbose_name='هزینه ارسال')),
+                ('final_price', models.PositiveIntegerField(verbose_name='مبلغ نهایی')),
+                ('status', models.CharField(choices=[('pending', 'در انتظار پرداخت'), ('paid', 'پرداخت شده'), ('processing', 'در حال آماده\u200cسازی'), ('shipped', 'ارسال شده'), ('delivered', 'تحویل داده شده'), ('cancelled', 'لغو شده')], max_length=20, verbose_name='وضعیت')),
+                ('created_at', models.DateTimeField(verbose_name='تاریخ سفارش')),
+                ('updated_at', models.DateTimeField(verbose_name='آخرین بروزرسانی')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ بایگانی')),
+                ('payload', models.BinaryField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'سفارش بایگانی\u200cشده',
+                'verbose_name_plural': 'سفارشات بایگانی\u200cشده',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at', '-id'], name='archived_order_history_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_archivedorder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_id', models.BigIntegerField(verbose_name='آخرین سفارش بررسی\u200cشده')),
+                ('products_refreshed', models.PositiveIntegerField(verbose_name='محصولات به\u200cروزشده')),
+                ('full', models.BooleanField(default=False, verbose_name='محاسبه کامل')),
+                ('finished_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان پایان')),
+            ],
+            options={
+                'verbose_name': 'اجرای محاسبه پیشنهادها',
+                'verbose_name_plural': 'اجراهای محاسبه پیشنهادها',
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_recommendationrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='slot',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='جایگاه اجرا'),
+        ),
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'running')), fields=('name', 'slot'), name='unique_running_job_slot'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_job_slot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedCooccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(verbose_name='تعداد خرید همزمان')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product', verbose_name='محصول همراه')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product', verbose_name='محصول')),
+            ],
+            options={
+                'verbose_name': 'خرید همزمان بایگانی\u200cشده',
+                'verbose_name_plural': 'خریدهای همزمان بایگانی\u200cشده',
+                'constraints': [models.UniqueConstraint(fields=('product', 'other'), name='unique_archived_cooccurrence')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_archivedcooccurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationrun',
+            name='last_status_change_id',
+            field=models.BigIntegerField(default=0, verbose_name='آخرین تغییر وضعیت بررسی\u200cشده'),
+        ),
+    ]
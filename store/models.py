@@ -1,9 +1,30 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
+from django.utils.text import slugify
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 class Category(models.Model):
     name = models.CharField(max_length=100, verbose_name='نام دسته‌بندی')
+    slug = models.SlugField(
+        max_length=120, unique=True, allow_unicode=True, blank=True,
+        help_text='در نشانی صفحه استفاده می‌شود؛ خالی بگذارید تا از نام ساخته شود.',
+        verbose_name='نامک'
+    )
+    parent = models.ForeignKey(
+        'self',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='children',
+        verbose_name='دسته‌بندی والد'
+    )
+    # Materialized path: the ids from the root down to this category, each
+    # followed by "/", so a whole subtree is one prefix lookup on this index
+    path = models.CharField(max_length=255, default='', editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     description = models.TextField(blank=True, verbose_name='توضیحات')
     is_active = models.BooleanField(default=True, verbose_name='فعال')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')
@@ -15,6 +36,51 @@ class Category(models.Model):
     
     def __str__(self):
         return self.name
+    
+    @staticmethod
+    def subtree_filter(path, prefix=''):
+        """Q for the categories under ``path``, itself included.
+
+        ``prefix`` reaches the category through a relation, e.g.
+        ``Product.objects.filter(Category.subtree_filter(path, 'category__'))``.
+        """
+        return Q(**{f'{prefix}path__startswith': path})
+    
+    def subtree(self):
+        return Category.objects.filter(self.subtree_filter(self.path))
+    
+    def clean(self):
+        if self.parent_id and self.pk and (
+            self.parent_id == self.pk or self.parent.path.startswith(self.path)
+        ):
+            raise ValidationError({'parent': 'یک دسته‌بندی نمی‌تواند زیرمجموعه خودش باشد.'})
+    
+    def _unique_slug(self):
+        base = slugify(self.name, allow_unicode=True)[:100] or 'category'
+        slug, n = base, 1
+        while Category.objects.filter(slug=slug).exclude(pk=self.pk).exists():
+            n += 1
+            slug = f'{base}-{n}'
+        return slug
+    
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = self._unique_slug()
+        with transaction.atomic():
+            if self.pk is None:
+                # The path ends with our own id, so the row has to exist first
+                super().save(*args, **kwargs)
+                args, kwargs = (), {}
+            old_path, old_depth = self.path, self.depth
+            self.path = f'{self.parent.path if self.parent_id else ""}{self.pk}/'
+            self.depth = self.path.count('/') - 1
+            super().save(*args, **kwargs)
+            if old_path and old_path != self.path:
+                # Moved: rewrite the prefix of every descendant in one UPDATE
+                Category.objects.filter(self.subtree_filter(old_path)).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (self.depth - old_depth),
+                )
 
 class SiteSettings(models.Model):
     site_name = models.CharField(max_length=100, default='تارلا ارگانیک', verbose_name='نام سایت')
@@ -68,11 +134,24 @@ class Product(models.Model):
     is_available = models.BooleanField(default=True, verbose_name='موجود')
     stock_quantity = models.PositiveIntegerField(default=0, verbose_name='تعداد موجودی')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')
+    # Recent sales with time decay, refreshed by "manage.py refresh_popularity"
+    popularity_score = models.FloatField(default=0, editable=False, verbose_name='امتیاز محبوبیت')
     
     class Meta:
         verbose_name = 'محصول'
         verbose_name_plural = 'محصولات'
         ordering = ['-created_at']
+        # One per listing sort order (see catalog.SORTS), covering only the
+        # listed products; each is scanned forwards or backwards with no sort
+        # step.  Partial rather than led by is_available, because SQLite
+        # compiles is_available=True to a bare column test that can't seek.
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=Q(is_available=True), name='product_newest_idx'),
+            models.Index(fields=['price', 'id'], condition=Q(is_available=True), name='product_price_idx'),
+            models.Index(
+                fields=['-popularity_score', '-id'], condition=Q(is_available=True), name='product_popular_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.name
@@ -117,6 +196,10 @@ class Order(models.Model):
         verbose_name = 'سفارش'
         verbose_name_plural = 'سفارشات'
         ordering = ['-created_at']
+        indexes = [
+            # A customer's order history, newest first (keyset pagination)
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_history_idx'),
+        ]
     
     def __str__(self):
         return f"سفارش {self.order_number}"
@@ -138,6 +221,104 @@ class OrderItem(models.Model):
     def total(self):
         return self.quantity * self.price
 
+class OrderStatusChange(models.Model):
+    """One row per order per transition, written in bulk by store.orders."""
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='status_changes',
+        verbose_name='سفارش'
+    )
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='از وضعیت')
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='به وضعیت')
+    changed_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='تغییر توسط'
+    )
+    changed_at = models.DateTimeField(verbose_name='تاریخ تغییر')
+
+    class Meta:
+        verbose_name = 'تغییر وضعیت سفارش'
+        verbose_name_plural = 'تاریخچه وضعیت سفارشات'
+        ordering = ['-changed_at', '-id']
+
+    def __str__(self):
+        return f"{self.order_id}: {self.from_status} -> {self.to_status}"
+
+class ArchivedOrder(models.Model):
+    """A finished order moved out of Order and OrderItem by store.archive.
+
+    The id is the original order's, so order URLs keep working.  Items, status
+    history and the ids of the order's stock movements are kept in
+    ``payload`` as zlib-compressed JSON.
+    """
+    id = models.BigIntegerField(primary_key=True, verbose_name='شناسه سفارش')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='کاربر')
+    order_number = models.CharField(max_length=20, unique=True, verbose_name='شماره سفارش')
+    total_price = models.PositiveIntegerField(verbose_name='مبلغ کل')
+    shipping_cost = models.PositiveIntegerField(default=0, verbose_name='هزینه ارسال')
+    final_price = models.PositiveIntegerField(verbose_name='مبلغ نهایی')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='وضعیت')
+    created_at = models.DateTimeField(verbose_name='تاریخ سفارش')
+    updated_at = models.DateTimeField(verbose_name='آخرین بروزرسانی')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ بایگانی')
+    payload = models.BinaryField(editable=False)
+
+    class Meta:
+        verbose_name = 'سفارش بایگانی‌شده'
+        verbose_name_plural = 'سفارشات بایگانی‌شده'
+        ordering = ['-created_at']
+        indexes = [
+            # Merged into a customer's order history (see profile_view)
+            models.Index(fields=['user', '-created_at', '-id'], name='archived_order_history_idx'),
+        ]
+
+    def __str__(self):
+        return f"سفارش {self.order_number}"
+
+class ArchivedCooccurrence(models.Model):
+    """How many archived orders had both products, kept for the recommendations.
+
+    store.archive adds an order's pairs here when it archives the order and
+    takes them back out on restore; rebuild_recommendations adds these counts
+    to the ones it reads from OrderItem.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='محصول')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='محصول همراه')
+    orders = models.PositiveIntegerField(verbose_name='تعداد خرید همزمان')
+
+    class Meta:
+        verbose_name = 'خرید همزمان بایگانی‌شده'
+        verbose_name_plural = 'خریدهای همزمان بایگانی‌شده'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='unique_archived_cooccurrence'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id}: {self.orders}"
+
+class IdempotencyKey(models.Model):
+    """A checkout submission, recorded in the same transaction as its order."""
+    key = models.CharField(max_length=64, unique=True, verbose_name='کلید')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name='کاربر')
+    order = models.OneToOneField(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='idempotency_key',
+        verbose_name='سفارش'
+    )
+    expires_at = models.DateTimeField(db_index=True, verbose_name='تاریخ انقضا')
+
+    class Meta:
+        verbose_name = 'کلید ثبت سفارش'
+        verbose_name_plural = 'کلیدهای ثبت سفارش'
+
+    def __str__(self):
+        return self.key
+
 class DiscountCode(models.Model):
     code = models.CharField(max_length=20, unique=True, verbose_name='کد تخفیف')
     discount_percent = models.PositiveIntegerField(
@@ -164,4 +345,189 @@ class DiscountCode(models.Model):
         now = timezone.now()
         return (self.is_active and 
                 self.used_count < self.max_usage and 
-                self.valid_from <= now <= self.valid_to)
\ No newline at end of file
+                self.valid_from <= now <= self.valid_to)
+
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        verbose_name='محصول'
+    )
+    recommended = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='recommended_for',
+        verbose_name='محصول پیشنهادی'
+    )
+    score = models.PositiveIntegerField(verbose_name='تعداد خرید همزمان')
+    rank = models.PositiveSmallIntegerField(verbose_name='رتبه')
+    computed_at = models.DateTimeField(verbose_name='تاریخ محاسبه')
+
+    class Meta:
+        verbose_name = 'پیشنهاد محصول'
+        verbose_name_plural = 'پیشنهادهای محصول'
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id}"
+
+
+class RecommendationRun(models.Model):
+    """One run of compute_recommendations; the latest is the next run's watermark."""
+    last_order_id = models.BigIntegerField(verbose_name='آخرین سفارش بررسی‌شده')
+    last_status_change_id = models.BigIntegerField(default=0, verbose_name='آخرین تغییر وضعیت بررسی‌شده')
+    products_refreshed = models.PositiveIntegerField(verbose_name='محصولات به‌روزشده')
+    full = models.BooleanField(default=False, verbose_name='محاسبه کامل')
+    finished_at = models.DateTimeField(auto_now_add=True, verbose_name='زمان پایان')
+
+    class Meta:
+        verbose_name = 'اجرای محاسبه پیشنهادها'
+        verbose_name_plural = 'اجراهای محاسبه پیشنهادها'
+
+    def __str__(self):
+        return f"{self.finished_at:%Y-%m-%d %H:%M} (#{self.last_order_id})"
+
+
+class ProductCounter(models.Model):
+    """Daily view and add-to-cart counts, written in batches by store.counters."""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='counters',
+        verbose_name='محصول'
+    )
+    day = models.DateField(verbose_name='روز')
+    views = models.PositiveBigIntegerField(default=0, verbose_name='بازدید')
+    cart_adds = models.PositiveBigIntegerField(default=0, verbose_name='افزودن به سبد')
+
+    class Meta:
+        verbose_name = 'آمار روزانه محصول'
+        verbose_name_plural = 'آمار روزانه محصولات'
+        ordering = ['-day', 'product']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='unique_product_counter_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='product_counter_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} @ {self.day}"
+
+
+class StockMovement(models.Model):
+    RECEIPT = 'receipt'
+    SALE = 'sale'
+    CANCELLATION = 'cancellation'
+    ADJUSTMENT = 'adjustment'
+    KIND_CHOICES = [
+        (RECEIPT, 'ورود به انبار'),
+        (SALE, 'فروش'),
+        (CANCELLATION, 'لغو سفارش'),
+        (ADJUSTMENT, 'اصلاح دستی'),
+    ]
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='stock_movements',
+        verbose_name='محصول'
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='نوع')
+    quantity = models.IntegerField(verbose_name='تغییر موجودی')
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements',
+        verbose_name='سفارش'
+    )
+    note = models.CharField(max_length=200, blank=True, verbose_name='توضیحات')
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='ثبت توسط'
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ثبت')
+
+    class Meta:
+        verbose_name = 'گردش موجودی'
+        verbose_name_plural = 'دفتر انبار'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity:+d} ({self.get_kind_display()})"
+
+
+class StockReservation(models.Model):
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='محصول'
+    )
+    session_key = models.CharField(max_length=40, verbose_name='کلید نشست')
+    quantity = models.PositiveIntegerField(verbose_name='تعداد')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='انقضا')
+
+    class Meta:
+        verbose_name = 'رزرو موجودی'
+        verbose_name_plural = 'رزروهای موجودی'
+        constraints = [
+            models.UniqueConstraint(fields=['session_key', 'product'], name='unique_session_reservation'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} × {self.quantity}"
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'در صف'),
+        (RUNNING, 'در حال اجرا'),
+        (DONE, 'انجام شده'),
+        (FAILED, 'ناموفق'),
+    ]
+
+    name = models.CharField(max_length=100, verbose_name='نام کار')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='ورودی')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, verbose_name='وضعیت')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='تعداد تلاش')
+    max_attempts = models.PositiveSmallIntegerField(default=5, verbose_name='حداکثر تلاش')
+    run_at = models.DateTimeField(verbose_name='زمان اجرا')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='شروع اجرا')
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name='اجرا کننده')
+    # Which of its kind's concurrency slots a running job holds (see jobs.claim)
+    slot = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='جایگاه اجرا')
+    last_error = models.TextField(blank=True, verbose_name='آخرین خطا')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='تاریخ پایان')
+
+    class Meta:
+        verbose_name = 'کار پس‌زمینه'
+        verbose_name_plural = 'کارهای پس‌زمینه'
+        ordering = ['-created_at']
+        indexes = [
+            # The worker's poll: due jobs in order
+            models.Index(fields=['status', 'run_at'], name='job_due_idx'),
+        ]
+        constraints = [
+            # Two workers can't both take the last free slot
+            models.UniqueConstraint(
+                fields=['name', 'slot'], condition=Q(status='running'), name='unique_running_job_slot',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk}"
@@ -0,0 +1,66 @@
+"""
+Order status transitions.
+
+An order moves pending → paid → processing → shipped → delivered and can be
+cancelled until it ships.  ``transition()`` moves a whole selection of orders
+in a fixed number of statements however many there are: one UPDATE of the
+orders that are in an allowed source state (the others are left alone), one
+bulk insert into the status history and, for cancellations, one UPDATE that
+puts the stock the ledger says each order still holds back on the shelf.
+"""
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import catalog, inventory
+from .models import Order, OrderStatusChange, StockMovement
+
+# Target status -> the statuses an order may move to it from
+TRANSITIONS = {
+    'paid': ('pending',),
+    'processing': ('pending', 'paid'),
+    'shipped': ('processing',),
+    'delivered': ('shipped',),
+    'cancelled': ('pending', 'paid', 'processing'),
+}
+BATCH_SIZE = 500
+
+
+def transition(orders, status, user=None):
+    """Move the orders in ``orders`` (a queryset) that may go to ``status``.
+
+    Returns how many orders moved; orders in any other state are skipped.
+    """
+    if status not in TRANSITIONS:
+        raise ValueError(f'Orders cannot be moved to {status!r}')
+    eligible = orders.filter(status__in=TRANSITIONS[status])
+    with transaction.atomic():
+        changes = list(eligible.select_for_update().order_by('pk').values_list('pk', 'status'))
+        if not changes:
+            return 0
+        returns = {}
+        if status == 'cancelled':
+            # Net of sales and earlier returns, so stock is never returned twice
+            returns = {
+                (order_id, product_id): -held
+                for order_id, product_id, held in (
+                    StockMovement.objects.filter(order__in=eligible.values('pk'))
+                    .values('order_id', 'product_id')
+                    .annotate(held=Sum('quantity'))
+                    .filter(held__lt=0)
+                    .values_list('order_id', 'product_id', 'held')
+                )
+            }
+        now = timezone.now()
+        # auto_now doesn't apply to update()
+        Order.objects.filter(pk__in=eligible.values('pk')).update(status=status, updated_at=now)
+        OrderStatusChange.objects.bulk_create([
+            OrderStatusChange(order_id=order_id, from_status=from_status, to_status=status,
+                              changed_by=user, changed_at=now)
+            for order_id, from_status in changes
+        ], batch_size=BATCH_SIZE)
+        if returns:
+            inventory.restock(returns, user=user)
+            # Returned stock can bring a product back in stock
+            catalog.bump()
+    return len(changes)
@@ -0,0 +1,79 @@
+"""
+Best-selling scores for the product listing, computed offline from order history.
+
+Each unit sold in the last POPULARITY_WINDOW_DAYS counts for
+``0.5 ** (age_in_days / POPULARITY_HALF_LIFE_DAYS)``, so last week's sales
+outweigh last quarter's.  Product views and cart additions from
+ProductCounter count the same way, scaled down by POPULARITY_VIEW_WEIGHT and
+POPULARITY_CART_ADD_WEIGHT.  The result is stored in Product.popularity_score,
+which the listing sorts on, instead of aggregating OrderItem per request.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalog, routers
+from .models import OrderItem, Product, ProductCounter
+
+BATCH_SIZE = 2000
+# Scores are stored rounded so a rerun doesn't rewrite every row for noise
+PRECISION = 4
+
+
+def decayed_scores(rows, now, half_life_days):
+    """Return {product_id: score} from (product_id, weight, happened_at) rows."""
+    half_life = half_life_days * 86400
+    scores = defaultdict(float)
+    for product_id, weight, happened_at in rows:
+        age = max((now - happened_at).total_seconds(), 0)
+        scores[product_id] += weight * 0.5 ** (age / half_life)
+    return {product_id: round(score, PRECISION) for product_id, score in scores.items()}
+
+
+def _counter_rows(since, view_weight, cart_add_weight):
+    # Daily counts are dated at noon of their day
+    for product_id, day, views, cart_adds in (
+        ProductCounter.objects.filter(day__gte=since.date())
+        .values_list('product_id', 'day', 'views', 'cart_adds')
+        .iterator(chunk_size=BATCH_SIZE)
+    ):
+        yield product_id, views * view_weight + cart_adds * cart_add_weight, timezone.make_aware(
+            datetime.combine(day, time(12))
+        )
+
+
+def refresh_popularity(window_days=None, half_life_days=None):
+    """Recompute every product's score and return how many changed."""
+    window_days = window_days or getattr(settings, 'POPULARITY_WINDOW_DAYS', 90)
+    half_life_days = half_life_days or getattr(settings, 'POPULARITY_HALF_LIFE_DAYS', 14)
+    view_weight = getattr(settings, 'POPULARITY_VIEW_WEIGHT', 0.02)
+    cart_add_weight = getattr(settings, 'POPULARITY_CART_ADD_WEIGHT', 0.2)
+    now = timezone.now()
+    since = now - timedelta(days=window_days)
+    with routers.reporting():
+        sales = (
+            OrderItem.objects.exclude(order__status='cancelled')
+            .filter(order__created_at__gte=since)
+            .values_list('product_id', 'quantity', 'order__created_at')
+            .iterator(chunk_size=BATCH_SIZE)
+        )
+        scores = decayed_scores(
+            chain(sales, _counter_rows(since, view_weight, cart_add_weight)), now, half_life_days
+        )
+
+    # Products that drop out of the window go back to zero
+    current = dict(Product.objects.exclude(popularity_score=0).values_list('pk', 'popularity_score'))
+    changed = [
+        Product(pk=product_id, popularity_score=score)
+        for product_id, score in {**dict.fromkeys(current, 0.0), **scores}.items()
+        if current.get(product_id, 0.0) != score
+    ]
+    with transaction.atomic():
+        Product.objects.bulk_update(changed, ['popularity_score'], batch_size=BATCH_SIZE)
+    if changed:
+        catalog.bump()
+    return len(changed)
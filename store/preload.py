@@ -0,0 +1,67 @@
+"""
+Preload hints for what a page's <head> blocks on.
+
+The stylesheets, fonts and scripts in base.html are the same on every page,
+so their hints are worked out once per process from the staticfiles manifest
+(hashed URLs, so the browser can reuse the preloaded copy as-is).  The page's
+largest image, its likely LCP element, comes from the catalog snapshot.  See
+EarlyHintsMiddleware for how they are sent.
+"""
+from functools import lru_cache
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+
+from . import catalog
+
+# Must match the URLs base.html loads when the CSS bundle hasn't been built
+CDN_ASSETS = [
+    ('https://cdn.tailwindcss.com', 'script'),
+    ('https://fonts.googleapis.com/css2?family=Vazirmatn:wght@400;500;600;700&display=swap', 'style'),
+    ('https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.2/css/all.min.css', 'style'),
+]
+
+
+def link(url, rel='preload', kind=None, crossorigin=False, mime=None):
+    value = f'<{url}>; rel={rel}'
+    if kind:
+        value += f'; as={kind}'
+    if mime:
+        value += f'; type="{mime}"'
+    if crossorigin:
+        value += '; crossorigin'
+    return value
+
+
+@lru_cache(maxsize=None)
+def asset_links():
+    """The Link values for base.html's render-blocking assets."""
+    if staticfiles_storage.exists('store/css/app.css'):
+        return (
+            link(staticfiles_storage.url('store/fonts/Vazirmatn-Regular.woff2'), kind='font',
+                 mime='font/woff2', crossorigin=True),
+            link(staticfiles_storage.url('store/css/app.css'), kind='style'),
+        )
+    return (
+        *(link(url, kind=kind) for url, kind in CDN_ASSETS),
+        # The font files are only named inside the Google Fonts stylesheet
+        link('https://fonts.gstatic.com', rel='preconnect', crossorigin=True),
+        link(staticfiles_storage.url('store/css/style.css'), kind='style'),
+    )
+
+
+def page_image(url_name, view_kwargs):
+    """The URL of the image a page is likely to paint largest, or None."""
+    if url_name == 'home':
+        product = next((product for product in catalog.snapshot().featured[:8] if product.image), None)
+    elif url_name == 'product_detail':
+        product = catalog.snapshot().get(view_kwargs.get('pk'))
+    else:
+        return None
+    return product.image.url if product is not None and product.image else None
+
+
+def links(url_name, view_kwargs):
+    image = page_image(url_name, view_kwargs)
+    if image is None:
+        return list(asset_links())
+    return [*asset_links(), link(image, kind='image')]
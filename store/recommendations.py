@@ -0,0 +1,142 @@
+"""
+"Frequently bought together" recommendations computed offline from order history.
+
+Co-occurrence counts are built from (order, product) pairs streamed in order id
+order, and only the top-K neighbours of each product are kept in
+ProductRecommendation, so product_detail needs a single indexed lookup.
+Orders moved out by store.archive are counted through ArchivedCooccurrence,
+which holds their pairs already added up.
+"""
+import heapq
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import catalog, routers
+from .models import (
+    ArchivedCooccurrence, Order, OrderItem, OrderStatusChange, ProductRecommendation, RecommendationRun,
+)
+
+TOP_K = 8
+BATCH_SIZE = 2000
+
+
+def order_baskets(rows):
+    # rows are (order_id, product_id) pairs sorted by order_id
+    for _, group in groupby(rows, key=itemgetter(0)):
+        yield {product_id for _, product_id in group}
+
+
+def count_cooccurrences(rows, products=None):
+    """Return {product_id: Counter(other_product_id: orders_together)}.
+
+    When ``products`` is given only rows for those products are counted,
+    which is what an incremental run needs.
+    """
+    counts = defaultdict(Counter)
+    for basket in order_baskets(rows):
+        if len(basket) < 2:
+            continue
+        for product_id in basket:
+            if products is not None and product_id not in products:
+                continue
+            neighbours = counts[product_id]
+            for other_id in basket:
+                if other_id != product_id:
+                    neighbours[other_id] += 1
+    return counts
+
+
+def top_neighbours(neighbours, top_k=TOP_K):
+    # Highest score first, ties broken by product id so runs are deterministic
+    return heapq.nsmallest(top_k, neighbours.items(), key=lambda item: (-item[1], item[0]))
+
+
+def rebuild_recommendations(full=False, top_k=TOP_K):
+    """Recompute recommendations and return the number of products refreshed.
+
+    An incremental run only refreshes products that appear in orders placed
+    since the previous run or in orders cancelled since then; their neighbour
+    lists are recomputed from every order that contains them, so the result
+    matches a full rebuild.  Each run records the last order and status change
+    it scanned, whether or not they changed anything, so neither is scanned
+    twice.
+    """
+    with routers.reporting():
+        orders = Order.objects.all()
+        changes = OrderStatusChange.objects.all()
+        if settings.DATABASE_REPLICAS:
+            # Order history is read from a replica; leaving out rows inside
+            # the allowed lag makes the next run pick up those still in flight
+            cutoff = timezone.now() - timedelta(seconds=settings.REPLICA_PIN_SECONDS)
+            orders = orders.filter(created_at__lt=cutoff)
+            changes = changes.filter(changed_at__lt=cutoff)
+        last_order_id = orders.aggregate(last=Max('pk'))['last'] or 0
+        last_change_id = changes.aggregate(last=Max('pk'))['last'] or 0
+        items = OrderItem.objects.exclude(order__status='cancelled').filter(order_id__lte=last_order_id)
+
+        touched = None
+        previous = None if full else RecommendationRun.objects.order_by('-pk').first()
+        if previous is not None:
+            touched = set(
+                items.filter(order_id__gt=previous.last_order_id)
+                .values_list('product_id', flat=True)
+                .distinct()
+            )
+            # Orders cancelled after they were counted no longer count
+            cancelled = changes.filter(
+                pk__gt=previous.last_status_change_id, pk__lte=last_change_id, to_status='cancelled',
+            )
+            touched.update(
+                OrderItem.objects.filter(order_id__in=cancelled.values('order_id'))
+                .values_list('product_id', flat=True)
+                .distinct()
+            )
+            items = items.filter(
+                order_id__in=OrderItem.objects.filter(product_id__in=touched).values('order_id')
+            )
+
+        counts = {}
+        if touched is None or touched:
+            rows = items.order_by('order_id').values_list('order_id', 'product_id').iterator(chunk_size=BATCH_SIZE)
+            counts = count_cooccurrences(rows, touched)
+            archived = ArchivedCooccurrence.objects.values_list('product_id', 'other_id', 'orders')
+            if touched is not None:
+                archived = archived.filter(product_id__in=touched)
+            for product_id, other_id, orders in archived.iterator(chunk_size=BATCH_SIZE):
+                counts[product_id][other_id] += orders
+
+    computed_at = timezone.now()
+    recommendations = [
+        ProductRecommendation(
+            product_id=product_id,
+            recommended_id=other_id,
+            score=score,
+            rank=rank,
+            computed_at=computed_at,
+        )
+        for product_id, neighbours in counts.items()
+        for rank, (other_id, score) in enumerate(top_neighbours(neighbours, top_k))
+    ]
+    refreshed = len(counts) if touched is None else len(touched)
+
+    with transaction.atomic():
+        if touched is None or touched:
+            stale = ProductRecommendation.objects.all()
+            if touched is not None:
+                stale = stale.filter(product_id__in=touched)
+            stale.delete()
+            ProductRecommendation.objects.bulk_create(recommendations, batch_size=BATCH_SIZE)
+        RecommendationRun.objects.create(
+            last_order_id=last_order_id, last_status_change_id=last_change_id,
+            products_refreshed=refreshed, full=previous is None,
+        )
+    if refreshed:
+        catalog.bump()
+    return refreshed
@@ -0,0 +1,139 @@
+"""
+Send catalog reads and reporting queries to read replicas.
+
+Product, Category and SiteSettings reads go to a replica from
+settings.DATABASE_REPLICAS; everything else, and every write, goes to the
+primary.  Once a request writes, the rest of it reads from the primary, and
+ReplicaPinMiddleware keeps the client there for REPLICA_PIN_SECONDS so the
+next page (e.g. order confirmation after checkout) sees the write too.  Code
+that can live with replication lag can send all its reads to a replica with
+``reporting()``, and code that compares catalog data with other tables can
+keep them consistent with ``primary()``.
+
+A replica that can't be connected to is skipped for REPLICA_RETRY_SECONDS,
+falling back to the primary when none is left.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+REPLICA_MODELS = {'store.product', 'store.category', 'store.sitesettings'}
+
+
+class RoutingState:
+    __slots__ = ('pinned', 'wrote', 'reporting')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.reporting = False
+
+
+_state = ContextVar('replica_routing', default=None)
+_down_until = {}
+
+
+def _current():
+    # Outside a request (management commands, shells) the state lives for
+    # the rest of the thread, so a script also reads its own writes
+    state = _state.get()
+    if state is None:
+        state = RoutingState()
+        _state.set(state)
+    return state
+
+
+@contextmanager
+def request_scope(pinned=False):
+    token = _state.set(RoutingState(pinned))
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def primary():
+    """Read everything from the primary within the block."""
+    state = _current()
+    previous, state.pinned = state.pinned, True
+    try:
+        yield
+    finally:
+        state.pinned = previous or state.wrote
+
+
+@contextmanager
+def reporting():
+    """Read everything from a replica, even after a write, within the block."""
+    state = _current()
+    previous, state.reporting = state.reporting, True
+    try:
+        yield
+    finally:
+        state.reporting = previous
+
+
+def _available_replicas():
+    now = time.monotonic()
+    available = []
+    for alias in settings.DATABASE_REPLICAS:
+        if _down_until.get(alias, 0) > now:
+            continue
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as e:
+            retry = getattr(settings, 'REPLICA_RETRY_SECONDS', 30)
+            logger.warning('Replica %s is unreachable, skipping it for %ss: %s', alias, retry, e)
+            _down_until[alias] = now + retry
+            continue
+        available.append(alias)
+    return available
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Follow relations on the database the instance came from
+            return instance._state.db
+        if not settings.DATABASE_REPLICAS:
+            return None
+
+        state = _state.get()
+        reporting = state is not None and state.reporting
+        if not reporting and (
+            (state is not None and state.pinned)
+            or model._meta.label_lower not in REPLICA_MODELS
+        ):
+            return DEFAULT_DB_ALIAS
+        replicas = _available_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Saving the session happens on every request that touches it and
+        # isn't data the next page reads back
+        if model._meta.app_label != 'sessions':
+            state = _current()
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas are copies of the primary
+        pool = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
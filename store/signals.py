@@ -0,0 +1,39 @@
+from django.contrib.auth.signals import user_login_failed
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import catalog, discounts, site, throttling
+from .models import Category, DiscountCode, Product, SiteSettings
+
+
+@receiver(pre_save, sender=DiscountCode)
+def invalidate_renamed_discount_code(sender, instance, **kwargs):
+    if instance.pk:
+        old_code = DiscountCode.objects.filter(pk=instance.pk).values_list('code', flat=True).first()
+        if old_code and old_code != instance.code:
+            discounts.invalidate(old_code)
+
+
+@receiver(post_save, sender=DiscountCode)
+@receiver(post_delete, sender=DiscountCode)
+def invalidate_discount_code(sender, instance, **kwargs):
+    discounts.invalidate(instance.code)
+
+
+@receiver(post_save, sender=SiteSettings)
+@receiver(post_delete, sender=SiteSettings)
+def invalidate_site_settings(sender, **kwargs):
+    site.invalidate()
+
+
+@receiver(user_login_failed)
+def count_failed_login(sender, credentials, request=None, **kwargs):
+    throttling.login_failed(request, credentials.get('username'))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_catalog_version(sender, **kwargs):
+    catalog.bump()
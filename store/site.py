@@ -0,0 +1,32 @@
+"""
+The SiteSettings row, cached for the context processors and the cart.
+
+Every rendered page needs the delivery fees and contact details, so the row
+is kept in the cache (and in each worker's L1) and dropped by a signal when
+it is saved or deleted.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from . import routers
+from .models import SiteSettings
+
+CACHE_KEY = 'settings:site'
+CACHE_TIMEOUT = 3600
+
+
+def settings():
+    """Return the SiteSettings row, or None if there isn't one yet."""
+    site_settings = cache.get(CACHE_KEY)
+    if site_settings is None:
+        # A replica may not have the change that dropped the key yet
+        with routers.primary():
+            site_settings = SiteSettings.objects.first()
+        if site_settings is not None:
+            cache.set(CACHE_KEY, site_settings, CACHE_TIMEOUT)
+    return site_settings
+
+
+def invalidate():
+    """Drop the cached row once the current transaction commits."""
+    transaction.on_commit(lambda: cache.delete(CACHE_KEY))
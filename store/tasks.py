@@ -0,0 +1,41 @@
+"""
+Side effects that don't need to hold up the response, run by ``run_worker``.
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+from django.template.loader import render_to_string
+
+from .jobs import register
+from .models import Order, SiteSettings
+
+
+def _site_settings():
+    return SiteSettings.objects.first() or SiteSettings()
+
+
+@register(concurrency=2)
+def send_contact_message(name, email, subject, message):
+    site = _site_settings()
+    body = render_to_string('store/emails/contact_message.txt', {
+        'name': name, 'email': email, 'subject': subject, 'message': message, 'site': site,
+    })
+    send_mail(
+        f'[{site.site_name}] {subject}', body, settings.DEFAULT_FROM_EMAIL, [site.contact_email],
+    )
+
+
+@register(concurrency=2)
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('user').get(pk=order_id)
+    if not order.user.email:
+        return
+    site = _site_settings()
+    body = render_to_string('store/emails/order_confirmation.txt', {
+        'order': order,
+        'order_items': order.orderitem_set.select_related('product'),
+        'site': site,
+    })
+    send_mail(
+        f'{site.site_name} - سفارش {order.order_number}', body,
+        settings.DEFAULT_FROM_EMAIL, [order.user.email],
+    )
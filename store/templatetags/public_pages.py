@@ -0,0 +1,21 @@
+from django import template
+from django.middleware.csrf import get_token
+from django.utils.html import format_html
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def csrf_field(context):
+    """Like {% csrf_token %}, but left blank on public pages.
+
+    Reading the token sets the CSRF cookie and ``Vary: Cookie``, which would
+    keep the page out of shared caches; on public pages the script in
+    store/js/session.js fills the field in from session_state instead.
+    """
+    request = context.get('request')
+    if request is None:
+        return ''
+    if getattr(request, 'public_page', False):
+        return format_html('<input type="hidden" name="csrfmiddlewaretoken" value="" data-csrf-field>')
+    return format_html('<input type="hidden" name="csrfmiddlewaretoken" value="{}">', get_token(request))
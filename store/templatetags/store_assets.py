@@ -0,0 +1,32 @@
+from functools import lru_cache
+
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+
+@lru_cache(maxsize=None)
+def _exists(path):
+    return staticfiles_storage.exists(path)
+
+
+@lru_cache(maxsize=None)
+def _read(path):
+    if not _exists(path):
+        return ''
+    with staticfiles_storage.open(path) as f:
+        return f.read().decode('utf-8')
+
+
+@register.simple_tag
+def static_exists(path):
+    """Whether a static file has been collected, e.g. a bundle from build_assets."""
+    return _exists(path)
+
+
+@register.simple_tag
+def inline_static(path):
+    """Paste a collected static file into the page; used for the critical CSS."""
+    return mark_safe(_read(path))
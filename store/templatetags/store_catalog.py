@@ -0,0 +1,16 @@
+from django import template
+from django.template.loader import render_to_string
+
+from .. import catalog
+
+register = template.Library()
+
+
+@register.simple_tag
+def category_menu():
+    """The header's category dropdown, rendered once per catalog snapshot."""
+    snapshot = catalog.snapshot()
+    return snapshot.fragment(
+        'category_menu',
+        lambda: render_to_string('store/category_menu.html', {'categories': snapshot.category_tree}),
+    )
@@ -1,3 +1,1432 @@
-from django.test import TestCase
+import gzip
+import os
+import subprocess
+import sys
+import tempfile
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import site as admin_site
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.template.base import Template
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.templatetags.static import static
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
+from django.utils import timezone
+
+from . import (
+    archive, catalog, compression, counters, discounts, idempotency, instrumentation, inventory, jobs, metrics,
+    orders, popularity, preload, recommendations, routers, site,
+)
+from .cache import TwoTierCache
+from .middleware import ReplicaPinMiddleware
+from .models import (
+    ArchivedCooccurrence, ArchivedOrder, Category, DiscountCode, IdempotencyKey, Job, Order, OrderItem, OrderStatusChange, Product,
+    ProductCounter, ProductRecommendation, RecommendationRun, SiteSettings, StockMovement, StockReservation,
+    UserProfile,
+)
+
+PROJECT_DIR = str(Path(settings.BASE_DIR))
+THIS_FILE = str(Path(__file__).resolve())
+
+
+def _call_site():
+    """Return the innermost project frame and the template being rendered."""
+    location = template = None
+    for frame, lineno in traceback.walk_stack(None):
+        filename = frame.f_code.co_filename
+        # type() rather than isinstance() so lazy objects aren't evaluated
+        if template is None and issubclass(type(frame.f_locals.get('self')), Template):
+            template = frame.f_locals['self'].origin.template_name
+        if (
+            location is None
+            and filename.startswith(PROJECT_DIR)
+            and filename != THIS_FILE
+            and 'site-packages' not in filename
+        ):
+            location = f'{Path(filename).relative_to(PROJECT_DIR)}:{lineno} in {frame.f_code.co_name}'
+        if location and template:
+            break
+    location = location or '<django>'
+    return f'{location} (rendering {template})' if template else location
+
+
+class QueryLog:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # Savepoints are transaction bookkeeping (and TestCase adds its own)
+        if not sql.startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')):
+            self.queries.append((_call_site(), sql))
+        return execute(sql, params, many, context)
+
+    def report(self):
+        by_site = defaultdict(lambda: defaultdict(int))
+        for site, sql in self.queries:
+            by_site[site][sql] += 1
+        lines = []
+        for site, statements in sorted(by_site.items(), key=lambda item: -sum(item[1].values())):
+            lines.append(f'  {site}: {sum(statements.values())} queries')
+            for sql, count in sorted(statements.items(), key=lambda item: -item[1]):
+                lines.append(f'    {count}x {sql[:300]}')
+        return '\n'.join(lines)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    THROTTLE_ENABLED=False,
+    SLOW_REQUEST_THRESHOLD_MS=60_000,
+    # Budgets count queries on the primary connection
+    DATABASE_REPLICAS=[],
+)
+class QueryBudgetTests(TestCase):
+    """Every view must run in a fixed number of queries, however big the data.
+
+    The fixture is scaled up (500 products, 50 cart lines, 20 order items) so
+    that a per-row query shows up as a budget many times over.  Budgets are
+    upper bounds; lower them when a view gets cheaper.
+    """
+
+    PRODUCTS = 500
+    CART_LINES = 50
+    ORDER_ITEMS = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        SiteSettings.objects.create()
+        categories = [Category.objects.create(name=f'دسته {i}') for i in range(5)]
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name=f'محصول {i}',
+                price=10_000 + i,
+                category=categories[i % len(categories)],
+                is_featured=i < 8,
+                stock_quantity=1_000,
+            )
+            for i in range(cls.PRODUCTS)
+        ])
+        StockMovement.objects.bulk_create([
+            StockMovement(product=product, kind=StockMovement.RECEIPT, quantity=1_000)
+            for product in cls.products
+        ])
+        cls.product = cls.products[0]
+        ProductRecommendation.objects.bulk_create([
+            ProductRecommendation(
+                product=cls.product, recommended=other, score=1, rank=rank, computed_at=timezone.now()
+            )
+            for rank, other in enumerate(cls.products[1:9])
+        ])
+
+        cls.user = User.objects.create_user('shopper', 'shopper@example.com', 'budget-password-123')
+        UserProfile.objects.create(user=cls.user)
+        cls.staff = User.objects.create_user('staff', password='budget-password-123', is_staff=True)
+
+        cls.order = Order.objects.create(
+            user=cls.user, order_number='TLBUDGET', total_price=0, final_price=0
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=cls.order, product=product, quantity=1, price=product.price)
+            for product in cls.products[:cls.ORDER_ITEMS]
+        ])
+        now = timezone.now()
+        DiscountCode.objects.create(
+            code='BUDGET10',
+            discount_percent=10,
+            max_usage=100,
+            valid_from=now - timedelta(days=1),
+            valid_to=now + timedelta(days=1),
+        )
+
+    def setUp(self):
+        # Budgets are for the steady state, with this fixture's catalog loaded
+        catalog.reset()
+        catalog.snapshot()
+
+    def fill_cart(self):
+        session = self.client.session
+        session['cart'] = {
+            str(product.pk): {'quantity': 2} for product in self.products[:self.CART_LINES]
+        }
+        session.save()
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        log = QueryLog()
+        with connection.execute_wrapper(log):
+            yield
+        if len(log.queries) > budget:
+            self.fail(f'{len(log.queries)} queries, budget is {budget}:\n{log.report()}')
+
+    def test_every_url_has_a_budget(self):
+        names = {
+            pattern.name for pattern in get_resolver().url_patterns
+            if getattr(pattern, 'name', None)
+        }
+        untested = sorted(name for name in names if not hasattr(self, f'test_{name}'))
+        self.assertEqual(untested, [], 'Add a query budget test for these URLs')
+
+    def test_debug_urls(self):
+        with self.assertMaxQueries(0):
+            self.client.get('/debug-urls/')
+
+    def test_home(self):
+        with self.assertMaxQueries(2):
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_products(self):
+        for sort in catalog.SORTS:
+            with self.assertMaxQueries(2):
+                response = self.client.get('/products/', {'sort': sort, 'page': 2})
+            self.assertEqual(response.status_code, 200)
+
+    def test_product_detail(self):
+        with self.assertMaxQueries(2):
+            response = self.client.get(f'/product/{self.product.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['related_products']), 4)
+
+    def test_about(self):
+        with self.assertMaxQueries(2):
+            self.client.get('/about/')
+
+    def test_contact(self):
+        with self.assertMaxQueries(2):
+            self.client.get('/contact/')
+        with self.assertMaxQueries(3), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/contact/', {
+                'name': 'آزمون', 'email': 'a@example.com', 'subject': 'سلام', 'message': 'پیام آزمایشی بلند',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Job.objects.filter(name='send_contact_message').exists())
+
+    def test_cart(self):
+        self.fill_cart()
+        with self.assertMaxQueries(5):
+            response = self.client.get('/cart/')
+        self.assertEqual(len(response.context['cart_items']), self.CART_LINES)
+
+    def test_add_to_cart(self):
+        self.fill_cart()
+        with self.assertMaxQueries(7):
+            response = self.client.post(f'/cart/add/{self.product.pk}/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_update_cart(self):
+        self.fill_cart()
+        with self.assertMaxQueries(7):
+            self.client.post(f'/cart/update/{self.product.pk}/', {'action': 'increase'})
+        with self.assertMaxQueries(7):
+            self.client.post(f'/cart/update/{self.product.pk}/', {'quantity': '5'})
+
+    def test_remove_from_cart(self):
+        self.fill_cart()
+        with self.assertMaxQueries(4):
+            response = self.client.post(f'/cart/remove/{self.product.pk}/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_clear_cart(self):
+        self.fill_cart()
+        with self.assertMaxQueries(3):
+            self.client.post('/cart/clear/')
+
+    def test_apply_discount(self):
+        self.fill_cart()
+        with self.assertMaxQueries(3):
+            self.client.post('/cart/apply-discount/', {'discount_code': 'budget10'})
+        self.assertEqual(self.client.session['discount_code']['code'], 'BUDGET10')
+
+    def test_remove_discount(self):
+        self.fill_cart()
+        self.client.post('/cart/apply-discount/', {'discount_code': 'BUDGET10'})
+        with self.assertMaxQueries(2):
+            self.client.get('/cart/remove-discount/')
+
+    def test_session_state(self):
+        self.fill_cart()
+        with self.assertMaxQueries(1):
+            response = self.client.get('/session/state/')
+        self.assertEqual(response.json()['cart_items_count'], 2 * self.CART_LINES)
+
+    def test_checkout(self):
+        self.client.force_login(self.user)
+        self.fill_cart()
+        self.client.post('/cart/apply-discount/', {'discount_code': 'BUDGET10'})
+        with self.assertMaxQueries(15), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/checkout/', {'idempotency_key': 'a' * 32})
+        order = Order.objects.latest('id')
+        self.assertRedirects(response, f'/order/confirmation/{order.pk}/', fetch_redirect_response=False)
+        self.assertEqual(order.orderitem_set.count(), self.CART_LINES)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 998)
+        self.assertEqual(StockMovement.objects.filter(order=order).count(), self.CART_LINES)
+        self.assertEqual(Job.objects.get(name='send_order_confirmation').payload, {'order_id': order.pk})
+
+    def test_checkout_rolls_back_when_one_line_is_short(self):
+        self.client.force_login(self.user)
+        self.fill_cart()
+        short = self.products[self.CART_LINES - 1]
+        Product.objects.filter(pk=short.pk).update(stock_quantity=1)
+        self.client.post('/checkout/', {'idempotency_key': 'a' * 32})
+        self.assertFalse(Order.objects.exclude(pk=self.order.pk).exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 1_000)
+
+    def test_repeated_checkout_returns_the_first_order(self):
+        self.client.force_login(self.user)
+        self.fill_cart()
+        first = self.client.post('/checkout/', {'idempotency_key': 'b' * 32})
+        # The cart is kept in the session the retry was sent with
+        self.fill_cart()
+        with self.assertMaxQueries(3):
+            retry = self.client.post('/checkout/', {'idempotency_key': 'b' * 32})
+        self.assertEqual(retry['Location'], first['Location'])
+        self.assertEqual(Order.objects.exclude(pk=self.order.pk).count(), 1)
+
+    def test_racing_checkouts_place_one_order(self):
+        self.client.force_login(self.user)
+        self.fill_cart()
+        self.client.post('/checkout/', {'idempotency_key': 'c' * 32})
+        order = Order.objects.latest('id')
+        self.fill_cart()
+        # The second submit looked before the first committed, so it only
+        # finds out from the unique key
+        with mock.patch.object(idempotency, 'order_for', side_effect=[None, order.pk]):
+            response = self.client.post('/checkout/', {'idempotency_key': 'c' * 32})
+        self.assertRedirects(response, f'/order/confirmation/{order.pk}/', fetch_redirect_response=False)
+        self.assertEqual(Order.objects.exclude(pk=self.order.pk).count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 998)
+
+    def test_expired_keys_are_purged(self):
+        self.client.force_login(self.user)
+        self.fill_cart()
+        self.client.post('/checkout/', {'idempotency_key': 'd' * 32})
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertIsNone(idempotency.order_for('d' * 32, self.user))
+        self.assertEqual(idempotency.purge_expired(batch_size=1), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_order_confirmation(self):
+        self.client.force_login(self.user)
+        with self.assertMaxQueries(6):
+            response = self.client.get(f'/order/confirmation/{self.order.pk}/')
+        self.assertEqual(len(response.context['order_items']), self.ORDER_ITEMS)
+
+    def test_order_detail(self):
+        self.client.force_login(self.user)
+        with self.assertMaxQueries(6):
+            response = self.client.get(f'/order/{self.order.pk}/')
+        self.assertEqual(len(response.context['order_items']), self.ORDER_ITEMS)
+
+    def test_orders_are_only_visible_to_their_owner(self):
+        self.client.force_login(self.staff)
+        for url in (f'/order/{self.order.pk}/', f'/order/confirmation/{self.order.pk}/'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_register(self):
+        with self.assertMaxQueries(2):
+            self.client.get('/register/')
+
+    def test_login(self):
+        with self.assertMaxQueries(2):
+            self.client.get('/login/')
+        with self.assertMaxQueries(6):
+            response = self.client.post('/login/', {
+                'username': 'shopper', 'password': 'budget-password-123',
+            })
+        self.assertEqual(response.status_code, 302)
+
+    def test_logout(self):
+        self.client.force_login(self.user)
+        with self.assertMaxQueries(4):
+            self.client.get('/logout/')
+
+    def test_profile(self):
+        # 25 orders of 20 items each, all placed in the same second, so the
+        # keyset cursor has to fall back to the id
+        created_at = timezone.now()
+        orders = Order.objects.bulk_create([
+            Order(user=self.user, order_number=f'TLHIST{i}', total_price=0, final_price=0)
+            for i in range(25)
+        ])
+        Order.objects.filter(user=self.user).update(created_at=created_at)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, price=product.price)
+            for order in orders for product in self.products[:self.ORDER_ITEMS]
+        ])
+        self.client.force_login(self.user)
+
+        seen = []
+        url = '/profile/'
+        while url:
+            with self.assertMaxQueries(7):
+                response = self.client.get(url)
+            page = response.context['orders']
+            self.assertTrue(all(order.item_count == self.ORDER_ITEMS for order in page))
+            self.assertTrue(all(len(order.preview_items) == 3 for order in page))
+            seen += [order.pk for order in page]
+            cursor = response.context['next_cursor']
+            url = f'/profile/?before={cursor}' if cursor else None
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), 26)
+
+    def test_metrics(self):
+        self.client.force_login(self.staff)
+        with self.assertMaxQueries(2):
+            response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='دسته')
+        cls.a, cls.b, cls.c, cls.d = Product.objects.bulk_create([
+            Product(name=name, price=1_000, category=category, stock_quantity=10) for name in 'abcd'
+        ])
+        cls.user = User.objects.create_user('recommended')
+        cls.place(cls.a, cls.b, cls.c)
+        cls.place(cls.a, cls.b)
+        cls.place(cls.c)
+        cls.place(cls.a, cls.c, status='cancelled')
+
+    @classmethod
+    def place(cls, *products, status='pending'):
+        number = Order.objects.count() + ArchivedOrder.objects.count()
+        order = Order.objects.create(user=cls.user, order_number=f'TLREC{number}',
+                                     total_price=0, final_price=0, status=status)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, price=product.price) for product in products
+        ])
+        return order
+
+    def recommendations(self):
+        return {
+            product.name: [(other.name, score) for other, score in (
+                (rec.recommended, rec.score) for rec in product.recommendations.select_related('recommended')
+            )]
+            for product in Product.objects.order_by('name')
+        }
+
+    def test_cooccurrence_counts(self):
+        self.assertEqual(recommendations.rebuild_recommendations(), 3)
+        self.assertEqual(self.recommendations(), {
+            'a': [('b', 2), ('c', 1)],
+            'b': [('a', 2), ('c', 1)],
+            'c': [('a', 1), ('b', 1)],
+            'd': [],
+        })
+
+    def test_incremental_run_matches_a_full_rebuild(self):
+        recommendations.rebuild_recommendations()
+        self.place(self.b, self.c)
+        self.place(self.c, self.d)
+        self.assertEqual(recommendations.rebuild_recommendations(), 3)
+        incremental = self.recommendations()
+        recommendations.rebuild_recommendations(full=True)
+        self.assertEqual(incremental, self.recommendations())
+        self.assertEqual(incremental['c'], [('b', 2), ('a', 1), ('d', 1)])
+
+    def test_watermark_passes_orders_without_pairs(self):
+        recommendations.rebuild_recommendations()
+        single = self.place(self.d)
+        self.assertEqual(recommendations.rebuild_recommendations(), 1)
+        self.assertEqual(RecommendationRun.objects.latest('pk').last_order_id, single.pk)
+        # Nothing new since, so nothing is scanned again
+        # last order and status change, last run, new and cancelled orders' products, recording the run
+        with self.assertNumQueries(8):
+            self.assertEqual(recommendations.rebuild_recommendations(), 0)
+
+    def test_orders_cancelled_after_a_run_stop_counting(self):
+        recommendations.rebuild_recommendations()
+        order = Order.objects.filter(order_number='TLREC1').get()
+        orders.transition(Order.objects.filter(pk=order.pk), 'cancelled')
+        self.assertEqual(recommendations.rebuild_recommendations(), 2)
+        incremental = self.recommendations()
+        self.assertEqual(incremental['a'], [('b', 1), ('c', 1)])
+        recommendations.rebuild_recommendations(full=True)
+        self.assertEqual(incremental, self.recommendations())
+
+    def test_archived_orders_keep_counting(self):
+        Order.objects.filter(status='pending').update(status='delivered')
+        Order.objects.update(created_at=timezone.now() - timedelta(days=400))
+        recommendations.rebuild_recommendations()
+        before = self.recommendations()
+        self.assertEqual(archive.archive(days=180), 4)
+        recommendations.rebuild_recommendations(full=True)
+        self.assertEqual(self.recommendations(), before)
+
+        # A touched product adds its new orders to the archived ones
+        self.place(self.b, self.c)
+        self.assertEqual(recommendations.rebuild_recommendations(), 2)
+        incremental = self.recommendations()
+        self.assertEqual(incremental['c'], [('b', 2), ('a', 1)])
+        recommendations.rebuild_recommendations(full=True)
+        self.assertEqual(self.recommendations(), incremental)
+
+        archive.restore(ArchivedOrder.objects.all())
+        self.assertFalse(ArchivedCooccurrence.objects.exists())
+        recommendations.rebuild_recommendations(full=True)
+        self.assertEqual(self.recommendations(), incremental)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    THROTTLE_ENABLED=True,
+    THROTTLE_RATES={'login': '2/m'},
+)
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1_000_000.0
+        clock = mock.patch('store.throttling.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def login(self):
+        return self.client.post('/login/', {'username': 'nobody', 'password': 'wrong-password'})
+
+    def test_full_window_answers_429_until_the_next_one(self):
+        self.assertEqual([self.login().status_code for _ in range(2)], [200, 200])
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        # Windows are whole minutes; this one ends 20 seconds from now
+        self.assertEqual(response['Retry-After'], '20')
+        self.now += 10
+        self.assertEqual(self.login()['Retry-After'], '10')
+        self.now += 10
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login().status_code, 429)
+        # Reading the page isn't counted
+        self.assertEqual(self.client.get('/login/').status_code, 200)
+
+    @override_settings(THROTTLE_LOGIN_FAILURES='2/h')
+    def test_failed_logins_lock_out_only_the_sending_address(self):
+        self.login()
+        self.now += 60
+        self.login()
+        self.now += 60
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '680')
+        # The same username from elsewhere isn't held up
+        response = self.client.post(
+            '/login/', {'username': 'nobody', 'password': 'wrong-password'}, REMOTE_ADDR='10.0.0.9',
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PublicPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='دسته')
+        cls.product = Product.objects.create(name='سیب', price=10_000, category=category, stock_quantity=5)
+
+    def setUp(self):
+        catalog.reset()
+
+    def test_cookieless_visitor_gets_a_shared_page(self):
+        response = self.client.get(f'/product/{self.product.pk}/')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('s-maxage=300', response['Cache-Control'])
+        self.assertFalse(response.has_header('Vary') and 'Cookie' in response['Vary'])
+        self.assertFalse(response.cookies)
+        self.assertContains(response, 'value="" data-csrf-field')
+        self.assertContains(response, 'store/js/session.js')
+
+    def test_visitor_with_a_session_gets_a_private_page(self):
+        self.client.post(f'/cart/add/{self.product.pk}/')
+        response = self.client.get(f'/product/{self.product.pk}/')
+        self.assertNotIn('public', response.get('Cache-Control', ''))
+        self.assertIn('Cookie', response['Vary'])
+        self.assertNotContains(response, 'data-csrf-field')
+        self.assertContains(response, 'id="cart-badge"')
+
+    def test_session_state_hydrates_a_shared_page(self):
+        self.client.post(f'/cart/add/{self.product.pk}/')
+        state = self.client.get('/session/state/').json()
+        self.assertEqual(state['cart_items_count'], 1)
+        self.assertEqual([message['tags'] for message in state['messages']], ['success'])
+        self.assertTrue(state['csrf_token'])
+        self.assertIsNone(state['username'])
+
+        # The form field it fills in is accepted
+        client = Client(enforce_csrf_checks=True)
+        client.get('/')
+        token = client.get('/session/state/').json()['csrf_token']
+        response = client.post(f'/cart/add/{self.product.pk}/', {'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+
+    def test_pages_that_set_cookies_are_not_shared(self):
+        response = self.client.get('/product/999999/')
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('public', response.get('Cache-Control', ''))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=10, REPLICA_RETRY_SECONDS=30)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.replica = mock.Mock()
+        patcher = mock.patch.object(routers, 'connections', {'replica': self.replica})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(routers._down_until.clear)
+
+    def request(self, **cookies):
+        """Run a request that reads, writes and reads again; returns where the reads went."""
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Product))
+            self.router.db_for_write(Order)
+            seen.append(self.router.db_for_read(Product))
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies)
+        return seen, ReplicaPinMiddleware(view)(request)
+
+    def test_reads_after_a_write_stay_on_the_primary(self):
+        seen, response = self.request()
+        self.assertEqual(seen, ['replica', 'default'])
+        self.assertEqual(response.cookies['db_primary']['max-age'], 10)
+        # The pin cookie keeps the client's next request on the primary
+        seen, _ = self.request(db_primary='1')
+        self.assertEqual(seen, ['default', 'default'])
+
+    def test_only_catalog_models_go_to_the_replica(self):
+        with routers.request_scope():
+            self.assertEqual(self.router.db_for_read(Order), 'default')
+            self.assertEqual(self.router.db_for_read(Category), 'replica')
+            self.router.db_for_write(Order)
+            with routers.reporting():
+                self.assertEqual(self.router.db_for_read(Order), 'replica')
+
+    def test_unreachable_replica_falls_back_to_the_primary(self):
+        self.replica.ensure_connection.side_effect = OperationalError('connection refused')
+        with routers.request_scope(), self.assertLogs('store.routers', 'WARNING'):
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+        # Not tried again until REPLICA_RETRY_SECONDS have passed
+        with routers.request_scope():
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+        self.assertEqual(self.replica.ensure_connection.call_count, 1)
+
+    def test_without_replicas_everything_uses_the_primary(self):
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertIsNone(self.router.db_for_read(Product))
+            with self.assertRaises(MiddlewareNotUsed):
+                ReplicaPinMiddleware(lambda request: HttpResponse())
+
+
+@jobs.register('flaky_test_job', max_attempts=2)
+def flaky_test_job(fail):
+    if fail:
+        raise RuntimeError('boom')
+
+
+@jobs.register('capped_test_job', concurrency=1)
+def capped_test_job():
+    pass
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DiscountCodeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.code = DiscountCode.objects.create(
+            code='ONCE', discount_percent=10, max_usage=1,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1),
+        )
+
+    def test_unknown_codes_are_cached_as_misses(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(discounts.lookup('guess'))
+            self.assertIsNone(discounts.lookup(' GUESS '))
+        with self.captureOnCommitCallbacks(execute=True):
+            DiscountCode.objects.create(
+                code='GUESS', discount_percent=5, max_usage=1,
+                valid_from=self.code.valid_from, valid_to=self.code.valid_to,
+            )
+        self.assertEqual(discounts.lookup('guess')['discount_percent'], 5)
+
+    def test_max_usage_stops_redemption(self):
+        discount = discounts.lookup('once')
+        self.assertTrue(discounts.redeem(discount['id']))
+        self.assertFalse(discounts.redeem(discount['id']))
+        self.assertEqual(DiscountCode.objects.get(pk=self.code.pk).used_count, 1)
+
+    def test_cache_is_dropped_only_when_the_redemption_commits(self):
+        discounts.lookup('once')
+        with self.captureOnCommitCallbacks() as callbacks:
+            discounts.redeem(self.code.pk, 'once')
+            self.assertEqual(discounts.lookup('once')['used_count'], 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(discounts.lookup('once')['used_count'], 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SiteSettingsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog.reset()
+        SiteSettings.objects.create(delivery_fee=30_000)
+
+    def site_settings_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/about/')
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries if 'store_sitesettings' in query['sql']]
+
+    def test_warm_render_reads_no_site_settings(self):
+        self.assertEqual(len(self.site_settings_queries()), 1)
+        self.assertEqual(self.site_settings_queries(), [])
+
+    def test_saving_drops_the_cached_row(self):
+        self.site_settings_queries()
+        site_settings = SiteSettings.objects.get()
+        site_settings.delivery_fee = 40_000
+        with self.captureOnCommitCallbacks(execute=True):
+            site_settings.save()
+        self.assertEqual(site.settings().delivery_fee, 40_000)
+
+
+class JobQueueTests(TestCase):
+    def run_next(self):
+        job = jobs.claim('test')
+        self.assertIsNotNone(job)
+        return jobs.execute(job)
+
+    def test_job_is_queued_only_when_the_transaction_commits(self):
+        with transaction.atomic():
+            jobs.enqueue('flaky_test_job', fail=False)
+            transaction.set_rollback(True)
+        self.assertFalse(Job.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('flaky_test_job', fail=False)
+        self.assertTrue(self.run_next())
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_failed_job_backs_off_then_gives_up(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('flaky_test_job', fail=True)
+        self.assertFalse(self.run_next())
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('boom', job.last_error)
+        self.assertIsNone(jobs.claim('test'))
+
+        Job.objects.update(run_at=timezone.now())
+        self.assertFalse(self.run_next())
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+    def test_claimed_job_cannot_be_claimed_twice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('flaky_test_job', fail=False)
+        self.assertIsNotNone(jobs.claim('one'))
+        self.assertIsNone(jobs.claim('two'))
+
+    def test_concurrency_cap_holds_when_workers_race(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('capped_test_job')
+            jobs.enqueue('capped_test_job')
+        first = jobs.claim('one')
+        self.assertEqual(first.slot, 0)
+        self.assertIsNone(jobs.claim('two'))
+        # A worker that counted the running jobs before the first claim
+        with mock.patch.object(jobs, '_free_slot', return_value=0):
+            self.assertIsNone(jobs.claim('three'))
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+        jobs.execute(first)
+        self.assertEqual(jobs.claim('two').slot, 0)
+
+    def test_jobs_of_dead_workers_are_run_again(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('flaky_test_job', fail=False)
+        jobs.claim('dead')
+        self.assertEqual(jobs.requeue_stale(), 0)
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertTrue(self.run_next())
+        self.assertEqual(Job.objects.get().attempts, 2)
+
+    def test_jobs_that_keep_killing_workers_fail(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('capped_test_job')
+        Job.objects.update(max_attempts=1)
+        jobs.claim('dead')
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 0)
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('stopped responding', job.last_error)
+        # Its concurrency slot is free again
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('capped_test_job')
+        self.assertEqual(jobs.claim('next').slot, 0)
+
+    def test_order_confirmation_email(self):
+        user = User.objects.create_user('buyer', 'buyer@example.com')
+        order = Order.objects.create(user=user, order_number='TLMAIL', total_price=0, final_price=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('send_order_confirmation', order_id=order.pk)
+        self.assertTrue(self.run_next())
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertIn('TLMAIL', mail.outbox[0].body)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    SERVER_TIMING_PUBLIC=False,
+    SLOW_REQUEST_THRESHOLD_MS=60_000,
+)
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        catalog.reset()
+
+    def test_server_timing_is_only_sent_to_staff(self):
+        self.assertFalse(self.client.get('/about/').has_header('Server-Timing'))
+        self.client.force_login(User.objects.create_user('customer'))
+        self.assertFalse(self.client.get('/about/').has_header('Server-Timing'))
+        self.client.force_login(User.objects.create_user('timing-staff', is_staff=True))
+        self.assertIn('db;dur=', self.client.get('/about/')['Server-Timing'])
+
+    def test_slow_requests_are_logged_with_their_queries(self):
+        with self.assertNoLogs('store.performance', 'WARNING'):
+            self.client.get('/about/')
+        # The threshold is read when the middleware is loaded, so a new client;
+        # a cold cache makes the page read the site settings
+        cache.clear()
+        with self.settings(SLOW_REQUEST_THRESHOLD_MS=0), self.assertLogs('store.performance', 'WARNING') as logs:
+            Client().get('/about/')
+        self.assertIn('Slow request GET /about/ -> 200', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class MetricsFileTests(SimpleTestCase):
+    def test_growing_the_file_keeps_values_and_unmaps_the_old_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'worker.db')
+            values = metrics.MmapedDict(path)
+            first = values._mmap
+            for n in range(3000):
+                values.inc(f'store_test_total{{n="{n}"}}', n)
+            self.assertTrue(first.closed)
+            self.assertGreater(values._capacity, metrics.INITIAL_SIZE)
+            values.inc('store_test_total{n="7"}', 1)
+            values.close()
+            read = dict(metrics.read_file(path))
+        self.assertEqual(len(read), 3000)
+        self.assertEqual(read['store_test_total{n="7"}'], 8)
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def worker(self, **options):
+        # Workers share the locmem "server" by its location, like a real shared cache
+        return TwoTierCache('', {'OPTIONS': {
+            'CACHE': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'two-tier-test'},
+            'L1_KEY_PREFIXES': ['catalog:'],
+            'L1_CHECK_SECONDS': 60,
+            **options,
+        }})
+
+    def setUp(self):
+        self.first, self.second = self.worker(), self.worker()
+        self.first.clear()
+
+    def test_hot_keys_are_served_from_memory(self):
+        self.second.set('catalog:version', 'v1')
+        with instrumentation.measure() as stats:
+            self.assertEqual(self.first.get('catalog:version'), 'v1')
+            self.assertEqual(self.first.get('catalog:version'), 'v1')
+            self.first.get('compressed:page')
+        self.assertEqual((stats.l1_hits, stats.l1_misses), (1, 1))
+        self.assertEqual((stats.cache_hits, stats.cache_misses), (1, 1))
+        self.assertIn('cache-l1;desc="hit=1 miss=1"', stats.server_timing())
+
+    def test_deletes_reach_other_workers_on_their_next_check(self):
+        self.first.set('catalog:version', 'v1')
+        self.assertEqual(self.second.get('catalog:version'), 'v1')
+        self.first.delete('catalog:version')
+        self.first.set('catalog:version', 'v2')
+        # Still inside the second worker's check interval
+        self.assertEqual(self.second.get('catalog:version'), 'v1')
+        self.second._checked_at -= 60
+        self.assertEqual(self.second.get('catalog:version'), 'v2')
+        self.first.delete_many(['catalog:version'])
+        self.second._checked_at -= 60
+        self.assertIsNone(self.second.get('catalog:version'))
+
+    def test_fills_are_not_broadcast(self):
+        self.second.get('catalog:version')
+        for n in range(50):
+            self.first.set(f'catalog:miss:{n}', 'missing', 30)
+            self.first.add(f'catalog:other:{n}', n)
+        self.assertIsNone(self.first._cache.get(TwoTierCache.EPOCH_KEY))
+        self.assertEqual(self.first.get('catalog:miss:3'), 'missing')
+
+    def test_l1_is_bounded(self):
+        worker = self.worker(L1_MAX_ENTRIES=2)
+        for n in range(3):
+            worker.set(f'catalog:{n}', n)
+        self.assertEqual([key for key, _ in worker._l1], ['catalog:1', 'catalog:2'])
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    THROTTLE_ENABLED=False,
+)
+class CompressionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='دسته')
+        Product.objects.bulk_create([
+            Product(name=f'محصول {i}', price=10_000, category=category, stock_quantity=5) for i in range(30)
+        ])
+
+    def setUp(self):
+        catalog.reset()
+
+    def test_negotiation(self):
+        self.assertEqual(compression.negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(compression.negotiate('gzip;q=0, identity'), None)
+        self.assertEqual(compression.negotiate('*'), 'br' if compression.brotli else 'gzip')
+        self.assertEqual(compression.negotiate(''), None)
+
+    def test_page_without_token_is_compressed_once(self):
+        first = self.client.get('/about/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', first['Vary'])
+        self.assertIn('تارلا', gzip.decompress(first.content).decode())
+
+        with self.assertNumQueries(0):
+            compressed = compression.compress(gzip.decompress(first.content), 'gzip', 600)
+        self.assertEqual(compressed, first.content)
+
+    def test_page_with_csrf_token_is_padded(self):
+        with mock.patch.object(compression, 'compress_secret', wraps=compression.compress_secret) as padded, \
+                mock.patch.object(compression, 'compress', wraps=compression.compress) as shared:
+            responses = [self.client.get('/contact/', HTTP_ACCEPT_ENCODING='br, gzip') for _ in range(10)]
+        self.assertEqual(padded.call_count, 10)
+        shared.assert_not_called()
+        self.assertFalse([key for key in cache._cache if 'compressed:' in key])
+        self.assertTrue(all(response['Content-Encoding'] == 'gzip' for response in responses))
+        self.assertIn('csrfmiddlewaretoken', gzip.decompress(responses[0].content).decode())
+        # Random padding in the gzip header, so lengths don't leak the content
+        self.assertGreater(len({len(response.content) for response in responses}), 1)
+
+    def test_small_and_unaccepted_responses_are_left_alone(self):
+        self.assertFalse(self.client.get('/about/').has_header('Content-Encoding'))
+        self.client.force_login(User.objects.create_user('x', is_staff=True))
+        response = self.client.get('/debug-urls/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogSnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='دسته')
+        cls.product = Product.objects.create(name='سیب', price=10_000, category=cls.category, stock_quantity=3)
+
+    def setUp(self):
+        catalog.reset()
+
+    def test_snapshot_is_reused_until_the_version_changes(self):
+        first = catalog.snapshot()
+        with self.assertNumQueries(0):
+            self.assertIs(catalog.snapshot(), first)
+        self.assertEqual(first.get(self.product.pk).name, 'سیب')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(name='گلابی')
+            catalog.bump()
+        self.assertEqual(catalog.snapshot().get(self.product.pk).name, 'گلابی')
+
+    def test_other_workers_reload_on_their_next_check(self):
+        first = catalog.snapshot()
+        cache.set(catalog.VERSION_KEY, 'from-another-worker', None)
+        with self.settings(CATALOG_VERSION_CHECK_SECONDS=0):
+            second = catalog.snapshot()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.version, 'from-another-worker')
+
+    def test_reloading_an_unchanged_version_reads_a_replica(self):
+        first = catalog.snapshot()
+        with self.settings(CATALOG_VERSION_CHECK_SECONDS=0, CATALOG_MAX_AGE_SECONDS=0), \
+                mock.patch.object(catalog, 'load', wraps=catalog.load) as load:
+            catalog.snapshot()
+        load.assert_called_once_with(first.version, primary=False)
+
+    def test_selling_out_reloads_the_snapshot(self):
+        catalog.snapshot()
+        order = Order.objects.create(user=User.objects.create_user('buyer'), order_number='TLSOLD',
+                                     total_price=0, final_price=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.sell(order, {self.product.pk: 2})
+        self.assertEqual(catalog.snapshot().get(self.product.pk).stock_quantity, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.sell(order, {self.product.pk: 1})
+        self.assertEqual(catalog.snapshot().get(self.product.pk).stock_quantity, 0)
+
+    def test_unavailable_products_leave_the_snapshot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.is_available = False
+            self.product.save()
+        self.assertIsNone(catalog.snapshot().get(self.product.pk))
+        self.assertRedirects(self.client.get(f'/product/{self.product.pk}/'), '/products/')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PopularityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='دسته')
+        cls.cheap, cls.old_hit, cls.recent_hit = Product.objects.bulk_create([
+            Product(name='ارزان', price=1_000, category=category, stock_quantity=5),
+            Product(name='پرفروش قدیمی', price=3_000, category=category, stock_quantity=5),
+            Product(name='پرفروش تازه', price=2_000, category=category, stock_quantity=5),
+        ])
+        user = User.objects.create_user('buyer')
+        now = timezone.now()
+        for days_ago, product, quantity, status in [
+            (60, cls.old_hit, 10, 'delivered'),
+            (1, cls.recent_hit, 4, 'delivered'),
+            (1, cls.cheap, 50, 'cancelled'),
+            (200, cls.cheap, 100, 'delivered'),
+        ]:
+            order = Order.objects.create(user=user, order_number=f'TLPOP{days_ago}{product.pk}',
+                                         total_price=0, final_price=0, status=status)
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(days=days_ago))
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.price)
+
+    def setUp(self):
+        catalog.reset()
+
+    def test_recent_sales_outweigh_old_ones(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(popularity.refresh_popularity(), 2)
+        scores = dict(Product.objects.values_list('pk', 'popularity_score'))
+        # Ten sales four half-lives ago count for less than four yesterday
+        self.assertAlmostEqual(scores[self.old_hit.pk], 10 * 0.5 ** (60 / 14), places=3)
+        self.assertGreater(scores[self.recent_hit.pk], scores[self.old_hit.pk])
+        # Cancelled orders and sales outside the window don't count
+        self.assertEqual(scores[self.cheap.pk], 0)
+        # Nothing changed, nothing is written
+        self.assertEqual(popularity.refresh_popularity(), 0)
+
+    def test_listing_sorts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            popularity.refresh_popularity()
+
+        def names(sort):
+            response = self.client.get('/products/', {'sort': sort})
+            return [product.name for product in response.context['products']]
+
+        self.assertEqual(names('popular'), ['پرفروش تازه', 'پرفروش قدیمی', 'ارزان'])
+        self.assertEqual(names('price'), ['ارزان', 'پرفروش تازه', 'پرفروش قدیمی'])
+        self.assertEqual(names('price_desc'), ['پرفروش قدیمی', 'پرفروش تازه', 'ارزان'])
+        self.assertEqual(names('bogus'), names('newest'))
+
+    def test_pages_keep_the_filters(self):
+        with mock.patch('store.views.PRODUCTS_PAGE_SIZE', 1):
+            response = self.client.get('/products/', {'sort': 'price', 'category': 'دسته', 'page': 2})
+        self.assertEqual([product.name for product in response.context['products']], ['پرفروش تازه'])
+        self.assertContains(response, '3 محصول یافت شد')
+        self.assertContains(response, '?page=3&sort=price&amp;category=')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='دسته')
+        cls.product = Product.objects.create(name='سیب', price=10_000, category=category, stock_quantity=5)
+
+    def setUp(self):
+        cache.clear()
+        catalog.reset()
+        counters.reset()
+
+    def counts(self):
+        return ProductCounter.objects.values_list('views', 'cart_adds').get(product=self.product)
+
+    def test_flushes_add_to_the_stored_counts(self):
+        counters.record(self.product.pk, 'views')
+        counters.record(self.product.pk, 'views')
+        counters.record(self.product.pk, 'cart_adds')
+        with self.assertNumQueries(3):  # savepoint, upsert, release
+            self.assertEqual(counters.flush(), 1)
+        self.assertEqual(self.counts(), (2, 1))
+
+        counters.record(self.product.pk, 'views', 5)
+        counters.flush()
+        self.assertEqual(self.counts(), (7, 1))
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.flush(), 0)
+
+    def test_failed_flush_keeps_the_counts(self):
+        counters.record(self.product.pk, 'views')
+        with mock.patch('store.counters._upsert', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                counters.flush()
+        counters.flush()
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_views_and_cart_adds_are_recorded_without_queries(self):
+        # Cookieless visitors get the shared page; session_state counts the view
+        self.client.get(f'/product/{self.product.pk}/')
+        self.client.get('/session/state/', {'viewed': self.product.pk})
+        self.client.post(f'/cart/add/{self.product.pk}/')
+        self.client.get(f'/product/{self.product.pk}/')
+        self.assertFalse(ProductCounter.objects.exists())
+        counters.flush()
+        self.assertEqual(self.counts(), (2, 1))
+
+    def test_views_are_counted_once_per_visitor(self):
+        for _ in range(5):
+            self.client.get('/session/state/', {'viewed': self.product.pk})
+            self.client.get('/session/state/', {'viewed': self.product.pk}, REMOTE_ADDR='10.0.0.2')
+        # A made-up session cookie doesn't make a new visitor
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'made-up'
+        self.client.get('/session/state/', {'viewed': self.product.pk})
+        self.client.post(f'/cart/add/{self.product.pk}/')
+        for _ in range(3):
+            self.client.get(f'/product/{self.product.pk}/')
+        counters.flush()
+        self.assertEqual(self.counts()[0], 3)
+
+    def test_counts_feed_popularity(self):
+        counters.record(self.product.pk, 'views', 100)
+        counters.flush()
+        with self.captureOnCommitCallbacks(execute=True):
+            popularity.refresh_popularity()
+        self.product.refresh_from_db()
+        # 100 views today are worth about two units sold
+        self.assertAlmostEqual(self.product.popularity_score, 2, delta=0.1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CategoryTreeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vegetables = Category.objects.create(name='سبزیجات')
+        cls.leafy = Category.objects.create(name='سبزی برگی', parent=cls.vegetables)
+        cls.herbs = Category.objects.create(name='سبزی خوردن', parent=cls.leafy)
+        cls.fruit = Category.objects.create(name='میوه')
+        cls.spinach = Product.objects.create(name='اسفناج', price=10_000, category=cls.herbs, stock_quantity=5)
+        cls.apple = Product.objects.create(name='سیب', price=10_000, category=cls.fruit, stock_quantity=5)
+
+    def setUp(self):
+        catalog.reset()
+
+    def test_paths_and_slugs(self):
+        self.assertEqual(self.herbs.path, f'{self.vegetables.pk}/{self.leafy.pk}/{self.herbs.pk}/')
+        self.assertEqual(self.herbs.depth, 2)
+        self.assertEqual(self.leafy.slug, 'سبزی-برگی')
+        self.assertEqual(Category.objects.create(name='سبزی برگی').slug, 'سبزی-برگی-2')
+
+    def test_subtree_is_one_query(self):
+        with self.assertNumQueries(1):
+            names = list(
+                Product.objects.filter(Category.subtree_filter(self.vegetables.path, 'category__'))
+                .values_list('name', flat=True)
+            )
+        self.assertEqual(names, ['اسفناج'])
+
+    def test_moving_a_category_moves_its_subtree(self):
+        self.leafy.parent = self.fruit
+        self.leafy.save()
+        self.herbs.refresh_from_db()
+        self.assertEqual(self.herbs.path, f'{self.fruit.pk}/{self.leafy.pk}/{self.herbs.pk}/')
+        self.assertEqual(self.herbs.depth, 2)
+        self.assertEqual(list(self.vegetables.subtree()), [self.vegetables])
+
+        self.leafy.parent = self.herbs
+        with self.assertRaises(ValidationError):
+            self.leafy.full_clean()
+
+    def test_listing_filters_by_subtree_slug(self):
+        response = self.client.get('/products/', {'category': self.vegetables.slug})
+        self.assertEqual([product.name for product in response.context['products']], ['اسفناج'])
+        response = self.client.get('/products/', {'category': 'سبزیجات-ناموجود'})
+        self.assertEqual(len(response.context['products']), 0)
+
+    def test_breadcrumbs_and_menu(self):
+        response = self.client.get(f'/product/{self.spinach.pk}/')
+        self.assertEqual(
+            [category.name for category in response.context['category_trail']],
+            ['سبزیجات', 'سبزی برگی', 'سبزی خوردن'],
+        )
+        self.assertContains(response, '?category=%D8%B3%D8%A8%D8%B2%DB%8C-%D8%A8%D8%B1%DA%AF%DB%8C')
+        # The menu is rendered once and reused until the catalog changes
+        self.assertIn('category_menu', catalog.snapshot()._fragments)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class EarlyHintsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='دسته')
+        cls.product = Product.objects.create(
+            name='انجیر', price=10_000, category=category, stock_quantity=5, image='products/fig.jpg',
+            is_featured=True,
+        )
+
+    def setUp(self):
+        catalog.reset()
+
+    def test_hints_are_sent_before_the_view_and_as_a_header(self):
+        sent = []
+        response = self.client.get(f'/product/{self.product.pk}/', **{'wsgi.early_hints': sent.extend})
+        links = [value for _, value in sent]
+        self.assertIn('</media/products/fig.jpg>; rel=preload; as=image', links)
+        # Hashed from the manifest, like the <link> in the page
+        self.assertIn(f'<{static("store/css/style.css")}>; rel=preload; as=style', links)
+        self.assertEqual(response['Link'], ', '.join(links))
+
+    def test_without_early_hints_only_the_header_is_sent(self):
+        self.assertIn('</media/products/fig.jpg>', self.client.get('/')['Link'])
+        self.assertNotIn('fig.jpg', self.client.get('/about/')['Link'])
+        self.assertFalse(self.client.get('/session/state/').has_header('Link'))
+
+    def test_pages_without_an_image_hint_skip_the_catalog(self):
+        with mock.patch.object(catalog, 'snapshot') as snapshot:
+            self.assertEqual(preload.links('about', {}), list(preload.asset_links()))
+        snapshot.assert_not_called()
+
+
+class StockLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='دسته')
+        cls.apple = Product.objects.create(name='سیب', price=1_000, category=category, image='products/apple.jpg')
+        inventory.record_movement(cls.apple.pk, StockMovement.RECEIPT, 5)
+        cls.apple.refresh_from_db()
+        cls.user = User.objects.create_user('ledger')
+
+    def balance(self):
+        return Product.objects.get(pk=self.apple.pk).stock_quantity
+
+    def test_reservations_cannot_oversell(self):
+        self.assertTrue(inventory.reserve('cart-a', self.apple, 3))
+        self.assertFalse(inventory.reserve('cart-b', self.apple, 3))
+        self.assertTrue(inventory.reserve('cart-b', self.apple, 2))
+        self.assertEqual(inventory.available_quantity(self.apple, 'cart-a'), 3)
+        # Growing your own hold only competes with the other carts
+        self.assertTrue(inventory.reserve('cart-a', self.apple, 3))
+        self.assertFalse(inventory.reserve('cart-a', self.apple, 4))
+
+        order = Order.objects.create(user=self.user, order_number='TLLEDGER', total_price=0, final_price=0)
+        with self.assertRaises(inventory.InsufficientStock) as raised:
+            inventory.sell(order, {self.apple.pk: 4}, session_key='cart-a')
+        self.assertEqual(raised.exception.product_id, self.apple.pk)
+        self.assertEqual(self.balance(), 5)
+        inventory.sell(order, {self.apple.pk: 3}, session_key='cart-a')
+        self.assertEqual(self.balance(), 2)
+
+    def test_expired_holds_are_freed(self):
+        inventory.reserve('cart-a', self.apple, 5)
+        self.assertFalse(inventory.reserve('cart-b', self.apple, 1))
+        StockReservation.objects.update(expires_at=timezone.now())
+        self.assertTrue(inventory.reserve('cart-b', self.apple, 5))
+        self.assertEqual(inventory.purge_expired_reservations(batch_size=1), 1)
+        self.assertEqual(list(StockReservation.objects.values_list('session_key', flat=True)), ['cart-b'])
+
+    def test_holds_follow_the_cart_and_are_released(self):
+        inventory.reserve('anonymous', self.apple, 2)
+        inventory.transfer_reservations('anonymous', 'logged-in')
+        self.assertEqual(inventory.reserved_quantities([self.apple.pk]), {self.apple.pk: 2})
+        self.assertEqual(inventory.available_quantity(self.apple, 'logged-in'), 5)
+        inventory.release('logged-in', [self.apple.pk])
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_reconcile_resets_balances_to_the_ledger(self):
+        Product.objects.filter(pk=self.apple.pk).update(stock_quantity=40)
+        out = StringIO()
+        call_command('reconcile_stock', stdout=out)
+        self.assertIn('1 mismatched', out.getvalue())
+        self.assertEqual(self.balance(), 40)
+        call_command('reconcile_stock', '--fix', stdout=out)
+        self.assertEqual(self.balance(), StockMovement.objects.aggregate(total=Sum('quantity'))['total'])
+        self.assertEqual(self.balance(), 5)
+
+    def test_admin_edits_leave_the_stock_alone(self):
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_superuser('stock-admin', password='x')
+        model_admin = admin_site._registry[Product]
+        product = Product.objects.get(pk=self.apple.pk)
+        # A sale lands between the admin loading the product and saving it
+        inventory.record_movement(self.apple.pk, StockMovement.SALE, -2)
+        form = model_admin.get_form(request, product, change=True)({
+            'name': 'سیب قرمز', 'description': '', 'price': 1_000, 'category': product.category_id,
+            'is_available': 'on',
+        }, instance=product)
+        self.assertTrue(form.is_valid(), form.errors)
+        model_admin.save_model(request, form.save(commit=False), form, change=True)
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.stock_quantity), ('سیب قرمز', 3))
+
+
+class OrderTransitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='دسته')
+        cls.apple, cls.pear = Product.objects.bulk_create([
+            Product(name='سیب', price=1_000, category=category, stock_quantity=100),
+            Product(name='گلابی', price=2_000, category=category, stock_quantity=100),
+        ])
+        cls.admin = User.objects.create_superuser('admin', password='x')
+        cls.orders = []
+        for n in range(6):
+            order = Order.objects.create(user=cls.admin, order_number=f'TLSM{n}', total_price=0, final_price=0)
+            inventory.sell(order, {cls.apple.pk: 2, cls.pear.pk: 1})
+            cls.orders.append(order)
+
+    def selection(self, *orders):
+        return Order.objects.filter(pk__in=[order.pk for order in orders])
+
+    def test_only_allowed_sources_move(self):
+        first, second = self.orders[:2]
+        Order.objects.filter(pk=second.pk).update(status='delivered')
+        before = Order.objects.get(pk=first.pk).updated_at
+        self.assertEqual(orders.transition(self.selection(first, second), 'processing', user=self.admin), 1)
+        self.assertEqual(
+            dict(Order.objects.filter(pk__in=[first.pk, second.pk]).values_list('pk', 'status')),
+            {first.pk: 'processing', second.pk: 'delivered'},
+        )
+        self.assertGreater(Order.objects.get(pk=first.pk).updated_at, before)
+        change = OrderStatusChange.objects.get()
+        self.assertEqual((change.order_id, change.from_status, change.to_status), (first.pk, 'pending', 'processing'))
+        with self.assertRaises(ValueError):
+            orders.transition(self.selection(first), 'pending')
+
+    def test_cancelling_restocks_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(orders.transition(self.selection(*self.orders), 'cancelled'), 6)
+        self.assertEqual(
+            dict(Product.objects.values_list('pk', 'stock_quantity')),
+            {self.apple.pk: 100, self.pear.pk: 100},
+        )
+        self.assertEqual(StockMovement.objects.filter(kind=StockMovement.CANCELLATION).count(), 12)
+        # Already cancelled orders are skipped, so nothing is returned twice
+        self.assertEqual(orders.transition(self.selection(*self.orders), 'cancelled'), 0)
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).stock_quantity, 100)
+
+    def test_statement_count_does_not_grow_with_the_selection(self):
+        # Six statements and two savepoints, for two orders or four
+        with self.assertNumQueries(10):
+            orders.transition(self.selection(*self.orders[:2]), 'cancelled')
+        with self.assertNumQueries(10):
+            orders.transition(self.selection(*self.orders[2:]), 'cancelled')
+
+    def test_admin_action(self):
+        self.client.force_login(self.admin)
+        response = self.client.post('/admin/store/order/', {
+            'action': 'mark_as_shipped',
+            '_selected_action': [order.pk for order in self.orders[:2]],
+        }, follow=True)
+        self.assertContains(response, '2 سفارش در وضعیتی بود')
+        self.assertFalse(Order.objects.filter(status='shipped').exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class OrderArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='دسته')
+        cls.apple = Product.objects.create(name='سیب', price=1_000, category=category, stock_quantity=10)
+        cls.user = User.objects.create_user('archived', password='archive-password-123')
+        cls.placed_at = timezone.now() - timedelta(days=400)
+        cls.orders = {}
+        for status, steps in [
+            ('delivered', ('processing', 'shipped', 'delivered')),
+            ('shipped', ('processing', 'shipped')),
+        ]:
+            order = Order.objects.create(user=cls.user, order_number=f'TLARC{status}', total_price=3_000,
+                                         final_price=3_000)
+            OrderItem.objects.create(order=order, product=cls.apple, quantity=3, price=1_000)
+            inventory.sell(order, {cls.apple.pk: 3})
+            for step in steps:
+                orders.transition(Order.objects.filter(pk=order.pk), step)
+            cls.orders[status] = order
+        Order.objects.update(created_at=cls.placed_at)
+        cls.recent = Order.objects.create(user=cls.user, order_number='TLARCNEW', total_price=0, final_price=0,
+                                          status='delivered')
+
+    def setUp(self):
+        catalog.reset()
+
+    def test_only_old_finished_orders_are_archived(self):
+        self.assertEqual(archive.archive(days=180, batch_size=1), 1)
+        delivered = self.orders['delivered']
+        self.assertEqual(
+            set(Order.objects.values_list('order_number', flat=True)), {'TLARCshipped', 'TLARCNEW'},
+        )
+        archived_order = ArchivedOrder.objects.get()
+        self.assertEqual((archived_order.pk, archived_order.created_at), (delivered.pk, self.placed_at))
+        self.assertEqual(
+            [(item.product.name, item.quantity, item.total) for item in archive.items(archived_order)],
+            [('سیب', 3, 3_000)],
+        )
+        # The ledger keeps the sale, without the order it belonged to
+        self.assertEqual(StockMovement.objects.filter(kind=StockMovement.SALE, order=None).count(), 1)
+
+    def test_archived_orders_stay_in_the_customers_history(self):
+        archive.archive(days=180)
+        self.client.force_login(self.user)
+        response = self.client.get('/profile/')
+        self.assertEqual(
+            [order.order_number for order in response.context['orders']],
+            ['TLARCNEW', 'TLARCshipped', 'TLARCdelivered'],
+        )
+        self.assertEqual(response.context['orders'][2].quantity_total, 3)
+        response = self.client.get(f'/order/{self.orders["delivered"].pk}/')
+        self.assertContains(response, 'TLARCdelivered')
+        self.assertContains(response, 'سیب')
+
+    def test_restore_puts_everything_back(self):
+        delivered = self.orders['delivered']
+        history = list(delivered.status_changes.values_list('from_status', 'to_status'))
+        archive.archive(days=180)
+        self.assertEqual(archive.restore(ArchivedOrder.objects.all()), 1)
+        self.assertFalse(ArchivedOrder.objects.exists())
+        order = Order.objects.get(pk=delivered.pk)
+        self.assertEqual((order.order_number, order.created_at), ('TLARCdelivered', self.placed_at))
+        self.assertEqual(list(order.orderitem_set.values_list('product', 'quantity')), [(self.apple.pk, 3)])
+        self.assertEqual(list(order.status_changes.values_list('from_status', 'to_status')), history)
+        self.assertEqual(order.stock_movements.get().kind, StockMovement.SALE)
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    def test_concurrent_writers_never_hit_database_is_locked(self):
+        # Separate processes on a file database, like gunicorn workers; see
+        # benchmarks/sqlite_stress.py for the comparison with SQLite's defaults
+        result = subprocess.run(
+            [sys.executable, 'benchmarks/sqlite_stress.py', '--profile-only', '--workers', '4', '--iterations', '50'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=300,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn(' 0 lock errors', result.stdout)
@@ -0,0 +1,92 @@
+"""
+Rate limiting with fixed-window counters in the shared cache.
+
+Each (scope, identity) pair has one counter per window of the rate's period,
+bumped with incr, which is atomic on Redis, so concurrent requests can't
+overwrite each other's counts.  A check costs one incr per identity.
+
+Failed logins are also counted per username and client IP, charged from the
+user_login_failed signal, so a wrong password can only lock out the address
+that sent it.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Turn '5/m' into (requests allowed, period in seconds)."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def client_ip(request):
+    if getattr(settings, 'THROTTLE_TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _digest(value):
+    return hashlib.blake2b(value.encode(), digest_size=8).hexdigest()
+
+
+def identities(request):
+    """Throttle identities for a request, derived without touching the session or DB."""
+    idents = ['ip:' + client_ip(request)]
+    session_cookie = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if session_cookie:
+        # Hashing the cookie identifies the visitor without loading the session
+        idents.append('session:' + _digest(session_cookie))
+    return idents
+
+
+def _login_identity(request, username):
+    return 'login:' + _digest(username.strip().lower() + '\0' + client_ip(request))
+
+
+def consume(scope, idents, limit, period, now=None):
+    """Count a request against every identity, returning 0 or seconds to wait."""
+    now = time.time() if now is None else now
+    window = int(now // period)
+    wait = 0
+    for ident in idents:
+        key = f'throttle:{scope}:{ident}:{window}'
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # First request of the window; the counter expires with it
+            count = 1 if cache.add(key, 1, period + 1) else cache.incr(key)
+        if count > limit:
+            wait = (window + 1) * period - now
+    return wait
+
+
+def _login_failures():
+    rate = getattr(settings, 'THROTTLE_LOGIN_FAILURES', None)
+    return parse_rate(rate) if rate else None
+
+
+def login_wait(request, now=None):
+    """Seconds until this address may try the submitted username again, or 0."""
+    rate = _login_failures()
+    username = request.POST.get('username')
+    if rate is None or not username:
+        return 0
+    limit, period = rate
+    now = time.time() if now is None else now
+    window = int(now // period)
+    failures = cache.get(f'throttle:login_failure:{_login_identity(request, username)}:{window}', 0)
+    return (window + 1) * period - now if failures >= limit else 0
+
+
+def login_failed(request, username, now=None):
+    """Count a failed login for the username from this address."""
+    rate = _login_failures()
+    if rate is not None and request is not None and username:
+        consume('login_failure', [_login_identity(request, username)], *rate, now=now)
@@ -37,14 +37,19 @@ urlpatterns = [
     path("cart/clear/", views.clear_cart, name="clear_cart"),
     path("cart/apply-discount/", views.apply_discount_code, name="apply_discount"),
     path("cart/remove-discount/", views.remove_discount_code, name="remove_discount"),
+    path("session/state/", views.session_state, name="session_state"),
     
     # Checkout
     path("checkout/", views.checkout, name="checkout"),
     path("order/confirmation/<int:order_id>/", views.order_confirmation, name="order_confirmation"),
+    path("order/<int:order_id>/", views.order_detail, name="order_detail"),
     
     # Authentication
     path("register/", views.register_view, name="register"),
     path("login/", views.login_view, name="login"),
     path("logout/", views.logout_view, name="logout"),
     path("profile/", views.profile_view, name="profile"),
+    
+    # Monitoring
+    path("metrics/", views.metrics_view, name="metrics"),
 ]
\ No newline at end of file
@@ -3,85 +3,121 @@ from django.contrib import messages
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
-from django.db.models import Q
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.db.models import Count, Prefetch, Q, Sum
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
 from django.core.exceptions import PermissionDenied
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.paginator import Paginator
+from django.middleware.csrf import get_token
+from django.urls import reverse
+from django.views.decorators.cache import never_cache
+from django.utils.crypto import constant_time_compare
 from django.utils import timezone
-from .models import Product, SiteSettings, Category, UserProfile, DiscountCode, Order, OrderItem
+from django.db import IntegrityError, transaction
+from .models import Product, SiteSettings, Category, UserProfile, DiscountCode, Order, OrderItem, ArchivedOrder
+from . import archive, catalog, counters, discounts, idempotency, inventory, jobs, metrics, site
+from datetime import datetime, timedelta, timezone as dt_timezone
+import logging
 import random
 import string
 
+logger = logging.getLogger(__name__)
+
+PRODUCTS_PAGE_SIZE = 24
+PRODUCT_SORT_OPTIONS = [
+    ('newest', 'جدیدترین'),
+    ('popular', 'پرفروش‌ترین'),
+    ('price', 'ارزان‌ترین'),
+    ('price_desc', 'گران‌ترین'),
+]
+ORDER_HISTORY_PAGE_SIZE = 10
+ORDER_PREVIEW_ITEMS = 3
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def _cart_session_key(request):
+    # Stock reservations are keyed by session, so make sure one exists
+    if not request.session.session_key:
+        request.session.save()
+    return request.session.session_key
+
+def _cart_product_ids(cart):
+    return [int(product_id) for product_id in cart if product_id.isdigit()]
+
+def _cart_products(cart):
+    # Display prices come from the catalog snapshot; checkout reads the
+    # database so an order is always placed at the current price
+    return catalog.snapshot().in_bulk(_cart_product_ids(cart))
+
 def home(request):
-    try:
-        featured_products = Product.objects.filter(is_featured=True, is_available=True)[:8]
-    except Exception as e:
-        featured_products = []
+    featured_products = catalog.snapshot().featured[:8]
     
     return render(request, "store/index.html", {"featured_products": featured_products})
 
 def products(request):
-    try:
-        products_list = Product.objects.filter(is_available=True)
-        
-        # Search functionality
-        search_query = request.GET.get('search', '').strip()
-        if search_query:
-            products_list = products_list.filter(
-                Q(name__icontains=search_query) | 
-                Q(description__icontains=search_query)
-            )
-        
-        # Category filter
-        category_filter = request.GET.get('category', '')
-        if category_filter:
-            products_list = products_list.filter(category__name=category_filter)
-        
-        # Price filter with validation
-        price_min = request.GET.get('price_min')
-        price_max = request.GET.get('price_max')
-        
-        if price_min and price_min.isdigit():
-            products_list = products_list.filter(price__gte=int(price_min))
-        if price_max and price_max.isdigit():
-            products_list = products_list.filter(price__lte=int(price_max))
-        
-        categories = Category.objects.filter(is_active=True)
-    except Exception as e:
+    snapshot = catalog.snapshot()
+    search_query = request.GET.get('search', '').strip()
+    category_filter = request.GET.get('category', '')
+    
+    # Price filter with validation
+    price_min = request.GET.get('price_min')
+    price_max = request.GET.get('price_max')
+    sort = request.GET.get('sort', catalog.DEFAULT_SORT)
+    if sort not in catalog.SORTS:
+        sort = catalog.DEFAULT_SORT
+    
+    # ?category= is a slug and covers the category's subcategories too
+    category = snapshot.category(category_filter) if category_filter else None
+    if category_filter and category is None:
         products_list = []
-        categories = []
-        search_query = ''
-        category_filter = ''
-        price_min = ''
-        price_max = ''
+    else:
+        products_list = snapshot.search(
+            search_query,
+            category,
+            int(price_min) if price_min and price_min.isdigit() else None,
+            int(price_max) if price_max and price_max.isdigit() else None,
+            sort,
+        )
+    categories = snapshot.categories
+    page = Paginator(products_list, PRODUCTS_PAGE_SIZE).get_page(request.GET.get('page'))
+    # Page links keep the filters and sort order
+    page_query = request.GET.copy()
+    page_query.pop('page', None)
     
     context = {
-        'products': products_list,
+        'products': page,
+        'page_range': page.paginator.get_elided_page_range(page.number, on_each_side=2, on_ends=1),
+        'page_query': page_query.urlencode(),
         'categories': categories,
         'search_query': search_query,
         'selected_category': category_filter,
+        'category_trail': snapshot.ancestors(category) if category else [],
         'price_min': price_min,
         'price_max': price_max,
+        'sort': sort,
+        'sort_options': PRODUCT_SORT_OPTIONS,
     }
     return render(request, "store/products.html", context)
 
 def product_detail(request, pk):
-    try:
-        product = get_object_or_404(Product, pk=pk, is_available=True)
-        related_products = Product.objects.filter(
-            category=product.category, 
-            is_available=True
-        ).exclude(pk=product.pk)[:4]
-    except Exception as e:
-        product = None
-        related_products = []
+    snapshot = catalog.snapshot()
+    product = snapshot.get(pk)
+    # Precomputed "frequently bought together" list (see compute_recommendations),
+    # or the same category for a cold product with no order history yet
+    related_products = snapshot.related(product) if product else []
     
     if not product:
         messages.error(request, 'محصول مورد نظر یافت نشد.')
         return redirect('products')
+    # A public page may be served from an edge cache; its view is counted
+    # when the page asks session_state for the visitor's state
+    if not getattr(request, 'public_page', False):
+        counters.record_view(request, product.id)
     
     context = {
         'product': product,
-        'related_products': related_products
+        'related_products': related_products,
+        'category_trail': snapshot.ancestors(product.category),
     }
     return render(request, "store/product_detail.html", context)
 
@@ -104,7 +140,7 @@ def contact(request):
             messages.error(request, 'پیام باید حداقل ۱۰ کاراکتر داشته باشد.')
             return render(request, "store/contact.html")
         
-        # Here you would typically save to database or send email
+        jobs.enqueue('send_contact_message', name=name, email=email, subject=subject, message=message)
         messages.success(request, 'پیام شما با موفقیت ارسال شد. به زودی با شما تماس خواهیم گرفت.')
         return redirect('contact')
     
@@ -122,9 +158,11 @@ def register_view(request):
             # Create user profile
             try:
                 UserProfile.objects.create(user=user)
-            except:
-                pass
+            except Exception:
+                logger.exception('Creating the profile for user %s failed', user.pk)
+            old_session_key = request.session.session_key
             login(request, user)
+            inventory.transfer_reservations(old_session_key, request.session.session_key)
             messages.success(request, 'ثبت‌نام با موفقیت انجام شد!')
             return redirect('home')
         else:
@@ -145,7 +183,9 @@ def login_view(request):
             password = form.cleaned_data.get('password')
             user = authenticate(username=username, password=password)
             if user is not None:
+                old_session_key = request.session.session_key
                 login(request, user)
+                inventory.transfer_reservations(old_session_key, request.session.session_key)
                 messages.success(request, f'خوش آمدید {user.username}!')
                 next_url = request.GET.get('next', 'home')
                 return redirect(next_url)
@@ -162,40 +202,84 @@ def logout_view(request):
         messages.success(request, 'با موفقیت خارج شدید.')
     return redirect('home')
 
+def _order_cursor(order):
+    # Exact microseconds, so orders placed in the same second keep their place
+    return f'{(order.created_at - _EPOCH) // timedelta(microseconds=1)}_{order.id}'
+
+def _parse_order_cursor(value):
+    try:
+        micros, order_id = value.split('_')
+        return _EPOCH + timedelta(microseconds=int(micros)), int(order_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
 @login_required
 def profile_view(request):
-    return render(request, 'store/auth/profile.html')
+    # Keyset pagination: "older" pages continue after the last order shown,
+    # which stays cheap however many orders a customer has
+    orders = (
+        Order.objects.filter(user=request.user)
+        .annotate(item_count=Count('orderitem'), quantity_total=Sum('orderitem__quantity'))
+        .prefetch_related(Prefetch(
+            'orderitem_set',
+            queryset=OrderItem.objects.select_related('product').order_by('id')[:ORDER_PREVIEW_ITEMS],
+            to_attr='preview_items',
+        ))
+        .order_by('-created_at', '-id')
+    )
+    # Old orders are in the archive (see store.archive); both are read with
+    # the same cursor and merged
+    archived_orders = ArchivedOrder.objects.filter(user=request.user).order_by('-created_at', '-id')
+    cursor = _parse_order_cursor(request.GET.get('before'))
+    if cursor:
+        created_at, order_id = cursor
+        older = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id)
+        orders = orders.filter(older)
+        archived_orders = archived_orders.filter(older)
+    
+    orders = sorted(
+        [*orders[:ORDER_HISTORY_PAGE_SIZE + 1], *archived_orders[:ORDER_HISTORY_PAGE_SIZE + 1]],
+        key=lambda order: (order.created_at, order.id),
+        reverse=True,
+    )[:ORDER_HISTORY_PAGE_SIZE + 1]
+    next_cursor = None
+    if len(orders) > ORDER_HISTORY_PAGE_SIZE:
+        orders = orders[:ORDER_HISTORY_PAGE_SIZE]
+        next_cursor = _order_cursor(orders[-1])
+    archive.with_items(
+        [order for order in orders if isinstance(order, ArchivedOrder)], preview=ORDER_PREVIEW_ITEMS
+    )
+    for order in orders:
+        order.more_items = order.item_count - len(order.preview_items)
+    
+    return render(request, 'store/auth/profile.html', {
+        'orders': orders,
+        'next_cursor': next_cursor,
+        'is_first_page': cursor is None,
+    })
 
 # Discount Code System
 def apply_discount_code(request):
     if request.method == 'POST':
-        discount_code = request.POST.get('discount_code', '').strip().upper()
+        discount_code = discounts.normalize_code(request.POST.get('discount_code'))
         
         if not discount_code:
             messages.error(request, 'لطفاً کد تخفیف را وارد کنید.')
             return redirect('cart')
         
-        try:
-            discount = DiscountCode.objects.get(
-                code=discount_code,
-                is_active=True,
-                valid_from__lte=timezone.now(),
-                valid_to__gte=timezone.now()
-            )
-            
-            if discount.used_count >= discount.max_usage:
-                messages.error(request, 'این کد تخفیف منقضی شده است.')
-            else:
-                # Store discount in session
-                request.session['discount_code'] = {
-                    'code': discount.code,
-                    'percent': discount.discount_percent,
-                    'id': discount.id
-                }
-                messages.success(request, f'کد تخفیف {discount.discount_percent}% اعمال شد!')
-                
-        except DiscountCode.DoesNotExist:
+        discount = discounts.lookup(discount_code)
+        if discount is None:
             messages.error(request, 'کد تخفیف معتبر نیست.')
+        elif discount['used_count'] >= discount['max_usage']:
+            messages.error(request, 'این کد تخفیف منقضی شده است.')
+        else:
+            # Store discount in session; it is redeemed at checkout
+            request.session['discount_code'] = {
+                'code': discount['code'],
+                'percent': discount['discount_percent'],
+                'id': discount['id']
+            }
+            messages.success(request, f'کد تخفیف {discount["discount_percent"]}% اعمال شد!')
         
         return redirect('cart')
 
@@ -211,43 +295,47 @@ def cart(request):
     cart_items = []
     total_price = 0
     cart_items_count = 0
+    held_elsewhere = inventory.reserved_quantities(
+        list(cart.keys()), exclude_session=request.session.session_key
+    ) if cart else {}
+    products = _cart_products(cart) if cart else {}
     
-    for product_id, item_data in cart.items():
-        try:
-            product = Product.objects.get(id=product_id, is_available=True)
-            quantity = item_data.get('quantity', 1)
-            
-            # Validate quantity
-            if quantity < 1:
-                quantity = 1
-            if quantity > 99:
-                quantity = 99
-            
-            # Check stock
-            if quantity > product.stock_quantity:
-                quantity = product.stock_quantity
-                messages.warning(request, f'تعداد {product.name} به دلیل محدودیت موجودی کاهش یافت.')
-            
-            item_total = product.price * quantity
-            total_price += item_total
-            cart_items_count += quantity
-            
-            cart_items.append({
-                'id': product_id,
-                'product': product,
-                'quantity': quantity,
-                'total': item_total
-            })
-        except Product.DoesNotExist:
+    for product_id, item_data in list(cart.items()):
+        product = products.get(int(product_id)) if product_id.isdigit() else None
+        if product is None:
             # Remove invalid products from cart
-            if product_id in cart:
-                del cart[product_id]
-                request.session['cart'] = cart
+            del cart[product_id]
+            request.session['cart'] = cart
             continue
+        
+        quantity = item_data.get('quantity', 1)
+        
+        # Validate quantity
+        if quantity < 1:
+            quantity = 1
+        if quantity > 99:
+            quantity = 99
+        
+        # Check stock not held by other carts
+        available = max(0, product.stock_quantity - held_elsewhere.get(product.id, 0))
+        if quantity > available:
+            quantity = available
+            messages.warning(request, f'تعداد {product.name} به دلیل محدودیت موجودی کاهش یافت.')
+        
+        item_total = product.price * quantity
+        total_price += item_total
+        cart_items_count += quantity
+        
+        cart_items.append({
+            'id': product_id,
+            'product': product,
+            'quantity': quantity,
+            'total': item_total
+        })
     
     # Get delivery settings
     try:
-        site_settings = SiteSettings.objects.first()
+        site_settings = site.settings()
         if site_settings:
             delivery_fee = site_settings.delivery_fee
             free_delivery_threshold = site_settings.free_delivery_threshold
@@ -299,7 +387,8 @@ def cart(request):
         'free_delivery_threshold': free_delivery_threshold,
         'free_delivery_enabled': free_delivery_enabled,
         'delivery_fee': delivery_fee,
-        'remaining_amount': remaining_amount
+        'remaining_amount': remaining_amount,
+        'checkout_key': idempotency.issue(),
     }
     return render(request, "store/cart.html", context)
 
@@ -313,9 +402,9 @@ def add_to_cart(request, pk):
         
         product_id = str(product.id)
         
-        # Check stock
+        # Reserve stock for this cart
         current_quantity = cart.get(product_id, {}).get('quantity', 0)
-        if current_quantity + 1 > product.stock_quantity:
+        if not inventory.reserve(_cart_session_key(request), product, current_quantity + 1):
             messages.error(request, f'موجودی {product.name} کافی نیست.')
             return redirect('products')
         
@@ -325,13 +414,16 @@ def add_to_cart(request, pk):
             cart[product_id] = {'quantity': 1}
         
         request.session['cart'] = cart
+        metrics.inc('store_cart_additions_total')
+        counters.record(product.id, 'cart_adds')
         messages.success(request, f'{product.name} به سبد خرید اضافه شد')
         
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
             return JsonResponse({'success': True, 'message': f'{product.name} به سبد خرید اضافه شد'})
         
         return redirect('products')
-    except Exception as e:
+    except Exception:
+        logger.exception('Adding product %s to the cart failed', pk)
         messages.error(request, 'خطا در افزودن محصول به سبد خرید')
         return redirect('products')
 
@@ -349,9 +441,10 @@ def update_cart(request, pk):
         
         if product_id in cart:
             current_quantity = cart[product_id].get('quantity', 1)
+            session_key = _cart_session_key(request)
             
             if action == 'increase':
-                if current_quantity + 1 <= product.stock_quantity:
+                if inventory.reserve(session_key, product, current_quantity + 1):
                     cart[product_id]['quantity'] = current_quantity + 1
                     messages.success(request, f'تعداد {product.name} افزایش یافت')
                 else:
@@ -360,6 +453,7 @@ def update_cart(request, pk):
             elif action == 'decrease':
                 if current_quantity > 1:
                     cart[product_id]['quantity'] = current_quantity - 1
+                    inventory.hold(session_key, product.id, current_quantity - 1)
                     messages.success(request, f'تعداد {product.name} کاهش یافت')
                 else:
                     messages.warning(request, 'حداقل تعداد محصول ۱ می‌باشد')
@@ -367,18 +461,21 @@ def update_cart(request, pk):
             elif quantity and quantity.isdigit():
                 new_quantity = int(quantity)
                 if 1 <= new_quantity <= 99:
-                    if new_quantity <= product.stock_quantity:
+                    if inventory.reserve(session_key, product, new_quantity):
                         cart[product_id]['quantity'] = new_quantity
                         messages.success(request, f'تعداد {product.name} به {new_quantity} عدد تغییر یافت')
                     else:
                         messages.error(request, f'موجودی {product.name} کافی نیست.')
-                        cart[product_id]['quantity'] = product.stock_quantity
+                        available = inventory.available_quantity(product, session_key)
+                        cart[product_id]['quantity'] = available
+                        inventory.hold(session_key, product.id, available)
                 else:
                     messages.error(request, 'تعداد باید بین ۱ تا ۹۹ باشد.')
         
         request.session['cart'] = cart
         return redirect('cart')
-    except Exception as e:
+    except Exception:
+        logger.exception('Updating product %s in the cart failed', pk)
         messages.error(request, 'خطا در بروزرسانی سبد خرید')
         return redirect('cart')
 
@@ -394,10 +491,12 @@ def remove_from_cart(request, pk):
             product = get_object_or_404(Product, pk=pk)
             del cart[product_id]
             request.session['cart'] = cart
+            inventory.release(request.session.session_key, [pk])
             messages.success(request, f'{product.name} از سبد خرید حذف شد')
         
         return redirect('cart')
-    except Exception as e:
+    except Exception:
+        logger.exception('Removing product %s from the cart failed', pk)
         messages.error(request, 'خطا در حذف محصول از سبد خرید')
         return redirect('cart')
 
@@ -408,10 +507,40 @@ def clear_cart(request):
     request.session['cart'] = {}
     if 'discount_code' in request.session:
         del request.session['discount_code']
+    inventory.release(request.session.session_key)
     messages.success(request, 'سبد خرید پاک شد')
     return redirect('cart')
 
+@never_cache
+def session_state(request):
+    """The per-visitor parts of a public page, fetched by store/js/session.js."""
+    cart = request.session.get('cart', {})
+    user = request.user
+    viewed = request.GET.get('viewed', '')
+    if viewed.isdigit() and catalog.snapshot().get(int(viewed)):
+        counters.record_view(request, int(viewed))
+    return JsonResponse({
+        'csrf_token': get_token(request),
+        'cart_items_count': sum(item.get('quantity', 1) for item in cart.values()),
+        'messages': [{'tags': message.tags, 'text': str(message)} for message in get_messages(request)],
+        'username': user.username if user.is_authenticated else None,
+        'profile_url': reverse('profile'),
+    })
+
 def checkout(request):
+    if request.method != 'POST':
+        return HttpResponseBadRequest("Invalid method")
+    
+    key = request.POST.get('idempotency_key', '')
+    if not idempotency.is_valid(key):
+        messages.error(request, 'درخواست ثبت سفارش نامعتبر است. لطفاً دوباره تلاش کنید.')
+        return redirect('cart')
+    # A double click or a retry of a checkout that already went through
+    order_id = idempotency.order_for(key, request.user)
+    if order_id:
+        metrics.inc('store_checkouts_total', outcome='duplicate')
+        return redirect('order_confirmation', order_id=order_id)
+    
     cart = request.session.get('cart', {})
     cart_items_count = sum(item.get('quantity', 1) for item in cart.values())
     
@@ -423,22 +552,22 @@ def checkout(request):
         # Calculate totals
         total_price = 0
         cart_items = []
+        products = Product.objects.filter(is_available=True).in_bulk(_cart_product_ids(cart))
         
         for product_id, item_data in cart.items():
-            try:
-                product = Product.objects.get(id=product_id, is_available=True)
-                quantity = item_data.get('quantity', 1)
-                item_total = product.price * quantity
-                total_price += item_total
-                
-                cart_items.append({
-                    'product': product,
-                    'quantity': quantity,
-                    'price': product.price,
-                    'total': item_total
-                })
-            except Product.DoesNotExist:
+            product = products.get(int(product_id)) if product_id.isdigit() else None
+            if product is None:
                 continue
+            quantity = item_data.get('quantity', 1)
+            item_total = product.price * quantity
+            total_price += item_total
+            
+            cart_items.append({
+                'product': product,
+                'quantity': quantity,
+                'price': product.price,
+                'total': item_total
+            })
         
         if not cart_items:
             messages.error(request, 'سبد خرید شما خالی است')
@@ -481,24 +610,61 @@ def checkout(request):
             random_str = ''.join(random.choices(string.digits, k=4))
             return f'TL{timestamp}{random_str}'
         
-        # Create order
-        order = Order.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            order_number=generate_order_number(),
-            total_price=total_price,
-            shipping_cost=shipping_cost,
-            final_price=final_price,
-            status='pending'
-        )
-        
-        # Create order items
-        for item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=item['product'],
-                quantity=item['quantity'],
-                price=item['price']
-            )
+        session_key = request.session.session_key
+        try:
+            with transaction.atomic():
+                # Create order
+                order = Order.objects.create(
+                    user=request.user if request.user.is_authenticated else None,
+                    order_number=generate_order_number(),
+                    total_price=total_price,
+                    shipping_cost=shipping_cost,
+                    final_price=final_price,
+                    status='pending'
+                )
+                # Claimed before the real work, so a concurrent submit with
+                # the same key fails here rather than after selling the stock
+                idempotency.record(key, order)
+                
+                # Create order items and take them out of stock
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order=order,
+                        product=item['product'],
+                        quantity=item['quantity'],
+                        price=item['price']
+                    )
+                    for item in cart_items
+                ])
+                inventory.sell(
+                    order,
+                    {item['product'].id: item['quantity'] for item in cart_items},
+                    session_key
+                )
+                
+                if discount_code and not discounts.redeem(discount_code['id'], discount_code['code']):
+                    raise discounts.DiscountUnavailable(discount_code['code'])
+                
+                jobs.enqueue('send_order_confirmation', order_id=order.id)
+        except IntegrityError:
+            order_id = idempotency.order_for(key, request.user)
+            if not order_id:
+                raise
+            metrics.inc('store_checkouts_total', outcome='duplicate')
+            return redirect('order_confirmation', order_id=order_id)
+        except inventory.InsufficientStock as e:
+            metrics.inc('store_checkouts_total', outcome='out_of_stock')
+            product = next(item['product'] for item in cart_items if item['product'].id == e.product_id)
+            messages.error(request, f'موجودی {product.name} کافی نیست.')
+            return redirect('cart')
+        except discounts.DiscountUnavailable:
+            metrics.inc('store_checkouts_total', outcome='discount_unavailable')
+            del request.session['discount_code']
+            messages.error(request, 'این کد تخفیف منقضی شده است.')
+            return redirect('cart')
+        inventory.release(session_key)
+        metrics.inc('store_checkouts_total', outcome='success')
+        metrics.inc('store_checkout_revenue_toman_total', order.final_price)
         
         # Clear cart and discount
         request.session['cart'] = {}
@@ -508,20 +674,49 @@ def checkout(request):
         # Redirect to confirmation page
         return redirect('order_confirmation', order_id=order.id)
         
-    except Exception as e:
+    except Exception:
+        logger.exception('Checkout failed')
+        metrics.inc('store_checkouts_total', outcome='error')
         messages.error(request, 'خطا در ثبت سفارش. لطفاً دوباره تلاش کنید.')
         return redirect('cart')
     
+def _order_and_items(request, order_id):
+    order = Order.objects.filter(id=order_id, user=request.user).first()
+    if order is None:
+        # Old orders are in the archive (see store.archive)
+        order = get_object_or_404(ArchivedOrder, id=order_id, user=request.user)
+        return order, archive.items(order)
+    return order, OrderItem.objects.filter(order=order).select_related('product')
+
+@login_required
 def order_confirmation(request, order_id):
-    try:
-        order = get_object_or_404(Order, id=order_id)
-        order_items = OrderItem.objects.filter(order=order)
-        
-        context = {
-            'order': order,
-            'order_items': order_items,
-        }
-        return render(request, 'store/order_confirmation.html', context)
-    except Exception as e:
-        messages.error(request, 'سفارش یافت نشد.')
-        return redirect('home')
\ No newline at end of file
+    order, order_items = _order_and_items(request, order_id)
+    
+    context = {
+        'order': order,
+        'order_items': order_items,
+    }
+    return render(request, 'store/order_confirmation.html', context)
+
+@login_required
+def order_detail(request, order_id):
+    # Other customers' orders are a 404, not a 403, so ids can't be probed
+    order, order_items = _order_and_items(request, order_id)
+    return render(request, 'store/order_detail.html', {
+        'order': order,
+        'order_items': order_items,
+    })
+
+def metrics_view(request):
+    # Scrapers authenticate with a bearer token, people with a staff login
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.headers.get('Authorization', '')
+    if not (
+        (token and constant_time_compare(authorization, f'Bearer {token}'))
+        or (request.user.is_authenticated and request.user.is_staff)
+    ):
+        raise PermissionDenied
+    return HttpResponse(
+        metrics.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
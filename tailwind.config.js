@@ -0,0 +1,15 @@
+/** Classes are collected from the templates at build time; see store/management/commands/build_assets.py */
+module.exports = {
+  content: [
+    './store/templates/**/*.html',
+    './store/views.py',
+  ],
+  theme: {
+    extend: {
+      fontFamily: {
+        sans: ['Vazirmatn', 'sans-serif'],
+      },
+    },
+  },
+  plugins: [],
+}
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,10 +48,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.RequestTimingMiddleware',
+    'store.middleware.ReplicaPinMiddleware',
+    'store.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add this
+    'store.middleware.PublicPageMiddleware',
+    'store.middleware.EarlyHintsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'store.middleware.ThrottleMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -62,7 +69,7 @@ ROOT_URLCONF = 'tarla.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'store.instrumentation.DjangoTemplates',
         'DIRS': [BASE_DIR / "store" / "templates"],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -92,6 +99,83 @@ DATABASES = {
     }
 }
 
+if os.environ.get('DATABASE_URL'):
+    import dj_database_url
+    DATABASES['default'] = dj_database_url.parse(os.environ['DATABASE_URL'])
+
+# Read replicas, as comma-separated URLs in DATABASE_REPLICA_URLS.  Catalog
+# reads and reporting go to them (see store/routers.py); tests mirror default.
+DATABASE_REPLICAS = []
+for index, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), 1):
+    import dj_database_url
+    DATABASES[f'replica{index}'] = dict(dj_database_url.parse(url.strip()), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+# SQLite profile for running several gunicorn workers on one file.  WAL lets
+# readers work alongside a writer, and BEGIN IMMEDIATE takes the write lock
+# when a transaction starts so busy_timeout can wait for it; a deferred
+# transaction that upgrades from read to write fails at once with "database
+# is locked" instead.  Set SQLITE_PROFILE=0 to use SQLite's defaults.
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', '1') == '1'
+SQLITE_OPTIONS = {
+    'init_command': ';'.join([
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA busy_timeout=20000',
+        # Safe with WAL: a power loss can only lose the last commits
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA mmap_size=268435456',
+        'PRAGMA cache_size=-32000',
+        'PRAGMA temp_store=MEMORY',
+    ]),
+    'transaction_mode': 'IMMEDIATE',
+}
+if SQLITE_PROFILE:
+    for database in DATABASES.values():
+        if database['ENGINE'] == 'django.db.backends.sqlite3':
+            database['OPTIONS'] = {**database.get('OPTIONS', {}), **SQLITE_OPTIONS}
+
+DATABASE_ROUTERS = ['store.routers.ReplicaRouter']
+# After a request writes, the client reads from the primary for this long
+# so it sees its own changes despite replication lag
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+# How long an unreachable replica is skipped before it is tried again
+REPLICA_RETRY_SECONDS = 30
+
+
+# Cache
+# Shared by every gunicorn worker on the host; set REDIS_URL to share it
+# between hosts as well.
+
+if os.environ.get('REDIS_URL'):
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', BASE_DIR / 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+
+# Hot keys are also kept for a few seconds in each worker's memory (L1); a
+# delete of one reaches the other workers' L1 within L1_CHECK_SECONDS.  Hits
+# and misses of both tiers go to Server-Timing and /metrics/.
+CACHES = {
+    'default': {
+        'BACKEND': 'store.cache.TwoTierCache',
+        'OPTIONS': {
+            'CACHE': SHARED_CACHE,
+            'L1_KEY_PREFIXES': ['catalog:', 'discount:', 'settings:'],
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 10,
+            'L1_CHECK_SECONDS': 1,
+        },
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -160,8 +244,106 @@ LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
-# Whitenoise compression
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Whitenoise: content-hashed, pre-compressed static files.  The CSS bundle is
+# built first with "python manage.py build_assets" (see build.sh).
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
+# Files added since the last collectstatic are served unhashed instead of
+# failing the page
+WHITENOISE_MANIFEST_STRICT = False
+
+# Throttling: requests per URL name as "<requests>/<s|m|h|d>", counted per
+# client IP and per session cookie in fixed windows of that period
+THROTTLE_ENABLED = os.environ.get('THROTTLE_ENABLED', '1') == '1'
+THROTTLE_RATES = {
+    'login': '5/m',
+    'register': '3/m',
+    'apply_discount': '10/m',
+    'add_to_cart': '30/m',
+}
+# Failed logins per username and client IP, charged only when the password
+# is wrong, so nobody can lock an account out for other addresses
+THROTTLE_LOGIN_FAILURES = '10/h'
+# Only enable behind a proxy that sets X-Forwarded-For itself
+THROTTLE_TRUST_X_FORWARDED_FOR = False
+
+# Request timing: Server-Timing header for staff and a log of slow requests
+SLOW_REQUEST_THRESHOLD_MS = int(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 500))
+SERVER_TIMING_PUBLIC = os.environ.get('SERVER_TIMING_PUBLIC') == '1'
+
+# Response compression (Brotli when the brotli package is installed, else
+# gzip); compressed token-free pages are cached by content hash
+COMPRESSION_MIN_SIZE = 512
+COMPRESSION_CACHE_SECONDS = 600
+
+# Pages rendered without the session for visitors with no session cookie,
+# and cacheable by a CDN for PUBLIC_PAGE_S_MAXAGE (browsers: MAX_AGE).  The
+# catalog they show can be that much older than the snapshot.
+PUBLIC_PAGES = ['home', 'products', 'product_detail', 'about']
+PUBLIC_PAGE_MAX_AGE = 60
+PUBLIC_PAGE_S_MAXAGE = 300
+
+# Pages whose stylesheets, fonts and main product image are announced with
+# "103 Early Hints" and a Link header before the view runs (store.preload)
+EARLY_HINTS_PAGES = [
+    'home', 'products', 'product_detail', 'about', 'contact', 'cart', 'profile',
+    'order_confirmation', 'order_detail', 'login', 'register',
+]
+
+# Metrics: per-worker files aggregated by /metrics/ (see gunicorn.conf.py).
+# Scrapers send "Authorization: Bearer $METRICS_TOKEN"; staff can browse it.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'tarla-metrics'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Catalog snapshot: how often workers check the shared version, and how old
+# their copy (and the stock left it shows) may get before a reload from a
+# replica regardless; changes bump the version, so this is only a safety net
+CATALOG_VERSION_CHECK_SECONDS = 1
+CATALOG_MAX_AGE_SECONDS = 3600
+
+# Product view/add-to-cart counters: each gunicorn worker writes its buffer
+# this often, so a crashed worker loses at most this many seconds of counts
+COUNTER_FLUSH_SECONDS = 5
+
+# Best-selling sort: "manage.py refresh_popularity" (run it from cron, e.g.
+# hourly) counts sales from this many days back, halving their weight every
+# POPULARITY_HALF_LIFE_DAYS
+POPULARITY_WINDOW_DAYS = 90
+POPULARITY_HALF_LIFE_DAYS = 14
+# What a product view and an add-to-cart count for, next to a unit sold
+POPULARITY_VIEW_WEIGHT = 0.02
+POPULARITY_CART_ADD_WEIGHT = 0.2
+
+# Orders: "manage.py archive_orders" (e.g. nightly from cron) moves delivered
+# and cancelled orders placed more than this many days ago to ArchivedOrder;
+# "manage.py restore_orders" brings them back.  Keep it longer than
+# POPULARITY_WINDOW_DAYS, which is counted from live orders only
+ORDER_ARCHIVE_AFTER_DAYS = 180
+
+# Inventory: how long a cart holds reserved stock
+STOCK_RESERVATION_MINUTES = 15
+
+# Checkout: a repeated submit of the same cart page within this many hours
+# returns the first order instead of placing another ("manage.py
+# purge_idempotency_keys", e.g. daily from cron, deletes older keys)
+IDEMPOTENCY_KEY_HOURS = 24
+
+# Background jobs: run with "python manage.py run_worker" next to gunicorn
+JOB_POLL_SECONDS = 2
+JOB_TIMEOUT_SECONDS = 600  # RUNNING jobs older than this are assumed dead
+JOB_REQUEUE_SECONDS = 60  # How often a worker looks for them
+JOB_KEEP_DAYS = 7
+
+# Email, sent from background jobs; prints to the console unless configured
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '1') == '1'
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'تارلا ارگانیک <no-reply@tarla.ir>')
 
 # File upload security
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
@@ -181,6 +363,11 @@ LOGGING = {
             'level': 'DEBUG',
             'class': 'logging.StreamHandler',
         },
+        'performance': {
+            'level': 'WARNING',
+            'class': 'logging.FileHandler',
+            'filename': BASE_DIR / 'django_performance.log',
+        },
     },
     'loggers': {
         'django': {
@@ -188,6 +375,16 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'store': {
+            'handlers': ['file', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'store.performance': {
+            'handlers': ['performance', 'console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
 